@@ -0,0 +1,55 @@
+-- Inventory Tombstones feed (soft deletes)
+-- Run this in Supabase SQL Editor
+--
+-- The web app soft-deletes an item by renaming it to 'DELETED'. Every time that
+-- happens a tombstone row is appended here, so store agents can consume deletes
+-- incrementally (id > last seen id) instead of re-scanning inventory each cycle.
+
+CREATE TABLE IF NOT EXISTS inventory_tombstones (
+    id BIGSERIAL PRIMARY KEY,
+    item_num VARCHAR(20) NOT NULL,
+    store_id VARCHAR(10) NOT NULL REFERENCES stores(store_id),
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Agents read: store_id = X AND id > watermark ORDER BY id
+CREATE INDEX IF NOT EXISTS idx_inventory_tombstones_store_id
+ON inventory_tombstones(store_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_inventory_tombstones_deleted_at
+ON inventory_tombstones(deleted_at);
+
+-- Append a tombstone whenever an item is soft-deleted
+CREATE OR REPLACE FUNCTION record_inventory_tombstone()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.item_name = 'DELETED' AND (TG_OP = 'INSERT' OR OLD.item_name IS DISTINCT FROM 'DELETED') THEN
+        INSERT INTO inventory_tombstones (item_num, store_id)
+        VALUES (NEW.item_num, NEW.store_id);
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS inventory_soft_delete_tombstone ON inventory;
+CREATE TRIGGER inventory_soft_delete_tombstone
+    AFTER INSERT OR UPDATE OF item_name ON inventory
+    FOR EACH ROW
+    EXECUTE FUNCTION record_inventory_tombstone();
+
+-- Backfill items that were already soft-deleted before this feed existed
+INSERT INTO inventory_tombstones (item_num, store_id)
+SELECT i.item_num, i.store_id
+FROM inventory i
+WHERE i.item_name = 'DELETED'
+  AND NOT EXISTS (
+      SELECT 1 FROM inventory_tombstones t
+      WHERE t.item_num = i.item_num AND t.store_id = i.store_id
+  );
+
+-- Enable RLS
+ALTER TABLE inventory_tombstones ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Allow all access to inventory_tombstones" ON inventory_tombstones FOR ALL USING (true);
+
+-- Optional housekeeping: tombstones older than 30 days have long been consumed
+-- DELETE FROM inventory_tombstones WHERE deleted_at < NOW() - INTERVAL '30 days';
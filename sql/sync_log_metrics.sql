@@ -0,0 +1,55 @@
+-- Sync log metrics (per-phase breakdown of every sync cycle)
+-- Run this in Supabase SQL Editor
+--
+-- Agents used to write one sync_log row per cycle with started_at = completed_at
+-- and a single records_synced count. They now record the real cycle start, the
+-- wall time, and a per-phase breakdown as JSON:
+--
+--   phases = {
+--     "transfers":      {"seconds": 1.42, "rows_read": 3, "rows_written": 3, "batches": 2,
+--                        "http_requests": 6, "bytes_sent": 2048, "bytes_received": 8192,
+--                        "sql_statements": 9, "errors": 0, "http_errors": 0},
+--     "sync_inventory": {...},
+--     ...
+--   }
+--
+-- Every key is optional (a phase only reports what it did). The totals columns
+-- are filled from the same data so the dashboard can sort / filter without
+-- unpacking JSON.
+
+ALTER TABLE sync_log ADD COLUMN IF NOT EXISTS duration_ms INTEGER;
+ALTER TABLE sync_log ADD COLUMN IF NOT EXISTS bytes_sent BIGINT;
+ALTER TABLE sync_log ADD COLUMN IF NOT EXISTS bytes_received BIGINT;
+ALTER TABLE sync_log ADD COLUMN IF NOT EXISTS errors INTEGER;
+ALTER TABLE sync_log ADD COLUMN IF NOT EXISTS phases JSONB NOT NULL DEFAULT '{}'::jsonb;
+
+-- "Last N cycles of store X", regardless of status
+CREATE INDEX IF NOT EXISTS idx_sync_log_store_started
+ON sync_log(store_id, started_at DESC);
+
+-- One row per (cycle, phase) - e.g. the slowest phases across the fleet today:
+--   SELECT store_id, phase, avg(seconds), max(seconds), sum(errors)
+--   FROM sync_log_phases WHERE started_at > NOW() - INTERVAL '1 day'
+--   GROUP BY store_id, phase ORDER BY max(seconds) DESC;
+CREATE OR REPLACE VIEW sync_log_phases AS
+SELECT
+    l.id AS sync_log_id,
+    l.store_id,
+    l.sync_type,
+    l.status,
+    l.started_at,
+    p.key AS phase,
+    (p.value->>'seconds')::NUMERIC AS seconds,
+    COALESCE((p.value->>'rows_read')::BIGINT, 0) AS rows_read,
+    COALESCE((p.value->>'rows_written')::BIGINT, 0) AS rows_written,
+    COALESCE((p.value->>'batches')::BIGINT, 0) AS batches,
+    COALESCE((p.value->>'http_requests')::BIGINT, 0) AS http_requests,
+    COALESCE((p.value->>'bytes_sent')::BIGINT, 0) AS bytes_sent,
+    COALESCE((p.value->>'bytes_received')::BIGINT, 0) AS bytes_received,
+    COALESCE((p.value->>'sql_statements')::BIGINT, 0) AS sql_statements,
+    COALESCE((p.value->>'errors')::BIGINT, 0) AS errors
+FROM sync_log l
+CROSS JOIN LATERAL jsonb_each(l.phases) AS p;
+
+-- Optional housekeeping: per-cycle rows add up quickly (one per store every 30s)
+-- DELETE FROM sync_log WHERE started_at < NOW() - INTERVAL '30 days';
@@ -0,0 +1,117 @@
+-- Transfer claims (server-side transfer pickup)
+-- Run this in Supabase SQL Editor
+--
+-- Agents call claim_transfers() instead of polling transfers by status. The
+-- function locks the candidate rows (FOR UPDATE SKIP LOCKED), records a claim
+-- per (transfer, direction) and returns the transfers WITH their items, so
+-- pickup is a single round trip and two agents can never pick up the same
+-- transfer for the same side at the same time.
+--
+-- A claim is a lease: if the agent dies before it finishes, the transfer is
+-- handed out again once p_lease_seconds have passed. Agents keep a local
+-- ledger, so a re-issued transfer is never applied twice.
+
+CREATE TABLE IF NOT EXISTS transfer_claims (
+    transfer_id UUID NOT NULL REFERENCES transfers(id) ON DELETE CASCADE,
+    direction VARCHAR(3) NOT NULL CHECK (direction IN ('in', 'out')),
+    store_id VARCHAR(10) NOT NULL REFERENCES stores(store_id),
+    agent_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    claimed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (transfer_id, direction)
+);
+
+CREATE INDEX IF NOT EXISTS idx_transfer_claims_store ON transfer_claims(store_id, claimed_at);
+
+-- Candidate lookups: outgoing = from_store_id + status, incoming = to_store_id + status
+CREATE INDEX IF NOT EXISTS idx_transfers_from_store_status ON transfers(from_store_id, status) WHERE shipped_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_transfers_to_store_status ON transfers(to_store_id, status);
+
+-- Claim up to p_limit transfers for one side of a store.
+--   'out': approved/completed/received transfers FROM the store not yet shipped (shipped_at IS NULL)
+--   'in' : completed transfers TO the store
+-- Returns a JSON array of transfer rows, each with an "items" array of its transfer_items.
+CREATE OR REPLACE FUNCTION claim_transfers(
+    p_store_id VARCHAR,
+    p_direction TEXT,
+    p_agent_id TEXT DEFAULT NULL,
+    p_limit INTEGER DEFAULT 50,
+    p_lease_seconds INTEGER DEFAULT 300
+)
+RETURNS JSONB AS $$
+DECLARE
+    result JSONB;
+BEGIN
+    IF p_direction NOT IN ('in', 'out') THEN
+        RAISE EXCEPTION 'claim_transfers: direction must be ''in'' or ''out'', got %', p_direction;
+    END IF;
+
+    WITH candidates AS (
+        SELECT t.id, t.updated_at
+        FROM transfers t
+        LEFT JOIN transfer_claims c
+               ON c.transfer_id = t.id AND c.direction = p_direction
+        WHERE (
+                (p_direction = 'out'
+                 AND t.from_store_id = p_store_id
+                 AND t.status IN ('approved', 'completed', 'received')
+                 AND t.shipped_at IS NULL)
+             OR (p_direction = 'in'
+                 AND t.to_store_id = p_store_id
+                 AND t.status = 'completed')
+              )
+          AND (c.transfer_id IS NULL
+               OR c.claimed_at < NOW() - make_interval(secs => p_lease_seconds))
+        ORDER BY t.updated_at
+        LIMIT p_limit
+        FOR UPDATE OF t SKIP LOCKED
+    ),
+    claimed AS (
+        INSERT INTO transfer_claims (transfer_id, direction, store_id, agent_id, claimed_at)
+        SELECT id, p_direction, p_store_id, p_agent_id, NOW() FROM candidates
+        ON CONFLICT (transfer_id, direction) DO UPDATE
+            SET agent_id = EXCLUDED.agent_id,
+                claimed_at = EXCLUDED.claimed_at,
+                attempts = transfer_claims.attempts + 1
+        RETURNING transfer_id
+    )
+    SELECT COALESCE(jsonb_agg(
+               to_jsonb(t) || jsonb_build_object('items', COALESCE((
+                   SELECT jsonb_agg(to_jsonb(ti))
+                   FROM transfer_items ti
+                   WHERE ti.transfer_id = t.id
+               ), '[]'::jsonb))
+               ORDER BY t.updated_at
+           ), '[]'::jsonb)
+    INTO result
+    FROM transfers t
+    JOIN claimed cl ON cl.transfer_id = t.id;
+
+    RETURN result;
+END;
+$$ language 'plpgsql';
+
+-- Give claims back early (e.g. a transfer that failed locally) so the next cycle retries it
+-- without waiting for the lease to run out.
+CREATE OR REPLACE FUNCTION release_transfer_claims(
+    p_transfer_ids UUID[],
+    p_direction TEXT
+)
+RETURNS INTEGER AS $$
+DECLARE
+    released INTEGER;
+BEGIN
+    DELETE FROM transfer_claims
+    WHERE transfer_id = ANY(p_transfer_ids) AND direction = p_direction;
+    GET DIAGNOSTICS released = ROW_COUNT;
+    RETURN released;
+END;
+$$ language 'plpgsql';
+
+-- Enable RLS
+ALTER TABLE transfer_claims ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Allow all access to transfer_claims" ON transfer_claims FOR ALL USING (true);
+
+-- Optional housekeeping: claims for finished transfers are no longer needed
+-- DELETE FROM transfer_claims c USING transfers t
+-- WHERE t.id = c.transfer_id AND t.status IN ('received', 'cancelled') AND c.claimed_at < NOW() - INTERVAL '7 days';
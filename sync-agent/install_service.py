@@ -67,6 +67,8 @@ class SyncAgentService(win32serviceutil.ServiceFramework):
                 # Check if stop requested
                 if win32event.WaitForSingleObject(self.hWaitStop, agent.sync_interval * 1000) == win32event.WAIT_OBJECT_0:
                     break
+            
+            agent.close()
                     
         except Exception as e:
             servicemanager.LogErrorMsg(f"Fatal error: {str(e)}")
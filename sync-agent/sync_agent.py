@@ -10,8 +10,11 @@ import logging
 import os
 import sys
 import json
+import socket
+import threading
 import httpx
-from datetime import datetime, timezone
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
 from configparser import ConfigParser
 
 # Configure logging - log to file next to exe
@@ -30,6 +33,71 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Transfers are re-read this far behind the newest updated_at seen, to cover rows committed late.
+# Re-reading is harmless: the transfer ledger makes applying a transfer idempotent.
+TRANSFER_WATERMARK_OVERLAP_SECONDS = 300
+SQL_IN_BATCH = 900  # Max parameters per IN (...) list (SQL Server caps a statement at 2100)
+
+
+def canonical_item_num(value):
+    """The one place item numbers are cleaned up: trimmed, as SQL Server compares them"""
+    return str(value).strip() if value is not None else ''
+
+
+def item_key(value):
+    """Lookup key for an item number - SQL Server's default collation ignores case and trailing spaces"""
+    return canonical_item_num(value).casefold()
+
+
+def in_filter(values):
+    """PostgREST in.(...) filter with every value quoted"""
+    quoted = ','.join('"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values)
+    return f'in.({quoted})'
+
+
+class CycleStats:
+    """Per-phase breakdown of one sync cycle (time, rows, batches, HTTP requests / bytes, errors) for sync_log"""
+    
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.monotonic()
+        self.phases = {}  # phase name -> {'seconds': s, field: n}
+        self.current = None  # Phase everything is attributed to right now
+    
+    def add(self, field: str, n=1):
+        stats = self.phases.setdefault(self.current or 'other', {'seconds': 0.0})
+        stats[field] = stats.get(field, 0) + n
+    
+    @contextmanager
+    def phase(self, name: str):
+        previous, self.current = self.current, name
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            stats = self.phases.setdefault(name, {'seconds': 0.0})
+            stats['seconds'] = round(stats['seconds'] + time.monotonic() - started, 3)
+            self.current = previous
+    
+    def total(self, field: str):
+        return sum(stats.get(field, 0) for stats in self.phases.values())
+    
+    def duration_ms(self):
+        return int((time.monotonic() - self.started) * 1000)
+
+
+class ErrorCounter(logging.Handler):
+    """Counts ERROR log records against the running phase of the agent's current cycle.
+    Only records from the thread running that cycle count - other agents in the process log to the same logger."""
+    
+    def __init__(self, agent):
+        super().__init__(level=logging.ERROR)
+        self.agent = agent
+    
+    def emit(self, record):
+        if self.agent.cycle is not None and record.thread == self.agent.cycle_thread:
+            self.agent.cycle.add('errors')
+
 
 class SupabaseClient:
     """Lightweight Supabase client using httpx"""
@@ -43,6 +111,24 @@ class SupabaseClient:
             'Content-Type': 'application/json',
             'Prefer': 'return=minimal'
         }
+        self.stats = None  # CycleStats of the running cycle - every request is counted against it
+        self.missing_functions = set()  # RPCs the project answered "not found" for (not deployed)
+    
+    def client(self, timeout: float):
+        """httpx client that counts requests and bytes into self.stats"""
+        return httpx.Client(timeout=timeout, event_hooks={'response': [self.record_response]})
+    
+    def record_response(self, response):
+        if self.stats is None:
+            return
+        response.read()
+        self.stats.add('http_requests')
+        self.stats.add('bytes_sent', len(response.request.content or b''))
+        self.stats.add('bytes_received', len(response.content or b''))
+        if response.status_code >= 400:
+            self.stats.add('http_errors')
+        elif response.request.method in ('POST', 'PATCH', 'DELETE') and '/rpc/' not in response.request.url.path:
+            self.stats.add('batches')  # One write round trip
     
     def upsert(self, table: str, data, on_conflict: str = None):
         """Insert or update a record or batch of records"""
@@ -58,7 +144,7 @@ class SupabaseClient:
         payload = data if isinstance(data, list) else [data]
         
         try:
-            with httpx.Client(timeout=60) as client:
+            with self.client(60) as client:
                 response = client.post(url, json=payload, headers=headers)
                 response.raise_for_status()
                 return len(payload) if isinstance(data, list) else True
@@ -82,7 +168,7 @@ class SupabaseClient:
         headers['Prefer'] = 'return=representation'
         
         try:
-            with httpx.Client(timeout=30) as client:
+            with self.client(30) as client:
                 response = client.get(url, params=params, headers=headers)
                 response.raise_for_status()
                 return response.json()
@@ -90,20 +176,53 @@ class SupabaseClient:
             logger.error(f"Select error: {e}")
             return []
     
-    def select_transfer_items(self, transfer_id: str):
-        """Get items for a specific transfer"""
-        url = f"{self.url}/rest/v1/transfer_items"
-        params = {'transfer_id': f"eq.{transfer_id}"}
+    def select_where(self, table: str, params: dict, select_fields: str = '*'):
+        """Select records with raw PostgREST filters, e.g. {'status': 'in.(a,b)', 'order': 'updated_at.asc'}"""
+        url = f"{self.url}/rest/v1/{table}"
+        query = {'select': select_fields}
+        query.update(params)
+        
+        try:
+            with self.client(30) as client:
+                response = client.get(url, params=query, headers=self.headers)
+                response.raise_for_status()
+                return response.json()
+        except Exception as e:
+            logger.error(f"Select error: {e}")
+            return None
+    
+    def select_in(self, table: str, column: str, values, select_fields: str = '*'):
+        """Select records whose column is in a list of values (one request)"""
+        if not values:
+            return []
+        url = f"{self.url}/rest/v1/{table}"
+        params = {'select': select_fields, column: in_filter(values)}
         
         try:
-            with httpx.Client(timeout=30) as client:
+            with self.client(30) as client:
                 response = client.get(url, params=params, headers=self.headers)
                 response.raise_for_status()
                 return response.json()
         except Exception as e:
-            logger.error(f"Select transfer items error: {e}")
+            logger.error(f"Select in error: {e}")
             return []
     
+    def update_in(self, table: str, data: dict, column: str, values):
+        """Apply the same update to every record whose column is in a list of values (one request)"""
+        if not values:
+            return True
+        url = f"{self.url}/rest/v1/{table}"
+        params = {column: in_filter(values)}
+        
+        try:
+            with self.client(30) as client:
+                response = client.patch(url, json=data, params=params, headers=self.headers)
+                response.raise_for_status()
+                return True
+        except Exception as e:
+            logger.error(f"Update in error: {e}")
+            return False
+    
     def update(self, table: str, data: dict, filters: dict):
         """Update records in a table"""
         url = f"{self.url}/rest/v1/{table}"
@@ -112,7 +231,7 @@ class SupabaseClient:
             params[key] = f"eq.{value}"
         
         try:
-            with httpx.Client(timeout=30) as client:
+            with self.client(30) as client:
                 response = client.patch(url, json=data, params=params, headers=self.headers)
                 response.raise_for_status()
                 return True
@@ -120,11 +239,45 @@ class SupabaseClient:
             logger.error(f"Update error: {e}")
             return False
     
-    def insert(self, table: str, data: dict):
-        """Insert a record"""
+    def rpc(self, function: str, params: dict):
+        """Call a Postgres function (POST /rest/v1/rpc/<function>). Returns its JSON result, or None on error"""
+        url = f"{self.url}/rest/v1/rpc/{function}"
+        try:
+            with self.client(30) as client:
+                response = client.post(url, json=params, headers=self.headers)
+                response.raise_for_status()
+                return response.json() if response.content else True
+        except Exception as e:
+            response = getattr(e, 'response', None)
+            if response is not None and (response.status_code == 404 or 'PGRST202' in response.text):
+                self.missing_functions.add(function)
+            logger.error(f"RPC {function} error: {e}")
+            return None
+    
+    def claim_transfers(self, store_id: str, direction: str, agent_id: str = None, limit: int = 50):
+        """Atomically claim pending transfers for one side of a store (see sql/transfer_claims.sql).
+        Returns the transfers with their lines under 'items', or None if the RPC is unavailable."""
+        return self.rpc('claim_transfers', {
+            'p_store_id': store_id,
+            'p_direction': direction,
+            'p_agent_id': agent_id,
+            'p_limit': limit
+        })
+    
+    def release_transfer_claims(self, transfer_ids, direction: str):
+        """Hand claims back early so the next cycle retries those transfers"""
+        if not transfer_ids:
+            return True
+        return self.rpc('release_transfer_claims', {
+            'p_transfer_ids': [str(i) for i in transfer_ids],
+            'p_direction': direction
+        }) is not None
+    
+    def insert(self, table: str, data):
+        """Insert a record or batch of records"""
         url = f"{self.url}/rest/v1/{table}"
         try:
-            with httpx.Client(timeout=30) as client:
+            with self.client(30) as client:
                 response = client.post(url, json=data, headers=self.headers)
                 response.raise_for_status()
                 return True
@@ -164,6 +317,14 @@ class SyncAgent:
         
         # Sync settings
         self.sync_interval = self.config.getint('sync', 'interval_seconds', fallback=30)
+        self.transfer_claim_limit = self.config.getint('sync', 'transfer_claim_limit', fallback=50)
+        self.agent_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.claim_rpc_available = True  # Cleared if claim_transfers isn't deployed; polling is used instead
+        self.local_item_keys = None  # item_key -> local ItemNum spelling, loaded on first use
+        self.cycle = None  # CycleStats of the running sync cycle
+        self.cycle_thread = None  # Thread running it - the only one whose errors it counts
+        self.error_counter = ErrorCounter(self)
+        logger.addHandler(self.error_counter)
         
         # Tracking file for cloud-to-local sync
         if getattr(sys, 'frozen', False):
@@ -321,25 +482,36 @@ class SyncAgent:
         logger.info(f"Synced {synced_count}/{len(inventory)} inventory items to cloud")
         return synced_count
     
-    def get_last_cloud_sync_timestamp(self):
-        """Get the last successful cloud-to-local sync timestamp from tracking file"""
+    def load_state(self):
+        """Read the whole tracking file (last_cloud_sync, transfer watermarks, ...)"""
         try:
             if os.path.exists(self.sync_state_file):
                 with open(self.sync_state_file, 'r') as f:
-                    state = json.load(f)
-                    return state.get('last_cloud_sync')
+                    return json.load(f)
         except Exception as e:
             logger.warning(f"Could not read sync state file: {e}")
-        return None
+        return {}
     
-    def save_last_cloud_sync_timestamp(self, timestamp):
-        """Save the last successful cloud-to-local sync timestamp"""
+    def save_state(self, **updates):
+        """Merge values into the tracking file (write to a temp file, then swap it in)"""
         try:
-            with open(self.sync_state_file, 'w') as f:
-                json.dump({'last_cloud_sync': timestamp}, f)
+            state = self.load_state()
+            state.update(updates)
+            tmp_path = self.sync_state_file + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.sync_state_file)
         except Exception as e:
             logger.error(f"Could not save sync state: {e}")
     
+    def get_last_cloud_sync_timestamp(self):
+        """Get the last successful cloud-to-local sync timestamp from tracking file"""
+        return self.load_state().get('last_cloud_sync')
+    
+    def save_last_cloud_sync_timestamp(self, timestamp):
+        """Save the last successful cloud-to-local sync timestamp"""
+        self.save_state(last_cloud_sync=timestamp)
+    
     def insert_item_to_local(self, item):
         """Insert a new item into local SQL Server database"""
         try:
@@ -492,21 +664,18 @@ class SyncAgent:
             # Get list of existing local item numbers
             conn = self.get_sql_connection()
             cursor = conn.cursor()
-            cursor.execute(
-                "SELECT ItemNum FROM Inventory WHERE Store_ID = ?",
-                (self.local_store_id,)
-            )
-            local_items = {row[0].strip() for row in cursor.fetchall()}
+            self.load_local_item_keys(cursor)
             cursor.close()
             conn.close()
             
             # Process each cloud item
             for item in cloud_items:
-                item_num = str(item['item_num']).strip()
+                item_num = canonical_item_num(item['item_num'])
                 
-                if item_num not in local_items:
+                if item_key(item_num) not in self.local_item_keys:
                     # New item - insert to local
                     if self.insert_item_to_local(item):
+                        self.local_item_keys[item_key(item_num)] = item_num
                         synced_count += 1
                         new_items += 1
                 else:
@@ -526,145 +695,309 @@ class SyncAgent:
             logger.error(f"Error syncing items from cloud: {e}")
             return 0
     
-    def update_local_stock(self, item_num: str, quantity_change: float, operation: str = 'add', item_name: str = None):
-        """Update stock in local SQL Server and return old/new stock values via Store_ID."""
+    def adjust_local_stock(self, cursor, deltas: dict):
+        """Apply In_Stock = In_Stock + delta for many items in ONE statement.
+
+        deltas: {item_num: signed quantity}. Returns {item_num: {'old_stock', 'new_stock', 'item_name'}}
+        for the rows that exist locally; missing items are simply absent from the result.
+        OUTPUT goes INTO a table variable because Inventory may carry an update trigger.
+        """
+        if not deltas:
+            return {}
+        
+        values = ', '.join(['(?, ?)'] * len(deltas))
+        params = []
+        for item_num, delta in deltas.items():
+            params += [item_num, float(delta)]
+        
+        where_clause = ""
+        if hasattr(self, 'local_store_id') and self.local_store_id:
+            where_clause = "WHERE i.Store_ID = ?"
+            params.append(self.local_store_id)
+        
+        cursor.execute(f"""
+            SET NOCOUNT ON;
+            DECLARE @changes TABLE (ItemNum NVARCHAR(50), ItemName NVARCHAR(100), OldStock FLOAT, NewStock FLOAT);
+            UPDATE i SET In_Stock = ISNULL(i.In_Stock, 0) + v.Delta
+            OUTPUT inserted.ItemNum, inserted.ItemName, deleted.In_Stock, inserted.In_Stock INTO @changes
+            FROM Inventory i
+            INNER JOIN (VALUES {values}) AS v (ItemNum, Delta) ON i.ItemNum = v.ItemNum
+            {where_clause};
+            SELECT ItemNum, ItemName, OldStock, NewStock FROM @changes;
+        """, params)
+        
+        results = {}
+        for row in cursor.fetchall():
+            results[canonical_item_num(row[0])] = {
+                'old_stock': float(row[2] or 0),
+                'new_stock': float(row[3] or 0),
+                'item_name': row[1]
+            }
+        return results
+    
+    def insert_stock_item(self, cursor, item_num: str, item_name: str, quantity: float):
+        """Create a local item that arrived by transfer (no commit). Returns rows inserted."""
+        store_id_to_use = self.local_store_id if hasattr(self, 'local_store_id') and self.local_store_id else '1001'
+        
+        # Insert item record
+        insert_query = """
+            INSERT INTO Inventory (
+                ItemNum, ItemName, Store_ID, Cost, Price, Retail_Price, In_Stock,
+                Reorder_Level, Reorder_Quantity,
+                Tax_1, Tax_2, Tax_3,
+                Dept_ID,
+                IsKit, IsModifier, Inv_Num_Barcode_Labels, Use_Serial_Numbers,
+                Num_Bonus_Points, IsRental, Use_Bulk_Pricing, Print_Ticket,
+                Print_Voucher, Num_Days_Valid, IsMatrixItem, AutoWeigh, Dirty,
+                FoodStampable, Exclude_Acct_Limit, Check_ID, Prompt_Price,
+                Prompt_Quantity, Allow_BuyBack, Special_Permission, Prompt_Description,
+                Check_ID2, Count_This_Item, Print_On_Receipt, Transfer_Markup_Enabled,
+                As_Is,
+                Import_Markup, PricePerMeasure,
+                AvailableOnline, DoughnutTax,
+                RowID,
+                DisableInventoryUpload, InvoiceLimitQty, ItemCategory, IsRestrictedPerInvoice
+            )
+            VALUES (
+                ?, ?, ?, 0, 0, 0, ?,
+                0, 0,
+                1, 0, 0,
+                'NONE',
+                0, 0, 0, 0,
+                0, 0, 0, 0,
+                0, 0, 0, 1, 1,
+                0, 0, 0, 0,
+                0, 0, 0, 0,
+                0, 1, 1, 0,
+                0,
+                0, 0,
+                0, 0,
+                NEWID(),
+                0, 0, 0, 0
+            )
+        """
+        cursor.execute(insert_query, (item_num, item_name, store_id_to_use, quantity))
+        logger.info(f"Inserted new item {item_num} with StoreID {store_id_to_use}, Stock {quantity}")
+        return cursor.rowcount
+    
+    def ensure_transfer_ledger(self, cursor):
+        """Create the local transfer ledger table if missing.
+        
+        One row per (transfer, direction, item) with the stock delta applied. Rows are written in the
+        SAME transaction as the stock change, so a transfer can never be applied twice - even after a crash.
+        """
+        cursor.execute("""
+            IF OBJECT_ID('dbo.Sync_Transfer_Ledger', 'U') IS NULL
+            CREATE TABLE dbo.Sync_Transfer_Ledger (
+                Transfer_ID NVARCHAR(64) NOT NULL,
+                Direction CHAR(3) NOT NULL,
+                Item_Num NVARCHAR(50) NOT NULL,
+                Quantity_Change FLOAT NOT NULL,
+                Applied_At DATETIME NOT NULL DEFAULT GETDATE(),
+                PRIMARY KEY (Transfer_ID, Direction, Item_Num)
+            )
+        """)
+    
+    def fetch_ledger_transfer_ids(self, cursor, transfer_ids, direction: str):
+        """Return which of the given transfers were already applied locally"""
+        done = set()
+        ids = [str(i) for i in transfer_ids]
+        for i in range(0, len(ids), SQL_IN_BATCH):
+            batch = ids[i:i + SQL_IN_BATCH]
+            cursor.execute(
+                f"SELECT DISTINCT Transfer_ID FROM Sync_Transfer_Ledger WHERE Direction = ? AND Transfer_ID IN ({', '.join(['?'] * len(batch))})",
+                [direction] + batch
+            )
+            done.update(str(row[0]) for row in cursor.fetchall())
+        return done
+    
+    def advance_transfer_watermark(self, key: str, transfers, done_ids):
+        """Move a transfer watermark past everything fully handled, but never past a transfer still pending"""
+        pending = [t['updated_at'] for t in transfers if t['id'] not in done_ids and t.get('updated_at')]
+        seen = [t['updated_at'] for t in transfers if t.get('updated_at')]
+        if not seen:
+            return
+        mark = min(pending) if pending else max(seen)
+        try:
+            mark_dt = datetime.fromisoformat(mark.replace('Z', '+00:00'))
+        except ValueError:
+            return
+        self.save_state(**{key: (mark_dt - timedelta(seconds=TRANSFER_WATERMARK_OVERLAP_SECONDS)).isoformat()})
+    
+    def fetch_pending_transfers(self, direction: str, poll_params: dict, watermark_key: str):
+        """Pick up this store's pending transfers for one direction.
+        
+        Uses the claim_transfers RPC (one round trip, transfers come with their items and
+        are locked against other agents). Falls back to a watermark poll only if it isn't deployed;
+        any other failure skips the direction for this cycle.
+        Returns (transfers, claimed).
+        """
+        if self.claim_rpc_available:
+            transfers = self.supabase.claim_transfers(
+                self.cloud_store_id, direction, self.agent_id, self.transfer_claim_limit
+            )
+            if transfers is not None:
+                return transfers, True
+            if 'claim_transfers' not in self.supabase.missing_functions:
+                # Transient (5xx, 429, timeout) - polling would reopen the double-claim race, so claim again next cycle
+                logger.warning(f"claim_transfers failed - skipping {direction} transfers this cycle")
+                return [], True
+            logger.warning("claim_transfers RPC unavailable - falling back to polling (run sql/transfer_claims.sql)")
+            self.claim_rpc_available = False
+        
+        params = dict(poll_params, order='updated_at.asc')
+        watermark = self.load_state().get(watermark_key)
+        if watermark:
+            params['updated_at'] = f'gte.{watermark}'
+        return self.supabase.select_where('transfers', params) or [], False
+    
+    def finish_transfer_pickup(self, direction: str, transfers, done, claimed: bool, watermark_key: str):
+        """Release claims on transfers that didn't finish, or advance the poll watermark"""
+        if claimed:
+            self.supabase.release_transfer_claims([t['id'] for t in transfers if t['id'] not in done], direction)
+        else:
+            self.advance_transfer_watermark(watermark_key, transfers, done)
+    
+    def load_local_item_keys(self, cursor):
+        """(Re)load the cached set of local item numbers used to validate transfer lines"""
+        cursor.execute("SELECT ItemNum FROM Inventory WHERE Store_ID = ?", (self.local_store_id,))
+        self.local_item_keys = {item_key(row[0]): canonical_item_num(row[0]) for row in cursor.fetchall()}
+        return self.local_item_keys
+    
+    def normalize_transfer_lines(self, items, direction: str):
+        """Turn raw transfer_items rows into one signed delta per local item.
+        
+        Item numbers are canonicalized once and mapped to their LOCAL spelling, quantities for
+        repeated lines are summed, and lines that net to zero are dropped.
+        Returns (deltas, names, missing) where missing lists items not in the cached local key set.
+        Raises ValueError for a line without an item number or with a non-numeric quantity.
+        """
+        deltas = {}
+        names = {}
+        for item in items:
+            item_num = canonical_item_num(item.get('item_num'))
+            if not item_num:
+                raise ValueError("transfer line without item_num")
+            try:
+                quantity = float(item['quantity'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"bad quantity {item.get('quantity')!r} for item {item_num}")
+            
+            item_num = self.local_item_keys.get(item_key(item_num), item_num)
+            deltas[item_num] = deltas.get(item_num, 0.0) + (quantity if direction == 'in' else -quantity)
+            names.setdefault(item_num, item.get('item_name'))
+        
+        deltas = {k: v for k, v in deltas.items() if v != 0}
+        missing = [k for k in deltas if item_key(k) not in self.local_item_keys]
+        return deltas, names, missing
+    
+    def apply_transfer_batch(self, transfers, direction: str):
+        """Apply all pending transfers of a cycle over ONE local connection, one transaction per transfer.
+
+        direction: 'out' (decrement, source store) or 'in' (increment, destination store).
+        Returns (ids of fully applied transfers, inventory_changes rows for them).
+        """
+        ids = [t['id'] for t in transfers]
+        applied = []
+        changes = []
+        conn = self.get_sql_connection()
         try:
-            conn = self.get_sql_connection()
             cursor = conn.cursor()
+            self.ensure_transfer_ledger(cursor)
+            conn.commit()
+            already_applied = self.fetch_ledger_transfer_ids(cursor, ids, direction)
+            if self.local_item_keys is None:
+                self.load_local_item_keys(cursor)
+            keys_refreshed = False
             
-            # Prepare WHERE clause
-            where_clause = "WHERE ItemNum = ?"
-            params = [item_num]
-            if hasattr(self, 'local_store_id') and self.local_store_id:
-                where_clause += " AND Store_ID = ?"
-                params.append(self.local_store_id)
-            
-            # 1. Get current stock
-            cursor.execute(f"SELECT In_Stock, ItemName FROM Inventory {where_clause}", params)
-            row = cursor.fetchone()
-            
-            if row:
-                # Item exists - update it
-                old_stock = float(row[0]) if row[0] else 0
-                existing_name = row[1] if row[1] else item_name
-                
-                if operation == 'add':
-                    new_stock = old_stock + quantity_change
-                    # USE ABSOLUTE UPDATE
-                    update_query = f"UPDATE Inventory SET In_Stock = ? {where_clause}"
-                    update_params = [new_stock, item_num]
-                    
-                elif operation == 'subtract':
-                    new_stock = old_stock - quantity_change
-                    # USE ABSOLUTE UPDATE
-                    update_query = f"UPDATE Inventory SET In_Stock = ? {where_clause}"
-                    update_params = [new_stock, item_num]
-                    
-                else:
-                    logger.error(f"Unknown operation: {operation}")
-                    return {'success': False, 'old_stock': old_stock, 'new_stock': old_stock, 'item_name': existing_name}
+            # Claimed transfers already carry their lines; otherwise fetch all not-yet-applied ones in one request
+            items_by_transfer = {t['id']: t['items'] for t in transfers if 'items' in t}
+            todo = [i for i in ids if str(i) not in already_applied and i not in items_by_transfer]
+            for item in (self.supabase.select_in('transfer_items', 'transfer_id', todo) if todo else []):
+                items_by_transfer.setdefault(item['transfer_id'], []).append(item)
+            
+            for transfer in transfers:
+                transfer_id = transfer['id']
+                if str(transfer_id) in already_applied:
+                    # Stock was changed in an earlier cycle; only the cloud status update is still outstanding
+                    logger.info(f"Transfer {transfer_id} already in local ledger - not re-applying stock")
+                    applied.append(transfer_id)
+                    continue
 
-                if hasattr(self, 'local_store_id') and self.local_store_id:
-                    update_params.append(self.local_store_id)
-                    
-                cursor.execute(update_query, update_params)
-                affected = cursor.rowcount
-                logger.info(f"Update SQL affected {affected} rows for {item_num} (Stock: {old_stock}->{new_stock})")
+                other_store = transfer.get('to_store_id' if direction == 'out' else 'from_store_id', 'Unknown')
+                items = items_by_transfer.get(transfer_id, [])
                 
-                if affected == 0:
-                    logger.warning(f"CRITICAL: Found item {item_num} but UPDATE affected 0 rows?!")
+                # Validate everything BEFORE touching SQL: no writes for a transfer that can't apply
+                try:
+                    deltas, names, missing = self.normalize_transfer_lines(items, direction)
+                    if missing and not keys_refreshed:
+                        # Items may have been added locally since the cache was loaded - reload once per batch
+                        self.load_local_item_keys(cursor)
+                        keys_refreshed = True
+                        deltas, names, missing = self.normalize_transfer_lines(items, direction)
+                except ValueError as e:
+                    logger.warning(f"Transfer {transfer_id} skipped: {e}")
+                    continue
+                if missing and direction == 'out':
+                    logger.warning(f"Transfer {transfer_id} skipped: items not found locally: {', '.join(missing)}")
+                    continue
                 
-            elif operation == 'add':
-                # Item doesn't exist - INSERT
-                old_stock = 0
-                new_stock = quantity_change
-                existing_name = item_name or 'Unknown Item'
-                store_id_to_use = self.local_store_id if hasattr(self, 'local_store_id') and self.local_store_id else '1001'
-                
-                # Insert item record
-                insert_query = """
-                    INSERT INTO Inventory (
-                        ItemNum, ItemName, Store_ID, Cost, Price, Retail_Price, In_Stock,
-                        Reorder_Level, Reorder_Quantity,
-                        Tax_1, Tax_2, Tax_3,
-                        Dept_ID,
-                        IsKit, IsModifier, Inv_Num_Barcode_Labels, Use_Serial_Numbers,
-                        Num_Bonus_Points, IsRental, Use_Bulk_Pricing, Print_Ticket,
-                        Print_Voucher, Num_Days_Valid, IsMatrixItem, AutoWeigh, Dirty,
-                        FoodStampable, Exclude_Acct_Limit, Check_ID, Prompt_Price,
-                        Prompt_Quantity, Allow_BuyBack, Special_Permission, Prompt_Description,
-                        Check_ID2, Count_This_Item, Print_On_Receipt, Transfer_Markup_Enabled,
-                        As_Is,
-                        Import_Markup, PricePerMeasure,
-                        AvailableOnline, DoughnutTax,
-                        RowID,
-                        DisableInventoryUpload, InvoiceLimitQty, ItemCategory, IsRestrictedPerInvoice
-                    )
-                    VALUES (
-                        ?, ?, ?, 0, 0, 0, ?,
-                        0, 0,
-                        1, 0, 0,
-                        'NONE',
-                        0, 0, 0, 0,
-                        0, 0, 0, 0,
-                        0, 0, 0, 1, 1,
-                        0, 0, 0, 0,
-                        0, 0, 0, 0,
-                        0, 1, 1, 0,
-                        0,
-                        0, 0,
-                        0, 0,
-                        NEWID(),
-                        0, 0, 0, 0
+                try:
+                    results = self.adjust_local_stock(cursor, {k: v for k, v in deltas.items() if k not in missing})
+                    for item_num in missing:
+                        # Incoming item doesn't exist - create it with the received quantity
+                        name = names.get(item_num) or 'Unknown Item'
+                        if self.insert_stock_item(cursor, item_num, name, deltas[item_num]) <= 0:
+                            raise ValueError(f"could not create item {item_num}")
+                        results[item_num] = {'old_stock': 0, 'new_stock': deltas[item_num], 'item_name': name}
+                    for item_num in deltas:
+                        if item_num not in results:
+                            raise ValueError(f"item {item_num} not found locally")
+                    
+                    # Ledger rows commit together with the stock change (an empty transfer still gets a marker row)
+                    ledger_rows = list(deltas.items()) or [('', 0.0)]
+                    cursor.execute(
+                        f"INSERT INTO Sync_Transfer_Ledger (Transfer_ID, Direction, Item_Num, Quantity_Change) VALUES {', '.join(['(?, ?, ?, ?)'] * len(ledger_rows))}",
+                        [v for item_num, delta in ledger_rows for v in (str(transfer_id), direction, item_num, delta)]
                     )
-                """
-                cursor.execute(insert_query, (item_num, existing_name, store_id_to_use, quantity_change))
-                affected = cursor.rowcount
-                logger.info(f"Inserted new item {item_num} with StoreID {store_id_to_use}, Stock {new_stock}")
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logger.warning(f"Transfer {transfer_id} had some failures updating local stock: {e}")
+                    continue
                 
-            else:
-                # Item doesn't exist and subtracting
-                logger.warning(f"Cannot subtract from non-existent item {item_num}")
-                cursor.close()
-                conn.close()
-                return {'success': False, 'old_stock': 0, 'new_stock': 0, 'item_name': None}
-            
-            conn.commit()
-            cursor.close()
+                for item_num in missing:
+                    self.local_item_keys[item_key(item_num)] = item_num
+                
+                applied.append(transfer_id)
+                for item_num, delta in deltas.items():
+                    result = results[item_num]
+                    changes.append({
+                        'item_num': item_num,
+                        'item_name': result.get('item_name') or names.get(item_num),
+                        'store_id': self.cloud_store_id,
+                        'change_type': 'transfer_in' if direction == 'in' else 'transfer_out',
+                        'quantity_change': delta,
+                        'old_stock': result['old_stock'],
+                        'new_stock': result['new_stock'],
+                        'transfer_id': transfer_id,
+                        'notes': f"Transfer {'from' if direction == 'in' else 'to'} {other_store}"
+                    })
+                logger.info(f"Transfer {transfer_id} applied locally ({len(deltas)} items)")
+        finally:
             conn.close()
-            
-            return {
-                'success': affected > 0,
-                'old_stock': old_stock,
-                'new_stock': new_stock,
-                'item_name': existing_name
-            }
-            
-        except Exception as e:
-            logger.error(f"Error updating local stock: {e}")
-            return {'success': False, 'old_stock': 0, 'new_stock': 0, 'item_name': None}
-            
-
+        
+        return applied, changes
     
-    def log_inventory_change(self, item_num: str, item_name: str, change_type: str, 
-                              quantity_change: float, old_stock: float, new_stock: float,
-                              transfer_id: str = None, notes: str = None):
-        """Log inventory change to Supabase for reporting"""
+    def log_inventory_changes(self, changes):
+        """Log a batch of inventory changes to Supabase in one insert"""
+        if not changes:
+            return
         try:
-            self.supabase.insert('inventory_changes', {
-                'item_num': item_num,
-                'item_name': item_name,
-                'store_id': self.cloud_store_id,
-                'change_type': change_type,
-                'quantity_change': quantity_change,
-                'old_stock': old_stock,
-                'new_stock': new_stock,
-                'transfer_id': transfer_id,
-                'notes': notes
-            })
-            logger.info(f"Logged inventory change: {item_num} {change_type} {quantity_change}")
+            self.supabase.insert('inventory_changes', changes)
+            logger.info(f"Logged {len(changes)} inventory changes")
         except Exception as e:
-            logger.error(f"Error logging inventory change: {e}")
+            logger.error(f"Error logging inventory changes: {e}")
     
     def process_outgoing_transfers(self):
         """Process approved/completed/received transfers FROM this store
@@ -672,156 +1005,69 @@ class SyncAgent:
         """
         logger.info("Checking for outgoing transfers...")
         
-        # 1. Approved transfers (Normal flow)
-        transfers_approved = self.supabase.select('transfers', {
-            'from_store_id': self.cloud_store_id,
-            'status': 'approved'
-        }) or []
-        
-        # 2. Completed transfers (Check for skipped/fast-forwarded ones)
-        transfers_completed = self.supabase.select('transfers', {
-            'from_store_id': self.cloud_store_id,
-            'status': 'completed'
-        }) or []
-
-        # 3. Received transfers (Check if destination processed it first - Race Condition Fix)
-        # This occurs if Store K receives it before Store H sync agent runs
-        transfers_received = self.supabase.select('transfers', {
-            'from_store_id': self.cloud_store_id,
-            'status': 'received'
-        }) or []
-        
-        # Combine and deduplicate based on ID if needed, though status is unique per row
-        all_candidates = transfers_approved + transfers_completed + transfers_received
-        
-        # Filter: Only process if 'shipped_at' is NULL (meaning Source hasn't touched it yet)
-        transfers_to_process = [t for t in all_candidates if not t.get('shipped_at')]
+        # Approved (normal flow), completed (skipped/fast-forwarded) and received (destination processed
+        # it first - Race Condition Fix), only rows the Source hasn't touched yet (shipped_at IS NULL)
+        transfers_to_process, claimed = self.fetch_pending_transfers('out', {
+            'from_store_id': f'eq.{self.cloud_store_id}',
+            'status': 'in.(approved,completed,received)',
+            'shipped_at': 'is.null'
+        }, 'outgoing_transfers_since')
         
         if not transfers_to_process:
             return 0
         
-        processed = 0
-        for transfer in transfers_to_process:
-            transfer_id = transfer['id']
-            status = transfer.get('status')
-            to_store = transfer.get('to_store_id', 'Unknown')
-            logger.info(f"Processing outgoing transfer {transfer_id} (Status: {status})")
-            
-            # Get transfer items
-            items = self.supabase.select_transfer_items(transfer_id)
-            
-            all_success = True
-            for item in items:
-                quantity = float(item['quantity'])
-                # Strip whitespace to match SQL Server's trimmed/varchar keys
-                raw_item_num = item['item_num']
-                item_num = str(raw_item_num).strip()
-                
-                logger.info(f"Processing Item: '{item_num}' (Raw: '{raw_item_num}', Len: {len(item_num)})")
-                
-                # Decrement stock in local SQL Server
-                result = self.update_local_stock(
-                    item_num, 
-                    quantity, 
-                    'subtract'
-                )
-                if result['success']:
-                    # Log the change for reporting
-                    self.log_inventory_change(
-                        item_num=item['item_num'],
-                        item_name=result.get('item_name') or item.get('item_name'),
-                        change_type='transfer_out',
-                        quantity_change=-quantity,
-                        old_stock=result['old_stock'],
-                        new_stock=result['new_stock'],
-                        transfer_id=transfer_id,
-                        notes=f"Transfer to {to_store}"
-                    )
-                else:
-                    all_success = False
-            
-            if all_success:
-                # Update transfer status
-                update_data = {
-                    'shipped_at': datetime.now(timezone.utc).isoformat()
-                }
-                
-                # Only update status to 'in_transit' if it was 'approved'
-                # If it's 'completed' or 'received', leave status alone, just set shipped_at
-                if status == 'approved':
-                    # AUTO-COMPLETE MODE: Skip 'in_transit' and go straight to 'completed'
-                    # This allows the Destination Agent to pick it up immediately without manual "Receive" click
-                    update_data['status'] = 'completed'
-                    
-                self.supabase.update('transfers', update_data, {'id': transfer_id})
-                
-                logger.info(f"Transfer {transfer_id} marked as processed (shipped_at set), stock decremented")
-                processed += 1
-            else:
-                logger.warning(f"Transfer {transfer_id} had some failures updating local stock")
+        logger.info(f"Processing {len(transfers_to_process)} outgoing transfers")
+        applied, changes = self.apply_transfer_batch(transfers_to_process, 'out')
+        if not applied:
+            self.finish_transfer_pickup('out', transfers_to_process, set(), claimed, 'outgoing_transfers_since')
+            return 0
         
-        return processed
+        # Cloud status updates - one request per distinct update
+        shipped_at = datetime.now(timezone.utc).isoformat()
+        status_by_id = {t['id']: t.get('status') for t in transfers_to_process}
+        # Only update status if it was 'approved'. AUTO-COMPLETE MODE: skip 'in_transit' and go straight to
+        # 'completed' so the Destination Agent picks it up without a manual "Receive" click.
+        # If it's 'completed' or 'received', leave status alone, just set shipped_at
+        approved = [i for i in applied if status_by_id[i] == 'approved']
+        others = [i for i in applied if status_by_id[i] != 'approved']
+        done = set()
+        if self.supabase.update_in('transfers', {'shipped_at': shipped_at, 'status': 'completed'}, 'id', approved):
+            done.update(approved)
+        if self.supabase.update_in('transfers', {'shipped_at': shipped_at}, 'id', others):
+            done.update(others)
+        self.finish_transfer_pickup('out', transfers_to_process, done, claimed, 'outgoing_transfers_since')
+        
+        self.log_inventory_changes(changes)
+        logger.info(f"{len(applied)} outgoing transfers marked as processed (shipped_at set), stock decremented")
+        return len(applied)
     
     def process_incoming_transfers(self):
         """Process completed transfers TO this store (increment stock)"""
         logger.info("Checking for completed incoming transfers...")
         
         # Get completed transfers where this store is the destination
-        transfers = self.supabase.select('transfers', {
-            'to_store_id': self.cloud_store_id,
-            'status': 'completed'
-        })
+        transfers, claimed = self.fetch_pending_transfers('in', {
+            'to_store_id': f'eq.{self.cloud_store_id}',
+            'status': 'eq.completed'
+        }, 'incoming_transfers_since')
         
         if not transfers:
             logger.info("No completed incoming transfers to process")
             return 0
         
-        processed = 0
-        for transfer in transfers:
-            transfer_id = transfer['id']
-            from_store = transfer.get('from_store_id', 'Unknown')
-            logger.info(f"Processing incoming transfer {transfer_id}")
-            
-            # Get transfer items
-            items = self.supabase.select_transfer_items(transfer_id)
-            
-            all_success = True
-            for item in items:
-                quantity = float(item['quantity'])
-                # Increment stock in local SQL Server (pass item_name for new items)
-                result = self.update_local_stock(
-                    item['item_num'], 
-                    quantity, 
-                    'add',
-                    item_name=item.get('item_name')
-                )
-                if result['success']:
-                    # Log the change for reporting
-                    self.log_inventory_change(
-                        item_num=item['item_num'],
-                        item_name=result.get('item_name') or item.get('item_name'),
-                        change_type='transfer_in',
-                        quantity_change=quantity,
-                        old_stock=result['old_stock'],
-                        new_stock=result['new_stock'],
-                        transfer_id=transfer_id,
-                        notes=f"Transfer from {from_store}"
-                    )
-                else:
-                    all_success = False
-            
-            if all_success:
-                # Update transfer status to received (so we don't process again)
-                self.supabase.update('transfers', {
-                    'status': 'received'
-                }, {'id': transfer_id})
-                
-                logger.info(f"Transfer {transfer_id} received, stock incremented")
-                processed += 1
-            else:
-                logger.warning(f"Transfer {transfer_id} had some failures updating local stock")
+        logger.info(f"Processing {len(transfers)} incoming transfers")
+        applied, changes = self.apply_transfer_batch(transfers, 'in')
+        if not applied:
+            self.finish_transfer_pickup('in', transfers, set(), claimed, 'incoming_transfers_since')
+            return 0
         
-        return processed
+        # Update transfer status to received (so we don't process again) - one request
+        done = set(applied) if self.supabase.update_in('transfers', {'status': 'received'}, 'id', applied) else set()
+        self.finish_transfer_pickup('in', transfers, done, claimed, 'incoming_transfers_since')
+        
+        self.log_inventory_changes(changes)
+        logger.info(f"{len(applied)} incoming transfers received, stock incremented")
+        return len(applied)
     
     def update_store_heartbeat(self):
         """Update the stores table with the current timestamp"""
@@ -832,77 +1078,125 @@ class SyncAgent:
         except Exception as e:
             logger.error(f"Error updating store heartbeat: {e}")
 
-    def log_sync(self, sync_type, status, records_synced, error_message=None):
-        """Log sync operation to Supabase"""
-        try:
-            self.supabase.insert('sync_log', {
-                'store_id': self.cloud_store_id,
-                'sync_type': sync_type,
-                'status': status,
-                'records_synced': records_synced,
-                'error_message': error_message,
-                'started_at': datetime.now(timezone.utc).isoformat(),
-                'completed_at': datetime.now(timezone.utc).isoformat() if status == 'completed' else None
+    def begin_cycle(self):
+        """Start a new CycleStats; HTTP traffic and logged errors are counted against it from now on"""
+        self.cycle = CycleStats()
+        self.cycle_thread = threading.get_ident()
+        self.supabase.stats = self.cycle
+        return self.cycle
+    
+    def log_sync(self, sync_type, status, records_synced, error_message=None, cycle=None):
+        """Log sync operation to Supabase, with the per-phase breakdown of `cycle` (default: the running cycle)"""
+        cycle = cycle or self.cycle
+        now = datetime.now(timezone.utc)
+        row = {
+            'store_id': self.cloud_store_id,
+            'sync_type': sync_type,
+            'status': status,
+            'records_synced': records_synced,
+            'error_message': error_message,
+            'started_at': (cycle.started_at if cycle else now).isoformat(),
+            'completed_at': now.isoformat() if status == 'completed' else None
+        }
+        if cycle:
+            row.update({
+                'duration_ms': cycle.duration_ms(),
+                'bytes_sent': cycle.total('bytes_sent'),
+                'bytes_received': cycle.total('bytes_received'),
+                'errors': cycle.total('errors'),
+                'phases': cycle.phases
             })
+        self.supabase.stats = None  # Don't count the log write itself
+        try:
+            if not self.supabase.insert('sync_log', row) and cycle:
+                # sync_log_metrics.sql not deployed yet - keep logging the basic row
+                for column in ('duration_ms', 'bytes_sent', 'bytes_received', 'errors', 'phases'):
+                    row.pop(column)
+                self.supabase.insert('sync_log', row)
         except Exception as e:
             logger.error(f"Error logging sync: {e}")
+        finally:
+            self.supabase.stats = self.cycle
     
-    def run(self):
-        """Main sync loop"""
-        logger.info(f"Starting sync agent for store {self.cloud_store_id}")
-        logger.info(f"Sync interval: {self.sync_interval} seconds")
-        
-        while True:
-            try:
-                logger.info("=" * 50)
-                logger.info("Starting sync cycle...")
-                
-                # 1. Process outgoing transfers (approved -> in_transit)
-                # Do this FIRST so local DB is updated before we read inventory
+    def run_cycle(self):
+        """One sync cycle: transfers, cloud -> local, local -> cloud, departments, heartbeat, sync_log"""
+        try:
+            logger.info("=" * 50)
+            logger.info("Starting sync cycle...")
+            
+            cycle = self.begin_cycle()
+            
+            # 1. Process outgoing transfers (approved -> in_transit)
+            # Do this FIRST so local DB is updated before we read inventory
+            with cycle.phase('outgoing_transfers'):
                 outgoing = self.process_outgoing_transfers()
-                
-                # 2. Process incoming transfers (completed -> received)
+                cycle.add('rows_written', outgoing)
+            
+            # 2. Process incoming transfers (completed -> received)
+            with cycle.phase('incoming_transfers'):
                 incoming = self.process_incoming_transfers()
+                cycle.add('rows_written', incoming)
 
-                # 3. Sync items FROM cloud TO local (Two-Way Sync)
-                # This ensures web-created items appear in local databases
+            # 3. Sync items FROM cloud TO local (Two-Way Sync)
+            # This ensures web-created items appear in local databases
+            with cycle.phase('items_from_cloud'):
                 cloud_synced = self.sync_items_from_cloud()
+                cycle.add('rows_written', cloud_synced)
 
-                # 4. Fetch inventory from SQL Server (now includes cloud-synced items)
+            # 4. Fetch inventory from SQL Server (now includes cloud-synced items)
+            with cycle.phase('fetch_inventory'):
                 inventory = self.fetch_inventory_from_sql()
-                logger.info(f"Fetched {len(inventory)} items from SQL Server")
-                
-                # 5. Sync to cloud (local -> cloud)
+                cycle.add('rows_read', len(inventory))
+            logger.info(f"Fetched {len(inventory)} items from SQL Server")
+            
+            # 5. Sync to cloud (local -> cloud)
+            with cycle.phase('inventory_to_cloud'):
                 synced_count = self.sync_inventory_to_cloud(inventory)
-                
-                # 6. Sync departments to cloud (for dropdown in web form)
+                cycle.add('rows_written', synced_count)
+            
+            # 6. Sync departments to cloud (for dropdown in web form)
+            with cycle.phase('departments'):
                 departments = self.fetch_departments_from_sql()
+                cycle.add('rows_read', len(departments))
                 if departments:
-                    self.sync_departments_to_cloud(departments)
-                
-                # 7. Update Store Heartbeat (Last Sync Time)
+                    cycle.add('rows_written', self.sync_departments_to_cloud(departments))
+            
+            # 7. Update Store Heartbeat (Last Sync Time)
+            with cycle.phase('heartbeat'):
                 self.update_store_heartbeat()
-                
-                # 8. Log sync
-                self.log_sync('full', 'completed', synced_count)
-                
-                logger.info(f"Sync cycle complete:")
-                logger.info(f"  - Outgoing transfers processed: {outgoing}")
-                logger.info(f"  - Incoming transfers processed: {incoming}")
-                logger.info(f"  - Cloud->Local items synced: {cloud_synced}")
-                logger.info(f"  - Local->Cloud inventory synced: {synced_count}")
-                logger.info(f"  - Departments synced: {len(departments)}")
-                logger.info(f"Next sync in {self.sync_interval} seconds.")
-                logger.info("=" * 50)
-                
-            except Exception as e:
-                logger.error(f"Sync cycle error: {e}")
-                self.log_sync('full', 'failed', 0, str(e))
             
+            # 8. Log sync (with the per-phase breakdown)
+            self.log_sync('full', 'completed', synced_count)
+            
+            logger.info(f"Sync cycle complete:")
+            logger.info(f"  - Outgoing transfers processed: {outgoing}")
+            logger.info(f"  - Incoming transfers processed: {incoming}")
+            logger.info(f"  - Cloud->Local items synced: {cloud_synced}")
+            logger.info(f"  - Local->Cloud inventory synced: {synced_count}")
+            logger.info(f"  - Departments synced: {len(departments)}")
+            logger.info(f"Next sync in {self.sync_interval} seconds.")
+            logger.info("=" * 50)
+            
+        except Exception as e:
+            logger.error(f"Sync cycle error: {e}")
+            self.log_sync('full', 'failed', 0, str(e))
+    
+    def run(self):
+        """Main sync loop"""
+        logger.info(f"Starting sync agent for store {self.cloud_store_id}")
+        logger.info(f"Sync interval: {self.sync_interval} seconds")
+        
+        while True:
+            self.run_cycle()
             time.sleep(self.sync_interval)
+    
+    def close(self):
+        """Detach the agent from the module logger"""
+        logger.removeHandler(self.error_counter)
 
 
 def main():
+    agent = None
     try:
         agent = SyncAgent()
         agent.run()
@@ -912,6 +1206,9 @@ def main():
         logger.error(f"Fatal error: {e}")
         input("Press Enter to exit...")
         sys.exit(1)
+    finally:
+        if agent is not None:
+            agent.close()
 
 
 if __name__ == '__main__':
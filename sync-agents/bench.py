@@ -0,0 +1,199 @@
+"""
+Benchmark Mode
+==============
+`--bench` runs the agent's pipeline stages against the REAL local SQL Server and
+reports throughput per stage, so the bottleneck on a given store's hardware is
+known before a change is rolled out:
+
+    fetch      Inventory query (ODBC round trip + driver row materialisation)
+    map        SQL row -> cloud payload (map_inventory_row)
+    diff       digest + compare against the agent's state store (diff_inventory)
+    serialize  JSON encoding of the upload batches
+    upload     POST of those batches - only with --bench-upload=<mock PostgREST URL>
+    departments / item_keys   the other local reads a cycle does
+
+Nothing is ever written to Supabase; without --bench-upload the upload stage is
+skipped. Local SQL Server is only read: a store the bench connects to itself gets
+no schema changes (ensure_schema is skipped - run the agent once first if the
+ItemType / Local_Updated_At columns are missing), and the SQL path it discovers is
+not cached. The stages only read the agent's state store, but the agent opens it
+when it is built - that creates its schema and imports a legacy sync_state.json
+the first time, as any start of the agent would.
+serialize / upload treat every row as changed - the cold-start worst case.
+
+    store-h-agent.py --bench [--bench-rounds=3] [--bench-upload=http://127.0.0.1:8000] [--bench-out=bench.json]
+    multi-store-agent.py --bench ...          (every store in stores.ini, one after the other)
+
+Rows/s is the median over the rounds; peak memory is the process's peak working
+set after each stage, so a stage that raises it shows where the memory goes.
+"""
+
+import argparse
+import ctypes
+import json
+import statistics
+import sys
+import time
+
+import requests
+from store_agent import INVENTORY_QUERY, UPLOAD_BATCH, chunked, make_http_session
+
+STAGES = ('fetch', 'map', 'diff', 'serialize', 'upload', 'departments', 'item_keys')
+
+
+def wants_bench(argv=None):
+    return '--bench' in (sys.argv[1:] if argv is None else argv)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='--bench', description='Benchmark the sync stages against the local SQL Server')
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--bench-rounds', type=int, default=3, help='Runs per stage (median is reported)')
+    parser.add_argument('--bench-upload', default=None, help='Mock PostgREST base URL for the upload stage (never the real cloud)')
+    parser.add_argument('--bench-out', default=None, help='Also write the results as JSON')
+    return parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+
+def peak_memory_mb():
+    """Peak resident set / working set of this process in MB (None if the platform doesn't say)"""
+    if sys.platform == 'win32':
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(Counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize / (1024 * 1024)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB on Linux
+
+
+class Bench:
+    def __init__(self, agent, rounds=3, upload_url=None):
+        self.agent = agent
+        self.rounds = max(1, rounds)
+        self.upload_url = upload_url.rstrip('/') if upload_url else None
+        self.upload_http = make_http_session() if upload_url else None
+        self.samples = {stage: [] for stage in STAGES}  # stage -> [(rows, seconds), ...]
+        self.memory = {}  # stage -> peak MB after it
+
+    def timed(self, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        return result, time.perf_counter() - started
+
+    def record(self, stage, rows, seconds):
+        self.samples[stage].append((rows, seconds))
+        self.memory[stage] = peak_memory_mb()
+
+    def run_round(self):
+        agent = self.agent
+        rows, secs = self.timed(agent.sql_conn.query, INVENTORY_QUERY, (agent.local_store_id,))
+        self.record('fetch', len(rows), secs)
+
+        items, secs = self.timed(lambda: [agent.map_inventory_row(r) for r in rows])
+        self.record('map', len(items), secs)
+
+        def diff():
+            state = agent.state
+            return agent.diff_inventory(items, state.get_cloud_versions(), state.get_digests(), state.get_echo_digests())
+        (to_push, _, _, _), secs = self.timed(diff)
+        self.record('diff', len(items), secs)
+
+        bodies, secs = self.timed(lambda: [json.dumps(batch) for batch in chunked(items, UPLOAD_BATCH)])
+        self.record('serialize', len(items), secs)
+
+        if self.upload_url:
+            _, secs = self.timed(self.upload, bodies)
+            self.record('upload', len(items), secs)
+
+        agent.dept_checksum = None  # Force the re-read the checksum would normally skip
+        depts, secs = self.timed(agent.fetch_local_departments)
+        self.record('departments', len(depts), secs)
+
+        _, secs = self.timed(agent.load_local_item_keys)
+        self.record('item_keys', len(agent.local_item_keys or {}), secs)
+        return len(to_push)
+
+    def upload(self, bodies):
+        headers = {'apikey': self.agent.supa_key, 'Authorization': f'Bearer {self.agent.supa_key}',
+                   'Content-Type': 'application/json', 'Prefer': 'resolution=merge-duplicates'}
+        for body in bodies:
+            res = self.upload_http.post(f'{self.upload_url}/rest/v1/inventory?on_conflict=item_num,store_id', headers=headers, data=body)
+            if res.status_code not in [200, 201, 204]:
+                raise requests.HTTPError(f"Mock upload failed: {res.status_code} {res.text[:200]}")
+
+    def run(self):
+        changed = 0
+        for n in range(self.rounds):
+            changed = self.run_round()
+            self.agent.log(f"[BENCH] Round {n + 1}/{self.rounds} done")
+        return self.report(changed)
+
+    def report(self, changed):
+        results = {}
+        for stage in STAGES:
+            samples = self.samples[stage]
+            if not samples:
+                continue
+            rows = samples[-1][0]
+            seconds = statistics.median(s for _, s in samples)
+            results[stage] = {
+                'rows': rows,
+                'seconds': round(seconds, 4),
+                'rows_per_second': round(rows / seconds) if seconds > 0 else None,
+                'peak_memory_mb': round(self.memory[stage], 1) if self.memory.get(stage) is not None else None,
+            }
+        pipeline = [results[s] for s in ('fetch', 'map', 'diff', 'serialize', 'upload') if s in results]
+        bottleneck = max(('fetch', 'map', 'diff', 'serialize', 'upload'), key=lambda s: results.get(s, {}).get('seconds', -1))
+        return {
+            'store_id': self.agent.store_id,
+            'rounds': self.rounds,
+            'changed_rows': changed,
+            'stages': results,
+            'pipeline_seconds': round(sum(r['seconds'] for r in pipeline), 4),
+            'bottleneck': bottleneck,
+            'upload': self.upload_url or 'disabled',
+        }
+
+
+def log_report(agent, report):
+    agent.log(f"[BENCH] {report['rounds']} rounds, upload {report['upload']}, "
+              f"{report['changed_rows']} rows would be pushed right now")
+    agent.log(f"[BENCH] {'stage':<12}{'rows':>9}{'seconds':>10}{'rows/s':>11}{'peak MB':>9}")
+    for stage, r in report['stages'].items():
+        rate = f"{r['rows_per_second']:,}" if r['rows_per_second'] is not None else '-'
+        memory = f"{r['peak_memory_mb']:.1f}" if r['peak_memory_mb'] is not None else '-'
+        agent.log(f"[BENCH] {stage:<12}{r['rows']:>9}{r['seconds']:>10.3f}{rate:>11}{memory:>9}")
+    agent.log(f"[BENCH] fetch->upload {report['pipeline_seconds']:.3f}s, bottleneck: {report['bottleneck']}")
+
+
+def run_bench(agents, argv=None):
+    """Benchmark each agent in turn; returns the reports. Agents must not be running their sync loop."""
+    args = parse_args(argv)
+    reports = []
+    for agent in agents:
+        agent.log("[BENCH] Connecting to local SQL Server (cloud writes disabled)...")
+        if agent.sql_conn is None and not agent.connect_sql(read_only=True):
+            agent.log("[BENCH] Database connection failed - skipping store", "ERROR")
+            continue
+        try:
+            report = Bench(agent, args.bench_rounds, args.bench_upload).run()
+        except Exception as e:
+            agent.log(f"[BENCH] Failed: {e}", "ERROR")
+            continue
+        log_report(agent, report)
+        reports.append(report)
+    if args.bench_out:
+        with open(args.bench_out, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2)
+    return reports
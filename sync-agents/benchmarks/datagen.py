@@ -0,0 +1,347 @@
+"""
+Synthetic Store Data
+====================
+Deterministic PCAmerica-shaped catalogues and change streams for the benchmarks.
+The same seed always gives the same items, departments and events.
+
+What makes it look like a real store rather than ItemNum 000001..N:
+- Sales velocity is Zipf-skewed: a few hundred items take most of the sales, the
+  long tail sells once a month. Stock levels follow velocity.
+- Department sizes are skewed too (a couple of huge departments, many tiny ones).
+- ItemNum mixes UPCs, PLUs and vendor SKUs in mixed case; a share of ItemNum and
+  Dept_ID values carry trailing spaces, like PCAmerica's padded columns do.
+- Some names are the full 30 characters, with accents, apostrophes and commas.
+- A few items sit at negative stock (sold before the delivery was received).
+
+    data = generate_store(10000, seed=7)
+    load_standin('store.db', data)                    # local PCAmerica stand-in
+    load_cloud(mock, data, 'STORE-H')                 # mock cloud, as a finished sync left it
+    stream = ChangeStream(data, seed=7)
+    apply_pos('store.db', stream.pos_events(500))     # register traffic
+    apply_web(mock, 'STORE-H', stream.web_edits(20))  # edits made in the web app
+
+Timestamps are not part of the data: Local_Updated_At / updated_at are set when
+rows are loaded or changed, so the agents see a consistent "now".
+"""
+
+import bisect
+import itertools
+import random
+
+import standin_sql
+
+ITEMNUM_MAX = 20  # Inventory.ItemNum / inventory.item_num
+ITEMNAME_MAX = 30  # Inventory.ItemName / inventory.item_name
+DEPT_ID_MAX = 8  # Departments.Dept_ID / departments.dept_id
+
+DEPT_CODES = ('BEER', 'WINE', 'LIQUOR', 'TOBACCO', 'CIGARS', 'VAPE', 'SNACKS', 'CANDY', 'SODA', 'WATER', 'ENERGY',
+              'JUICE', 'DAIRY', 'GROCERY', 'FROZEN', 'ICE', 'HBA', 'AUTO', 'PHONE', 'LOTTO', 'GIFT', 'MIXERS', 'DELI',
+              'COFFEE', 'PAPER', 'PET', 'BABY', 'SEASONAL', 'GM', 'MISC')
+BRANDS = ('Coca-Cola', 'Pepsi', "Lay's", 'Doritos', 'Marlboro', 'Newport', "Jack Daniel's", 'Tito\'s', 'Bud Light',
+          'Modelo', 'Corona', 'Red Bull', 'Monster', 'Hershey\'s', 'Snickers', 'Takis', 'Arizona', 'Gatorade',
+          'Häagen-Dazs', 'Nestlé', 'Jalapeño Bros', 'Crème Co', 'Swisher', 'Black & Mild', 'Juul', 'Tylenol', 'Advil',
+          'Duracell', 'Bic', 'Zig-Zag', 'Hennessy', 'Crown Royal', 'Fireball', 'Smirnoff', 'Patrón', 'Barefoot')
+PRODUCTS = ('Original', 'Diet', 'Zero Sugar', 'Cherry', 'Classic', 'Light', 'Extra Strong', 'Menthol', 'Hot Chili',
+            'Family Size', 'King Size', 'Party Pack', 'Limited Edition', 'Variety', 'Sugar Free', 'Café Mocha',
+            'Sour Cream & Onion', 'Flamin Hot', 'Peach', 'Wild Berry', 'Gold', 'Silver', 'Reserve', 'Single')
+SIZES = ('12oz', '16oz', '20oz', '24oz', '1L', '2L', '750ml', '1.75L', '50ml', '6pk', '12pk', '24pk', '1oz', '3.5oz',
+         '8ct', '20ct', 'Each', 'Box', 'Case')
+UNIT_TYPES = ('EA', 'CS', 'PK', 'BX', 'LB')
+VENDORS = tuple(f'V{n:04d}' for n in range(1, 61))
+
+
+def zipf_weights(n, skew, rng):
+    """n weights following 1/rank^skew, assigned to positions in random order"""
+    weights = [1.0 / (rank ** skew) for rank in range(1, n + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+def pad(value, width, rng):
+    """Trailing spaces up to width, like a CHAR / padded NVARCHAR column returns it"""
+    return value + ' ' * rng.randint(1, max(1, width - len(value))) if len(value) < width else value
+
+
+class Dataset:
+    """One store's catalogue. Rows use PCAmerica column names (ItemNum, Dept_ID, ...), values as stored locally."""
+
+    def __init__(self, store_id, departments, items, velocity, seed):
+        self.store_id = store_id  # Local Store_ID
+        self.departments = departments  # [{'Dept_ID', 'Description'}]
+        self.items = items  # [{'ItemNum', 'ItemName', 'Dept_ID', 'Cost', 'Price', ...}]
+        self.velocity = velocity  # Expected units sold per day, parallel to items
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.items)
+
+    def summary(self):
+        by_dept = {}
+        for item in self.items:
+            key = item['Dept_ID'].rstrip()
+            by_dept[key] = by_dept.get(key, 0) + 1
+        top = sorted(self.velocity, reverse=True)
+        head = sum(top[:max(1, len(top) // 100)])
+        return {
+            'items': len(self.items),
+            'departments': len(self.departments),
+            'largest_department': max(by_dept.values()) if by_dept else 0,
+            'padded_item_nums': sum(1 for i in self.items if i['ItemNum'] != i['ItemNum'].rstrip()),
+            'padded_dept_ids': sum(1 for d in self.departments if d['Dept_ID'] != d['Dept_ID'].rstrip()),
+            'full_length_names': sum(1 for i in self.items if len(i['ItemName']) == ITEMNAME_MAX),
+            'top_1pct_sales_share': round(head / sum(top), 3) if top else 0,
+        }
+
+
+def make_departments(count, padded_pct, rng):
+    codes = list(DEPT_CODES[:count]) + [f'DEPT{n:03d}' for n in range(count - len(DEPT_CODES))]
+    departments = []
+    for code in codes:
+        dept_id = pad(code, DEPT_ID_MAX, rng) if rng.random() * 100 < padded_pct else code
+        departments.append({'Dept_ID': dept_id, 'Description': code.title()[:ITEMNAME_MAX]})
+    return departments
+
+
+def make_item_num(rng, style_roll):
+    if style_roll < 0.6:
+        return ''.join(rng.choices('0123456789', k=12))  # UPC-A
+    if style_roll < 0.7:
+        return str(rng.randint(3000, 99999))  # PLU
+    if style_roll < 0.95:  # Vendor SKU, mixed case
+        prefix = ''.join(rng.choices('ABCDEFGHJKLMNPQRSTUVWXYZabcdefghjkmnpqrstuvwxyz', k=rng.randint(2, 4)))
+        return f"{prefix}-{rng.randint(100, 999999)}"
+    return ''.join(rng.choices('ABCDEFGHJKLMNPQRSTUVWXYZ0123456789', k=rng.randint(3, 6)))  # Short house codes
+
+
+def make_name(rng, long_name):
+    name = f"{rng.choice(BRANDS)} {rng.choice(PRODUCTS)} {rng.choice(SIZES)}"
+    if long_name:
+        while len(name) < ITEMNAME_MAX:
+            name += ' ' + rng.choice(PRODUCTS + SIZES)
+    return name[:ITEMNAME_MAX].rstrip() if not long_name else name[:ITEMNAME_MAX]
+
+
+def generate_store(items, seed=1, store_id='1001', departments=None, padded_pct=15.0, long_name_pct=10.0,
+                   velocity_skew=1.1, department_skew=1.2, negative_stock_pct=2.0):
+    """A deterministic catalogue of `items` items. departments defaults to ~2 per 1000 items (10..120)."""
+    rng = random.Random(seed)
+    dept_count = departments or max(10, min(120, items // 500))
+    depts = make_departments(dept_count, padded_pct, rng)
+    dept_cum = list(itertools.accumulate(zipf_weights(dept_count, department_skew, rng)))
+    velocity_weights = zipf_weights(items, velocity_skew, rng)
+    total_weight = sum(velocity_weights) or 1
+    daily_units = 20.0 * items / 100  # Whole store: ~20 units a day per 100 items
+
+    rows, velocity, seen = [], [], set()
+    for n in range(items):
+        while True:
+            item_num = make_item_num(rng, rng.random())
+            key = item_num.casefold()
+            if key not in seen:  # Unique under PCAmerica's collation
+                seen.add(key)
+                break
+        if rng.random() * 100 < padded_pct:
+            item_num = pad(item_num, ITEMNUM_MAX, rng)
+        dept = depts[bisect.bisect_left(dept_cum, rng.random() * dept_cum[-1])]
+        per_day = daily_units * velocity_weights[n] / total_weight
+        cost = round(rng.lognormvariate(1.2, 0.9), 2)
+        price = max(0.99, round(cost * rng.uniform(1.2, 1.8)) - 0.01)
+        stock = max(0, int(rng.gauss(per_day * 14 + 6, per_day * 4 + 2)))  # ~Two weeks of cover
+        if rng.random() * 100 < negative_stock_pct:
+            stock = -rng.randint(1, 12)
+        rows.append({
+            'ItemNum': item_num,
+            'ItemName': make_name(rng, rng.random() * 100 < long_name_pct),
+            'Dept_ID': dept['Dept_ID'],
+            'Cost': cost,
+            'Price': price,
+            'Retail_Price': price,
+            'In_Stock': stock,
+            'ItemType': 0 if rng.random() < 0.97 else rng.choice((1, 2, 3)),
+            'Vendor_Number': rng.choice(VENDORS),
+            'Unit_Type': rng.choice(UNIT_TYPES),
+            'Unit_Size': rng.choice((1, 1, 1, 6, 12, 24)),
+        })
+        velocity.append(per_day)
+    return Dataset(str(store_id), depts, rows, velocity, seed)
+
+
+INVENTORY_COLUMNS = ('ItemNum', 'ItemName', 'Dept_ID', 'Cost', 'Price', 'Retail_Price', 'In_Stock', 'ItemType',
+                     'Vendor_Number', 'Unit_Type', 'Unit_Size')
+
+
+def load_standin(path, dataset):
+    """Create / fill a stand-in database with the dataset (direct SQLite, not row by row through the shim)"""
+    standin_sql.create_database(path, dataset.store_id)
+    conn = standin_sql.open_sqlite(path)
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO Departments (Dept_ID, Store_ID, Description, RowID) VALUES (?, ?, ?, NEWID())",
+                         [(d['Dept_ID'], dataset.store_id, d['Description']) for d in dataset.departments])
+        conn.executemany(f"INSERT OR IGNORE INTO Inventory ({', '.join(INVENTORY_COLUMNS)}, Store_ID, RowID) "
+                         f"VALUES ({', '.join('?' * len(INVENTORY_COLUMNS))}, ?, NEWID())",
+                         [tuple(i[c] for c in INVENTORY_COLUMNS) + (dataset.store_id,) for i in dataset.items])
+    conn.close()
+    return path
+
+
+def cloud_item(item, cloud_store_id):
+    """A local row as the agent uploads it (store_agent.map_inventory_row): trimmed keys, cloud column names"""
+    return {
+        'item_num': item['ItemNum'].strip(),
+        'item_name': item['ItemName'],
+        'dept_id': item['Dept_ID'].strip() or 'OTHER',
+        'itemtype': int(item['ItemType'] or 0),
+        'in_stock': float(item['In_Stock']),
+        'cost': float(item['Cost']),
+        'price': float(item['Price']),
+        'retail_price': float(item['Price']),
+        'store_id': cloud_store_id,
+    }
+
+
+def load_cloud(mock, dataset, cloud_store_id, batch=1000):
+    """Fill the mock cloud with the dataset, as a completed sync of this store would have left it"""
+    with mock.lock:
+        mock.insert('stores', {'store_id': cloud_store_id, 'store_name': cloud_store_id, 'is_active': True},
+                    upsert=True)
+        mock.insert('departments', [{'dept_id': d['Dept_ID'].strip(), 'dept_name': d['Description'],
+                                     'description': d['Description'], 'store_id': cloud_store_id}
+                                    for d in dataset.departments], upsert=True)
+        for start in range(0, len(dataset.items), batch):
+            mock.insert('inventory', [cloud_item(i, cloud_store_id) for i in dataset.items[start:start + batch]],
+                        upsert=True)
+
+
+class ChangeStream:
+    """Deterministic POS traffic and web-app edits over a dataset.
+
+    POS events follow sales velocity; each is {'kind', 'item_num', ...} with item_num exactly as stored
+    locally (padding included):
+        sale      qty sold (In_Stock -= qty, Last_Sold = now)
+        receive   qty received (In_Stock += qty)
+        price     new Price
+        rename    new ItemName
+        new_item  a full new row (item)
+    Web edits are what office staff change in the cloud: price, in_stock (a count) or item_name.
+    """
+
+    POS_MIX = (('sale', 0.88), ('receive', 0.06), ('price', 0.03), ('rename', 0.015), ('new_item', 0.015))
+    WEB_MIX = (('price', 0.5), ('in_stock', 0.35), ('item_name', 0.15))
+
+    def __init__(self, dataset, seed=None):
+        self.dataset = dataset
+        self.rng = random.Random(dataset.seed * 7919 + 1 if seed is None else seed)
+        self.items = [dict(i) for i in dataset.items]  # Our view of the catalogue; the dataset stays as generated
+        self.cum = list(itertools.accumulate(v or 1e-9 for v in dataset.velocity))
+        self.keys = {i['ItemNum'].rstrip().casefold() for i in self.items}
+        self.added = 0
+
+    def pick(self):
+        """An item, weighted by sales velocity"""
+        return self.items[bisect.bisect_left(self.cum, self.rng.random() * self.cum[-1])]
+
+    def choose(self, mix):
+        roll, total = self.rng.random(), 0.0
+        for kind, share in mix:
+            total += share
+            if roll < total:
+                return kind
+        return mix[-1][0]
+
+    def new_item(self):
+        rng = self.rng
+        while True:
+            item_num = make_item_num(rng, rng.random())
+            if item_num.casefold() not in self.keys:
+                self.keys.add(item_num.casefold())
+                break
+        price = round(rng.uniform(1, 30)) + 0.99
+        item = {'ItemNum': item_num, 'ItemName': make_name(rng, False), 'Dept_ID': rng.choice(self.dataset.departments)['Dept_ID'],
+                'Cost': round(price * 0.6, 2), 'Price': price, 'Retail_Price': price, 'In_Stock': rng.randint(6, 48),
+                'ItemType': 0, 'Vendor_Number': rng.choice(VENDORS), 'Unit_Type': 'EA', 'Unit_Size': 1}
+        self.items.append(item)
+        self.cum.append(self.cum[-1] + self.cum[-1] / max(1, len(self.items)))  # An average seller from now on
+        self.added += 1
+        return item
+
+    def pos_event(self):
+        kind = self.choose(self.POS_MIX)
+        if kind == 'new_item':
+            return {'kind': kind, 'item_num': None, 'item': self.new_item()}
+        item = self.pick()
+        event = {'kind': kind, 'item_num': item['ItemNum']}
+        if kind == 'sale':
+            event['qty'] = 1 if self.rng.random() < 0.8 else self.rng.randint(2, 6)
+        elif kind == 'receive':
+            event['qty'] = self.rng.choice((6, 12, 24, 48))
+        elif kind == 'price':
+            event['price'] = max(0.99, round(item['Price'] * self.rng.uniform(0.9, 1.15)) - 0.01)
+            item['Price'] = event['price']
+        elif kind == 'rename':
+            event['name'] = make_name(self.rng, self.rng.random() < 0.3)
+            item['ItemName'] = event['name']
+        return event
+
+    def pos_events(self, n):
+        return [self.pos_event() for _ in range(n)]
+
+    def web_edit(self):
+        item = self.pick()
+        kind = self.choose(self.WEB_MIX)
+        if kind == 'price':
+            value = max(0.99, round(item['Price'] * self.rng.uniform(0.85, 1.2)) - 0.01)
+        elif kind == 'in_stock':
+            value = float(max(0, self.rng.randint(0, 60)))
+        else:
+            value = make_name(self.rng, False)
+        return {'kind': kind, 'item_num': item['ItemNum'].strip(), 'value': value}
+
+    def web_edits(self, n):
+        return [self.web_edit() for _ in range(n)]
+
+
+def apply_pos(path, events):
+    """Apply POS events to a stand-in database in one transaction (the trigger bumps Local_Updated_At)"""
+    conn = standin_sql.open_sqlite(path)
+    store_id = conn.execute('SELECT Store_ID FROM Setup').fetchone()[0]
+    with conn:
+        for e in events:
+            kind = e['kind']
+            if kind == 'sale':
+                conn.execute('UPDATE Inventory SET In_Stock = In_Stock - ?, Last_Sold = GETDATE() WHERE ItemNum = ?', (e['qty'], e['item_num']))
+            elif kind == 'receive':
+                conn.execute('UPDATE Inventory SET In_Stock = In_Stock + ? WHERE ItemNum = ?', (e['qty'], e['item_num']))
+            elif kind == 'price':
+                conn.execute('UPDATE Inventory SET Price = ?, Retail_Price = ? WHERE ItemNum = ?', (e['price'], e['price'], e['item_num']))
+            elif kind == 'rename':
+                conn.execute('UPDATE Inventory SET ItemName = ? WHERE ItemNum = ?', (e['name'], e['item_num']))
+            elif kind == 'new_item':
+                item = e['item']
+                conn.execute(f"INSERT OR IGNORE INTO Inventory ({', '.join(INVENTORY_COLUMNS)}, Store_ID, RowID) "
+                             f"VALUES ({', '.join('?' * len(INVENTORY_COLUMNS))}, ?, NEWID())",
+                             tuple(item[c] for c in INVENTORY_COLUMNS) + (store_id,))
+    conn.close()
+    return len(events)
+
+
+def apply_web(mock, cloud_store_id, edits):
+    """Apply web-app edits to the mock cloud, one PATCH-equivalent per edit (each gets its own updated_at)"""
+    with mock.lock:
+        for e in edits:
+            mock.update('inventory', {e['kind']: e['value']},
+                        [('store_id', f'eq.{cloud_store_id}'), ('item_num', f'eq.{e["item_num"]}')])
+    return len(edits)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='Generate a synthetic PCAmerica stand-in database')
+    parser.add_argument('path', help='SQLite file to create')
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--store-id', default='1001')
+    args = parser.parse_args()
+    data = generate_store(args.items, seed=args.seed, store_id=args.store_id)
+    load_standin(args.path, data)
+    print(json.dumps(data.summary(), indent=2))
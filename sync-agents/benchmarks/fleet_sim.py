@@ -0,0 +1,351 @@
+"""
+Fleet Load Simulator
+====================
+Runs N store agents in one process against one mock Supabase (mock_postgrest.py),
+each with its own PCAmerica stand-in (standin_sql.py) and synthetic catalogue
+(datagen.py), and steps N up to find where the cloud side saturates.
+
+    --kind legacy   sync-agent/sync_agent.py: pulls every cloud row and pushes every
+                    local row each cycle (the 30-second full-push design)
+    --kind store    sync-agents/store_agent.py: incremental, digest-filtered
+
+Every store sees POS traffic (ChangeStream) and the mock's uplink can be degraded
+(--network store_dsl, or --latency-ms / --loss-pct / --error-rate / ... - see
+mock_postgrest.Conditions). Besides that, marked
+writes are made on both sides at --probe-rate per store and minute and timed until
+they show up on the other side:
+
+    web -> local   a marker price written in the cloud, seen in the store's database
+    pos -> cloud   a marker price written at the POS, seen in the cloud
+    lost           not seen within --probe-timeout (or overwritten before it arrived)
+
+Per fleet size it reports server request rate, rows and KB per second, how busy
+the mock was, cycle time p50 / p99 and propagation p50 / p99.
+
+    python benchmarks/fleet_sim.py [--fleet 1,5,10,25] [--kind legacy] [--items 500]
+                                   [--duration 120] [--interval 30] [--network flaky_uplink]
+                                   [--latency-ms 150] [--error-rate 0.01] [--out fleet.json]
+
+All agents share this process (and its GIL), so cycle times at large N include
+CPU contention in the simulator itself - `cpu` in the report shows how close the
+process was to one core. The mock serialises its database behind one lock;
+`busy` is the share of wall time it spent serving. When either nears 100%, the
+numbers say more about the simulator than about Supabase.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+AGENTS_DIR = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, AGENTS_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(AGENTS_DIR), 'sync-agent'))
+
+# sync_agent.py calls logging.basicConfig() on import, which would log to ./sync_agent.log -
+# configuring the root logger first turns that into a no-op; main() points it at the work directory
+logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+
+import standin_sql
+standin_sql.install()  # Before the agents import pyodbc
+import datagen
+from mock_postgrest import conditions_from_args, network_arguments, serve
+import probe
+import store_agent
+stray_log = not os.path.exists('sync_agent.log')
+import sync_agent
+if stray_log and os.path.isfile('sync_agent.log') and not os.path.getsize('sync_agent.log'):
+    with contextlib.suppress(OSError):
+        os.remove('sync_agent.log')  # Its FileHandler opens the file even though basicConfig ignores it
+
+KINDS = ('legacy', 'store')
+MARKER_BASE = 7000.0  # Probe prices: MARKER_BASE + n / 100, far above any generated price
+
+
+class SimStore:
+    """One simulated store: stand-in database, traffic and an agent of the given kind"""
+
+    def __init__(self, index, kind, workdir, server, dataset, interval):
+        """dataset: datagen.Dataset for this store (stores may share one - transfers need common items)"""
+        self.index = index
+        self.kind = kind
+        self.workdir = workdir
+        self.server = server
+        self.store_id = f'SIM-{index:03d}'
+        self.interval = interval
+        self.dataset = dataset
+        self.stream = datagen.ChangeStream(dataset, seed=dataset.seed + index)
+        self.db_path = datagen.load_standin(os.path.join(workdir, f'{self.store_id}.db'), dataset)
+        self.database = f'fleet_{self.store_id}'.lower().replace('-', '_')
+        standin_sql.register(self.database, self.db_path)
+        datagen.load_cloud(server.mock, dataset, self.store_id)  # An existing fleet, already in sync
+        self.cycles = []  # Wall seconds of every finished cycle
+        self.pos_deltas = {}  # item_key -> In_Stock change made by the POS traffic
+        self.agents = []
+        self.agent = self.add_agent()
+
+    def add_agent(self):
+        """Another agent on this store's database - the first one, or a second install with its own state"""
+        suffix = f'-{len(self.agents) + 1}' if self.agents else ''
+        agent = self.make_legacy(suffix) if self.kind == 'legacy' else self.make_store(suffix)
+        self.agents.append(agent)
+        return agent
+
+    def make_legacy(self, suffix=''):
+        config_path = os.path.join(self.workdir, f'{self.store_id}{suffix}.ini')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            f.write(f"[database]\nconnection_string = DRIVER={{{standin_sql.DRIVER_NAME}}};SERVER=localhost;DATABASE={self.database};"
+                    f"Trusted_Connection=yes;\ncloud_store_id = {self.store_id}\nlocal_store_id = {self.dataset.store_id}\n\n"
+                    f"[supabase]\nurl = {self.server.url}\nkey = fleet-key\n\n[sync]\ninterval_seconds = {self.interval}\n")
+        agent = sync_agent.SyncAgent(config_path)
+        agent.sync_state_file = os.path.join(self.workdir, f'{self.store_id}{suffix}_sync_state.json')  # Not the one next to the script
+        agent.agent_id += suffix  # hostname:pid is the same for every agent in this process
+        return agent
+
+    def make_store(self, suffix=''):
+        settings = {
+            'CLOUD_STORE_ID': self.store_id,
+            'SQL_SERVER': 'localhost',
+            'SQL_DATABASE': self.database,
+            'SYNC_INTERVAL': self.interval,
+            'supa_url': self.server.url,
+            'supa_key': 'fleet-key',
+            'METRICS_FILE': '',
+        }
+        agent = store_agent.SyncAgent(settings, state_db=os.path.join(self.workdir, f'state_{self.store_id}{suffix}.db'))
+        if not agent.start():
+            raise RuntimeError(f'{self.store_id}: stand-in database did not connect')
+        return agent
+
+    def run(self, stop, offset, agent=None):
+        """An agent's own loop: cycle, then sleep the interval (first cycle after a random offset)"""
+        agent = agent or self.agent
+        if stop.wait(offset):
+            return
+        while not stop.is_set():
+            started = time.perf_counter()
+            agent.run_cycle()
+            self.cycles.append(time.perf_counter() - started)
+            stop.wait(self.interval)
+
+    def traffic(self, stop, events_per_minute):
+        """POS traffic, applied once a second"""
+        owed = 0.0
+        while not stop.wait(1.0):
+            owed += events_per_minute / 60
+            if owed >= 1:
+                events = self.stream.pos_events(int(owed))
+                datagen.apply_pos(self.db_path, events)
+                for e in events:
+                    if e['kind'] in ('sale', 'receive'):
+                        key = e['item_num'].rstrip().casefold()
+                        self.pos_deltas[key] = self.pos_deltas.get(key, 0) + (e['qty'] if e['kind'] == 'receive' else -e['qty'])
+                owed -= int(owed)
+
+    def close(self):
+        for agent in self.agents:
+            agent.close()
+
+
+class Propagation:
+    """Marked price writes on random items of every store, timed with probe.Tracker (in-process reads, no requests)"""
+
+    def __init__(self, mock, stores, timeout, seed):
+        self.mock = mock
+        self.stores = stores
+        self.rng = random.Random(seed)
+        self.seq = 0
+        self.tracker = probe.Tracker(timeout)
+
+    def marker(self):
+        self.seq += 1
+        return round(MARKER_BASE + self.seq / 100, 2)
+
+    def write(self, store, direction):
+        item_num = store.stream.pick()['ItemNum']
+        marker = self.marker()
+        if direction == 'web_to_local':
+            datagen.apply_web(self.mock, store.store_id, [{'kind': 'price', 'item_num': item_num.strip(), 'value': marker}])
+        else:
+            datagen.apply_pos(store.db_path, [{'kind': 'price', 'item_num': item_num, 'price': marker}])
+        self.tracker.sent(direction, (store, item_num), marker)
+
+    def writer(self, stop, per_minute):
+        """Alternate directions over every store, per_minute writes per store and direction"""
+        if not per_minute:
+            return
+        pause = 60 / (per_minute * len(probe.DIRECTIONS) * len(self.stores))
+        for n in range(10 ** 9):
+            if stop.wait(pause * self.rng.uniform(0.5, 1.5)):
+                return
+            self.write(self.stores[n // 2 % len(self.stores)], probe.DIRECTIONS[n % 2])
+
+    def seen(self, direction, key, marker, connections):
+        store, item_num = key
+        if direction == 'web_to_local':
+            conn = connections.get(store.store_id)
+            if conn is None:
+                conn = connections[store.store_id] = standin_sql.open_sqlite(store.db_path)
+            row = conn.execute('SELECT Price FROM Inventory WHERE ItemNum = ?', (item_num,)).fetchone()
+        else:
+            with self.mock.lock:
+                row = self.mock.conn.execute('SELECT price FROM inventory WHERE store_id = ? AND item_num = ?',
+                                             (store.store_id, item_num.strip())).fetchone()
+        return row is not None and row[0] is not None and abs(row[0] - marker) < 0.001
+
+    def poller(self, stop, every=0.25):
+        connections = {}
+        seen = lambda direction, key, marker: self.seen(direction, key, marker, connections)
+        try:
+            while not stop.wait(every):
+                self.tracker.settle(seen)
+            self.tracker.settle(seen, final=True)
+        finally:
+            for conn in connections.values():
+                conn.close()
+
+    def report(self):
+        return {d: {**self.tracker.summary(d), 'unresolved': self.tracker.unresolved[d]} for d in probe.DIRECTIONS}
+
+
+def run_step(workdir, n, args, conditions):
+    """One fleet size on a fresh mock; returns its report"""
+    server = serve(conditions=conditions)
+    stores = []
+    threads = []
+    stop = threading.Event()
+    rng = random.Random(args.seed + n)
+    try:
+        for i in range(n):
+            stores.append(SimStore(i + 1, args.kind, workdir, server, datagen.generate_store(args.items, seed=args.seed + i + 1), args.interval))
+        propagation = Propagation(server.mock, stores, args.probe_timeout or 3 * args.interval + 30, args.seed)
+        before = server.mock.snapshot()
+        faults_before = dict(conditions.faults)
+        cpu_before, wall_before = time.process_time(), time.perf_counter()
+        for store in stores:
+            threads.append(threading.Thread(target=store.run, args=(stop, rng.uniform(0, args.interval)), daemon=True))
+            if args.pos_rate:
+                threads.append(threading.Thread(target=store.traffic, args=(stop, args.pos_rate), daemon=True))
+        threads.append(threading.Thread(target=propagation.writer, args=(stop, args.probe_rate), daemon=True))
+        poller = threading.Thread(target=propagation.poller, args=(stop,), daemon=True)
+        for t in threads + [poller]:
+            t.start()
+        stop.wait(args.duration)
+        stop.set()
+        for t in threads:
+            t.join(timeout=max(60, 3 * args.interval))
+        poller.join(timeout=60)
+        wall = time.perf_counter() - wall_before
+        cpu = time.process_time() - cpu_before
+        after = server.mock.snapshot()
+    finally:
+        stop.set()
+        for store in stores:
+            store.close()
+        server.stop()
+
+    served = {}
+    for key, s in after.items():
+        b = before.get(key, {})
+        served[key] = {field: s[field] - b.get(field, 0) for field in s}
+    total = lambda field: sum(s[field] for s in served.values())
+    cycles = [c for store in stores for c in store.cycles]
+    busiest = sorted(served.items(), key=lambda kv: -kv[1]['requests'])[:5]
+    return {
+        'stores': n,
+        'seconds': round(wall, 1),
+        'requests_per_second': round(total('requests') / wall, 1),
+        'rows_per_second': round(total('rows') / wall, 1),
+        'kb_up_per_second': round(total('bytes_in') / 1024 / wall, 1),
+        'kb_down_per_second': round(total('bytes_out') / 1024 / wall, 1),
+        'errors': total('errors'),
+        'injected': total('injected'),
+        'faults': {kind: count - faults_before[kind] for kind, count in conditions.faults.items()},
+        'busy': round(total('seconds') / wall, 3),
+        'cpu': round(cpu / wall, 3),
+        'cycles': len(cycles),
+        'cycle_p50': round(probe.percentile(cycles, 50), 2) if cycles else None,
+        'cycle_p99': round(probe.percentile(cycles, 99), 2) if cycles else None,
+        'propagation': propagation.report(),
+        'top_endpoints': {f'{method} {table}': s['requests'] for (method, table), s in busiest},
+    }
+
+
+def print_report(report):
+    network = ', '.join(f'{k}={v}' for k, v in report['network'].items() if v) or 'unthrottled'
+    print(f"{report['kind']} agents, {report['items']} items/store, {report['interval']}s interval, network: {network}")
+    print(f"{'stores':>6}{'req/s':>8}{'rows/s':>9}{'KB/s up':>9}{'KB/s dn':>9}{'errors':>7}{'busy':>6}{'cpu':>6}"
+          f"{'cycles':>7}{'p50 s':>7}{'p99 s':>7}  {'web->local p50/p99 lost':<26}{'pos->cloud p50/p99 lost':<26}")
+    for r in report['steps']:
+        prop = []
+        for direction in ('web_to_local', 'pos_to_cloud'):
+            p = r['propagation'][direction]
+            fmt = lambda v: f'{v:.1f}' if v is not None else '-'
+            prop.append(f"{fmt(p['p50'])}/{fmt(p['p99'])} {p['lost']}")
+        fmt = lambda v: f'{v:.2f}' if v is not None else '-'
+        print(f"{r['stores']:>6}{r['requests_per_second']:>8.1f}{r['rows_per_second']:>9.0f}{r['kb_up_per_second']:>9.1f}"
+              f"{r['kb_down_per_second']:>9.1f}{r['errors']:>7}{r['busy']:>6.0%}{r['cpu']:>6.0%}{r['cycles']:>7}"
+              f"{fmt(r['cycle_p50']):>7}{fmt(r['cycle_p99']):>7}  {prop[0]:<26}{prop[1]:<26}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Many store agents in one process against the mock cloud')
+    parser.add_argument('--fleet', default='1,5,10,25', help='Comma-separated fleet sizes to step through')
+    parser.add_argument('--kind', choices=KINDS, default='legacy')
+    parser.add_argument('--items', type=int, default=500, help='Catalogue size per store')
+    parser.add_argument('--duration', type=float, default=120, help='Seconds per fleet size')
+    parser.add_argument('--interval', type=int, default=30, help='Agent sync interval (seconds)')
+    parser.add_argument('--pos-rate', type=float, default=30, help='POS events per store and minute')
+    parser.add_argument('--probe-rate', type=float, default=2, help='Marked writes per store, direction and minute')
+    parser.add_argument('--probe-timeout', type=float, default=None, help='Seconds before a marked write counts as lost (default 3 intervals + 30)')
+    network_arguments(parser)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING', help='Agent log level (the log goes to agents.log)')
+    parser.add_argument('--out', default=None, help='Also write the results as JSON')
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--keep', action='store_true')
+    args = parser.parse_args(argv)
+    os.environ.pop('SUPABASE_URL', None)
+    os.environ.pop('SUPABASE_KEY', None)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='fleet-sim-')
+    os.makedirs(workdir, exist_ok=True)
+    log_file = open(os.path.join(workdir, 'agents.log'), 'w', encoding='utf-8')
+    root = logging.getLogger()
+    root.setLevel(args.log_level.upper())
+    root.addHandler(logging.StreamHandler(log_file))
+
+    conditions = conditions_from_args(args, seed=args.seed)
+    report = {'kind': args.kind, 'items': args.items, 'interval': args.interval, 'network': conditions.describe(), 'steps': []}
+    try:
+        for n in [int(s) for s in args.fleet.split(',') if s.strip()]:
+            step_dir = os.path.join(workdir, f'fleet_{n}')
+            os.makedirs(step_dir, exist_ok=True)
+            print(f"[FLEET] {n} {args.kind} agents for {args.duration:.0f}s...", flush=True)
+            with contextlib.redirect_stdout(log_file):
+                report['steps'].append(run_step(step_dir, n, args, conditions))
+    finally:
+        root.handlers = [h for h in root.handlers if getattr(h, 'stream', None) is not log_file]
+        log_file.close()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif args.keep:
+            print(f"[FLEET] Work directory kept: {workdir}")
+    print_report(report)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
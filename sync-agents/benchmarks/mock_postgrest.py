@@ -0,0 +1,867 @@
+"""
+Mock PostgREST
+==============
+A local stand-in for the Supabase REST API (/rest/v1) the agents talk to, backed
+by SQLite, so sync cycles can be benchmarked without touching the real project.
+
+    mock = MockPostgREST()            # in-memory; MockPostgREST('cloud.db') to keep it
+    server = serve(mock)              # http://127.0.0.1:<port> on a daemon thread
+    agent profile: supa_url = server.url
+
+Covers what the agents use:
+- GET with select (incl. one level of embedding: transfers?select=*,transfer_items(*)),
+  column filters (eq, neq, gt, gte, lt, lte, like, ilike, in, is, not.*), and=/or= logic
+  trees (keyset cursors), order, limit, offset
+- POST insert / upsert (Prefer: resolution=merge-duplicates, on_conflict=...),
+  PATCH and DELETE with filters, Prefer: return=representation
+- RPC: claim_transfers, release_transfer_claims (sql/transfer_claims.sql)
+- Database-side behaviour the agents rely on: generated ids and timestamps,
+  updated_at = NOW() on every update (one NOW() per request, like one transaction),
+  the inventory_tombstones feed for soft deletes (sql/inventory_tombstones.sql)
+
+Unknown tables / columns and over-long VARCHAR values are rejected with PostgREST's
+status codes and error bodies, so a payload the real API would refuse fails here too.
+
+Every request is counted in `stats` (per method and table: requests, rows, bytes,
+server time, injected failures) for the benchmarks. Like Supabase, a GET returns at
+most MAX_ROWS rows.
+
+The HTTP server can emulate the store's uplink (Conditions): added latency with
+jitter, per-direction bandwidth caps, packet loss (as retransmission delays), and
+injected faults - 5xx and 429 answers that touch no data, connection resets, and
+responses cut off after the request WAS applied. Named profiles (NETWORK_PROFILES,
+e.g. store_dsl, flaky_uplink = 300 ms RTT with 2% loss) or an INI file select them:
+
+    python mock_postgrest.py --network flaky_uplink
+    python mock_postgrest.py --network network.ini:store_k --error-rate 0.05
+"""
+
+import contextlib
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+from configparser import ConfigParser
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# column type: 'text', 'uuid' (generated), 'serial', 'real', 'int', 'bool', 'json', 'now' (timestamp, DEFAULT NOW())
+TABLES = {
+    'stores': {
+        'columns': {'id': 'uuid', 'store_id': 'text', 'store_name': 'text', 'address': 'text', 'phone': 'text',
+                    'manager_email': 'text', 'is_active': 'bool', 'created_at': 'now', 'updated_at': 'now'},
+        'key': ('store_id',), 'touch': True,
+    },
+    'inventory': {
+        'columns': {'id': 'uuid', 'item_num': 'text', 'item_name': 'text', 'store_id': 'text', 'cost': 'real',
+                    'price': 'real', 'retail_price': 'real', 'in_stock': 'real', 'reorder_level': 'real',
+                    'reorder_quantity': 'real', 'dept_id': 'text', 'vendor_number': 'text', 'unit_type': 'text',
+                    'unit_size': 'real', 'itemtype': 'int', 'last_sold': 'text', 'last_synced_at': 'now',
+                    'created_at': 'now', 'updated_at': 'now'},
+        'key': ('item_num', 'store_id'), 'touch': True,
+        'indexes': [('store_id', 'updated_at', 'item_num')],
+    },
+    'departments': {
+        'columns': {'id': 'uuid', 'dept_id': 'text', 'store_id': 'text', 'dept_name': 'text', 'description': 'text',
+                    'last_synced_at': 'now', 'created_at': 'now', 'updated_at': 'now'},
+        'key': ('dept_id', 'store_id'), 'touch': True,
+        'indexes': [('store_id', 'updated_at')],
+    },
+    'transfers': {
+        'columns': {'id': 'uuid', 'transfer_number': 'text', 'from_store_id': 'text', 'to_store_id': 'text',
+                    'status': 'text', 'notes': 'text', 'created_by': 'text', 'approved_by': 'text', 'created_at': 'now',
+                    'approved_at': 'text', 'shipped_at': 'text', 'completed_at': 'text', 'updated_at': 'now'},
+        'key': ('id',), 'touch': True,
+        'indexes': [('from_store_id', 'status'), ('to_store_id', 'status'), ('updated_at',)],
+    },
+    'transfer_items': {
+        'columns': {'id': 'uuid', 'transfer_id': 'text', 'item_num': 'text', 'item_name': 'text', 'quantity': 'real',
+                    'unit_cost': 'real', 'created_at': 'now'},
+        'key': ('id',),
+        'indexes': [('transfer_id',)],
+    },
+    'transfer_claims': {
+        'columns': {'transfer_id': 'text', 'direction': 'text', 'store_id': 'text', 'agent_id': 'text',
+                    'attempts': 'int', 'claimed_at': 'now'},
+        'key': ('transfer_id', 'direction'),
+    },
+    'inventory_changes': {
+        'columns': {'id': 'uuid', 'item_num': 'text', 'item_name': 'text', 'store_id': 'text', 'change_type': 'text',
+                    'quantity_change': 'real', 'old_stock': 'real', 'new_stock': 'real', 'transfer_id': 'text',
+                    'notes': 'text', 'created_at': 'now'},
+        'key': ('id',),
+    },
+    'inventory_tombstones': {
+        'columns': {'id': 'serial', 'item_num': 'text', 'store_id': 'text', 'deleted_at': 'now'},
+        'key': ('id',),
+        'indexes': [('store_id', 'id')],
+    },
+    'sync_log': {
+        'columns': {'id': 'uuid', 'store_id': 'text', 'sync_type': 'text', 'status': 'text', 'records_synced': 'int',
+                    'error_message': 'text', 'started_at': 'now', 'completed_at': 'text', 'duration_ms': 'int',
+                    'bytes_sent': 'int', 'bytes_received': 'int', 'errors': 'int', 'phases': 'json'},
+        'key': ('id',),
+    },
+}
+# VARCHAR(n) columns (sql/schema.sql) - longer values are rejected like Postgres does
+LENGTHS = {
+    ('stores', 'store_id'): 10, ('inventory', 'item_num'): 20, ('inventory', 'item_name'): 30,
+    ('inventory', 'store_id'): 10, ('inventory', 'dept_id'): 8, ('inventory', 'vendor_number'): 12,
+    ('inventory', 'unit_type'): 10, ('departments', 'dept_id'): 8, ('departments', 'store_id'): 10,
+    ('departments', 'description'): 30, ('transfers', 'transfer_number'): 20, ('transfer_items', 'item_num'): 20,
+    ('transfer_items', 'item_name'): 30, ('sync_log', 'store_id'): 10, ('sync_log', 'sync_type'): 20,
+    ('sync_log', 'status'): 20,
+}
+EMBEDS = {('transfers', 'transfer_items'): ('id', 'transfer_id')}  # parent column, child column
+
+TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS inventory_tombstone_insert AFTER INSERT ON inventory
+WHEN NEW.item_name = 'DELETED'
+BEGIN
+    INSERT INTO inventory_tombstones (item_num, store_id, deleted_at) VALUES (NEW.item_num, NEW.store_id, NEW.updated_at);
+END;
+CREATE TRIGGER IF NOT EXISTS inventory_tombstone_update AFTER UPDATE OF item_name ON inventory
+WHEN NEW.item_name = 'DELETED' AND OLD.item_name IS NOT 'DELETED'
+BEGIN
+    INSERT INTO inventory_tombstones (item_num, store_id, deleted_at) VALUES (NEW.item_num, NEW.store_id, NEW.updated_at);
+END;
+"""
+
+OPERATORS = {'eq': '=', 'neq': '<>', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<=', 'like': 'LIKE', 'ilike': 'LIKE'}
+MAX_ROWS = 1000  # Supabase's default "Max rows": a GET never returns more, whatever limit= says
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+
+class ApiError(Exception):
+    """Becomes a PostgREST-style error response"""
+    def __init__(self, status, code, message, details=None):
+        super().__init__(message)
+        self.status, self.code, self.message, self.details = status, code, message, details
+
+    def body(self):
+        return {'code': self.code, 'message': self.message, 'details': self.details, 'hint': None}
+
+
+def split_top(text, sep=','):
+    """Split on sep outside parentheses and double quotes"""
+    parts, depth, quoted, current, escaped = [], 0, False, [], False
+    for ch in text:
+        if escaped:
+            current.append(ch)
+            escaped = False
+            continue
+        if ch == '\\' and quoted:
+            current.append(ch)
+            escaped = True
+            continue
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        if ch == sep and depth == 0 and not quoted:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+    parts.append(''.join(current))
+    return parts
+
+
+def unquote(value):
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', value[1:-1])
+    return value
+
+
+class MockPostgREST:
+    def __init__(self, path=':memory:', max_rows=MAX_ROWS):
+        self.max_rows = max_rows  # None = unlimited
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        self.clock = None  # Last NOW() handed out - strictly increasing
+        self.stats = {}  # (method, table) -> {'requests', 'rows', 'bytes_in', 'bytes_out', 'seconds', 'errors'}
+        self.stats_lock = threading.Lock()
+        self.create_schema()
+
+    # --- schema ---
+    def create_schema(self):
+        for table, spec in TABLES.items():
+            cols = []
+            for name, kind in spec['columns'].items():
+                if kind == 'serial':
+                    cols.append(f'"{name}" INTEGER PRIMARY KEY AUTOINCREMENT')
+                else:
+                    affinity = {'real': 'REAL', 'int': 'INTEGER', 'bool': 'INTEGER'}.get(kind, 'TEXT')
+                    cols.append(f'"{name}" {affinity}')
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ({", ".join(cols)})')
+            if spec['columns'].get(spec['key'][0]) != 'serial':
+                key = ', '.join(f'"{c}"' for c in spec['key'])
+                self.conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_key ON {table} ({key})')
+            for n, index in enumerate(spec.get('indexes', [])):
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_{n} ON {table} ({", ".join(index)})')
+        self.conn.executescript(TRIGGERS)
+
+    def now(self):
+        """One NOW() per request; strictly increasing so keyset tests see distinct instants between requests"""
+        now = datetime.now(timezone.utc)
+        if self.clock is not None and now <= self.clock:
+            now = self.clock + timedelta(microseconds=1)
+        self.clock = now
+        return now.isoformat(timespec='microseconds')
+
+    # --- helpers ---
+    def spec(self, table):
+        spec = TABLES.get(table)
+        if spec is None:
+            raise ApiError(404, 'PGRST205', f"Could not find the table 'public.{table}' in the schema cache")
+        return spec
+
+    def column(self, table, name):
+        if name not in self.spec(table)['columns']:
+            raise ApiError(400, '42703', f'column {table}.{name} does not exist')
+        return self.spec(table)['columns'][name]
+
+    def coerce(self, table, column, value, write=False):
+        kind = self.column(table, column)
+        if value is None:
+            return None
+        if kind == 'bool':
+            return 1 if str(value).lower() in ('true', '1', 't') else 0
+        if kind in ('real', 'int', 'serial'):
+            try:
+                return float(value) if kind == 'real' else int(float(value))
+            except (TypeError, ValueError):
+                raise ApiError(400, '22P02', f'invalid input syntax for type {kind}: "{value}"')
+        if kind == 'json':
+            return value if isinstance(value, str) else json.dumps(value)
+        value = str(value)
+        limit = LENGTHS.get((table, column)) if write else None  # Filters compare, they don't cast to the column
+        if limit is not None and len(value) > limit:
+            raise ApiError(400, '22001', f'value too long for type character varying({limit})')
+        return value
+
+    def to_json(self, table, row):
+        out = {}
+        columns = self.spec(table)['columns']
+        for key in row.keys():
+            value = row[key]
+            kind = columns.get(key)
+            if kind == 'bool' and value is not None:
+                value = bool(value)
+            elif kind == 'json' and value is not None:
+                value = json.loads(value)
+            out[key] = value
+        return out
+
+    # --- filters ---
+    def condition(self, table, column, expr):
+        """col + 'op.value' -> (sql, params)"""
+        negate = expr.startswith('not.')
+        if negate:
+            expr = expr[4:]
+        op, _, value = expr.partition('.')
+        self.column(table, column)
+        col = f'"{column}"'
+        if op == 'in':
+            if not (value.startswith('(') and value.endswith(')')):
+                raise ApiError(400, 'PGRST100', f'"failed to parse filter (in.{value})"')
+            values = [self.coerce(table, column, unquote(v)) for v in split_top(value[1:-1]) if v != '']
+            sql = f'{col} IN ({", ".join("?" * len(values))})' if values else '0'
+            params = values
+        elif op == 'is':
+            mapping = {'null': 'IS NULL', 'not_null': 'IS NOT NULL', 'true': '= 1', 'false': '= 0'}
+            if value.lower() not in mapping:
+                raise ApiError(400, 'PGRST100', f'"failed to parse filter (is.{value})"')
+            sql, params = f'{col} {mapping[value.lower()]}', []
+        elif op in OPERATORS:
+            value = unquote(value)
+            if op in ('like', 'ilike'):
+                value = value.replace('*', '%')
+            sql, params = f'{col} {OPERATORS[op]} ?', [self.coerce(table, column, value)]
+        else:
+            raise ApiError(400, 'PGRST100', f'"failed to parse filter ({op}.{value})"')
+        return (f'NOT ({sql})', params) if negate else (sql, params)
+
+    def logic(self, table, op, body):
+        """and / or tree: body is '(expr,expr,...)'"""
+        if not (body.startswith('(') and body.endswith(')')):
+            raise ApiError(400, 'PGRST100', f'"failed to parse logic tree ({body})"')
+        parts, params = [], []
+        for expr in split_top(body[1:-1]):
+            negate = expr.startswith('not.')
+            inner = expr[4:] if negate else expr
+            nested = re.match(r'^(and|or)(\(.*\))$', inner, re.S)
+            if nested:
+                sql, p = self.logic(table, nested.group(1), nested.group(2))
+            else:
+                column, _, rest = inner.partition('.')
+                sql, p = self.condition(table, column, rest)
+            parts.append(f'NOT ({sql})' if negate else f'({sql})')
+            params += p
+        return f' {op.upper()} '.join(parts) or '1', params
+
+    def where(self, table, params):
+        clauses, values = [], []
+        for key, value in params:
+            if key in RESERVED_PARAMS:
+                continue
+            negate = key.startswith('not.')
+            op = key[4:] if negate else key
+            if op in ('and', 'or'):
+                sql, p = self.logic(table, op, value)
+            else:
+                sql, p = self.condition(table, key, value)
+            clauses.append(f'NOT ({sql})' if negate and op in ('and', 'or') else f'({sql})')
+            values += p
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', values
+
+    def order_by(self, table, spec):
+        terms = []
+        for term in split_top(spec):
+            parts = term.split('.')
+            self.column(table, parts[0])
+            direction = 'DESC' if 'desc' in parts[1:] else 'ASC'
+            nulls = 'NULLS FIRST' if 'nullsfirst' in parts[1:] or (direction == 'DESC' and 'nullslast' not in parts[1:]) else 'NULLS LAST'
+            terms.append(f'"{parts[0]}" {direction} {nulls}')
+        return ' ORDER BY ' + ', '.join(terms)
+
+    def parse_select(self, table, select):
+        columns, embeds = [], []
+        for item in split_top(select or '*'):
+            item = item.strip()
+            embedded = re.match(r'^(\w+)\((.*)\)$', item)
+            if embedded:
+                child = embedded.group(1)
+                if (table, child) not in EMBEDS:
+                    raise ApiError(400, 'PGRST200', f"Could not find a relationship between '{table}' and '{child}' in the schema cache")
+                embeds.append((child, embedded.group(2)))
+            elif item == '*':
+                columns = ['*']
+            elif item:
+                self.column(table, item.split(':')[-1])
+                columns.append(item.split(':')[-1])
+        return columns or ['*'], embeds
+
+    # --- operations ---
+    def select(self, table, params):
+        self.spec(table)
+        query = dict(params)
+        columns, embeds = self.parse_select(table, query.get('select'))
+        where, values = self.where(table, params)
+        sql = f'SELECT {", ".join("*" if c == "*" else f"{chr(34)}{c}{chr(34)}" for c in columns)}'
+        if embeds and columns != ['*']:
+            sql += ', ' + ', '.join(f'"{EMBEDS[(table, child)][0]}" AS "__embed_key_{child}"' for child, _ in embeds)
+        sql += f' FROM {table}{where}'
+        if 'order' in query:
+            sql += self.order_by(table, query['order'])
+        limits = [int(query['limit'])] if 'limit' in query else []
+        if self.max_rows:
+            limits.append(self.max_rows)
+        if limits:
+            sql += ' LIMIT ?'
+            values.append(min(limits))
+            if 'offset' in query:
+                sql += ' OFFSET ?'
+                values.append(int(query['offset']))
+        rows = [self.to_json(table, r) for r in self.conn.execute(sql, values)]
+        for child, child_select in embeds:
+            parent_col, child_col = EMBEDS[(table, child)]
+            keys = [r.pop(f'__embed_key_{child}', None) or r.get(parent_col) for r in rows]
+            children = {}
+            for i in range(0, len(keys), 500):
+                batch = [k for k in keys[i:i + 500] if k is not None]
+                if not batch:
+                    continue
+                cols, _ = self.parse_select(child, child_select)
+                fetch = ', '.join('*' if c == '*' else f'"{c}"' for c in cols)
+                extra = '' if cols == ['*'] or child_col in cols else f', "{child_col}" AS "__parent"'
+                for r in self.conn.execute(f'SELECT {fetch}{extra} FROM {child} WHERE "{child_col}" IN ({", ".join("?" * len(batch))})', batch):
+                    row = self.to_json(child, r)
+                    parent = row.pop('__parent', None) or row.get(child_col)
+                    children.setdefault(parent, []).append(row)
+            for row, key in zip(rows, keys):
+                row[child] = children.get(key, [])
+        return rows
+
+    def prepare_row(self, table, row, now):
+        spec = self.spec(table)
+        if not isinstance(row, dict):
+            raise ApiError(400, 'PGRST102', 'All object keys must match')
+        for key in row:
+            if key not in spec['columns']:
+                raise ApiError(400, 'PGRST204', f"Could not find the '{key}' column of '{table}' in the schema cache")
+        out = {k: self.coerce(table, k, v, write=True) for k, v in row.items()}
+        for name, kind in spec['columns'].items():
+            if name in out:
+                continue
+            if kind == 'uuid':
+                out[name] = str(uuid.uuid4())
+            elif kind == 'now':
+                out[name] = now
+            elif name == 'attempts':
+                out[name] = 1
+        if spec.get('touch') and 'updated_at' in spec['columns']:
+            out['updated_at'] = now
+        return out
+
+    def insert(self, table, rows, upsert=False, on_conflict=None, ignore_duplicates=False, returning=False):
+        spec = self.spec(table)
+        now = self.now()
+        if isinstance(rows, dict):
+            rows = [rows]
+        key = tuple(on_conflict.split(',')) if on_conflict else spec['key']
+        for k in key:
+            self.column(table, k)
+        result = []
+        self.conn.execute('BEGIN')
+        try:
+            for raw in rows:
+                row = self.prepare_row(table, raw, now)
+                cols = list(row)
+                sql = f'INSERT INTO {table} ({", ".join(f"{chr(34)}{c}{chr(34)}" for c in cols)}) VALUES ({", ".join("?" * len(cols))})'
+                if upsert or ignore_duplicates:
+                    target = ', '.join(f'"{k}"' for k in key)
+                    # Only what the client sent is merged (+ updated_at); generated ids / created_at stay
+                    sent = [c for c in cols if c in raw or c == 'updated_at' and spec.get('touch')]
+                    updates = ', '.join(f'"{c}" = excluded."{c}"' for c in sent if c not in key)
+                    if ignore_duplicates or not updates:
+                        sql += f' ON CONFLICT ({target}) DO NOTHING'
+                    else:
+                        sql += f' ON CONFLICT ({target}) DO UPDATE SET {updates}'
+                sql += ' RETURNING *'
+                result += [self.to_json(table, r) for r in self.conn.execute(sql, [row[c] for c in cols]).fetchall()]
+            self.conn.execute('COMMIT')
+        except sqlite3.IntegrityError as e:
+            self.conn.execute('ROLLBACK')
+            raise ApiError(409, '23505', f'duplicate key value violates unique constraint ({e})')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return result
+
+    def update(self, table, values, params):
+        spec = self.spec(table)
+        if not isinstance(values, dict):
+            raise ApiError(400, 'PGRST102', 'Update body must be an object')
+        now = self.now()
+        sets = {k: self.coerce(table, k, v, write=True) for k, v in values.items()}
+        if spec.get('touch') and 'updated_at' in spec['columns']:
+            sets['updated_at'] = now
+        where, params_values = self.where(table, params)
+        if not sets:
+            return []
+        sql = f'UPDATE {table} SET {", ".join(f"{chr(34)}{c}{chr(34)} = ?" for c in sets)}{where} RETURNING *'
+        self.conn.execute('BEGIN')
+        try:
+            rows = [self.to_json(table, r) for r in self.conn.execute(sql, list(sets.values()) + params_values).fetchall()]
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def delete(self, table, params):
+        self.spec(table)
+        where, values = self.where(table, params)
+        self.conn.execute('BEGIN')
+        try:
+            rows = [self.to_json(table, r) for r in self.conn.execute(f'DELETE FROM {table}{where} RETURNING *', values).fetchall()]
+            if table == 'transfers' and rows:  # ON DELETE CASCADE
+                ids = [r['id'] for r in rows]
+                for i in range(0, len(ids), 500):
+                    batch = ids[i:i + 500]
+                    marks = ", ".join("?" * len(batch))
+                    self.conn.execute(f'DELETE FROM transfer_items WHERE transfer_id IN ({marks})', batch)
+                    self.conn.execute(f'DELETE FROM transfer_claims WHERE transfer_id IN ({marks})', batch)
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    # --- RPC (sql/transfer_claims.sql) ---
+    def rpc(self, function, args):
+        if function == 'claim_transfers':
+            return self.claim_transfers(**args)
+        if function == 'release_transfer_claims':
+            return self.release_transfer_claims(**args)
+        raise ApiError(404, 'PGRST202', f'Could not find the function public.{function} in the schema cache')
+
+    def claim_transfers(self, p_store_id, p_direction, p_agent_id=None, p_limit=50, p_lease_seconds=300):
+        if p_direction not in ('in', 'out'):
+            raise ApiError(400, 'P0001', f"claim_transfers: direction must be 'in' or 'out', got {p_direction}")
+        now = self.now()
+        expired = (datetime.fromisoformat(now) - timedelta(seconds=p_lease_seconds)).isoformat(timespec='microseconds')
+        if p_direction == 'out':
+            side = "t.from_store_id = ? AND t.status IN ('approved', 'completed', 'received') AND t.shipped_at IS NULL"
+        else:
+            side = "t.to_store_id = ? AND t.status = 'completed'"
+        self.conn.execute('BEGIN')
+        try:
+            ids = [r[0] for r in self.conn.execute(f"""
+                SELECT t.id FROM transfers t
+                LEFT JOIN transfer_claims c ON c.transfer_id = t.id AND c.direction = ?
+                WHERE {side} AND (c.transfer_id IS NULL OR c.claimed_at < ?)
+                ORDER BY t.updated_at LIMIT ?""", (p_direction, p_store_id, expired, int(p_limit)))]
+            for transfer_id in ids:
+                self.conn.execute("""
+                    INSERT INTO transfer_claims (transfer_id, direction, store_id, agent_id, attempts, claimed_at)
+                    VALUES (?, ?, ?, ?, 1, ?)
+                    ON CONFLICT (transfer_id, direction) DO UPDATE
+                    SET agent_id = excluded.agent_id, claimed_at = excluded.claimed_at, attempts = attempts + 1""",
+                                  (transfer_id, p_direction, p_store_id, p_agent_id, now))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        if not ids:
+            return []
+        transfers = self.select('transfers', [('id', f'in.({",".join(ids)})'), ('select', '*,transfer_items(*)'), ('order', 'updated_at.asc')])
+        for t in transfers:
+            t['items'] = t.pop('transfer_items')
+        return transfers
+
+    def release_transfer_claims(self, p_transfer_ids, p_direction):
+        if not p_transfer_ids:
+            return 0
+        marks = ', '.join('?' * len(p_transfer_ids))
+        cur = self.conn.execute(f'DELETE FROM transfer_claims WHERE direction = ? AND transfer_id IN ({marks})',
+                                [p_direction] + list(p_transfer_ids))
+        return cur.rowcount
+
+    # --- HTTP entry point ---
+    def handle(self, method, path, query, headers, body):
+        """One REST call -> (status, response headers, body bytes)"""
+        started = time.perf_counter()
+        parts = urlsplit(path)
+        segments = [s for s in parts.path.split('/') if s]
+        table = '/'.join(segments[2:]) if segments[:2] == ['rest', 'v1'] else None
+        params = parse_qsl(query if query is not None else parts.query, keep_blank_values=True)
+        prefer = {p.strip() for p in headers.get('Prefer', '').split(',') if p.strip()}
+        status, result = 200, None
+        try:
+            if table is None:
+                raise ApiError(404, 'PGRST125', f'Invalid path {parts.path}')
+            payload = json.loads(body) if body else None
+            with self.lock:
+                if table.startswith('rpc/'):
+                    if method != 'POST':
+                        raise ApiError(405, 'PGRST101', 'Only POST is supported for rpc')
+                    result = self.rpc(table[4:], payload or {})
+                elif method == 'GET':
+                    result = self.select(table, params)
+                elif method == 'POST':
+                    query_map = dict(params)
+                    rows = self.insert(table, payload, upsert='resolution=merge-duplicates' in prefer,
+                                       on_conflict=query_map.get('on_conflict'),
+                                       ignore_duplicates='resolution=ignore-duplicates' in prefer)
+                    status, result = (201, rows) if 'return=representation' in prefer else (201, None)
+                elif method == 'PATCH':
+                    rows = self.update(table, payload or {}, params)
+                    status, result = (200, rows) if 'return=representation' in prefer else (204, None)
+                elif method == 'DELETE':
+                    rows = self.delete(table, params)
+                    status, result = (200, rows) if 'return=representation' in prefer else (204, None)
+                else:
+                    raise ApiError(405, 'PGRST117', f'Unsupported HTTP method: {method}')
+        except ApiError as e:
+            status, result = e.status, e.body()
+        except json.JSONDecodeError as e:
+            status, result = 400, ApiError(400, 'PGRST102', f'Empty or invalid json: {e}').body()
+        except sqlite3.Error as e:
+            status, result = 400, ApiError(400, 'XX000', str(e)).body()
+        data = json.dumps(result).encode('utf-8') if result is not None else b''
+        self.record(method, table, status, len(body or b''), len(data), time.perf_counter() - started,
+                    len(result) if isinstance(result, list) else 0)
+        return status, {'Content-Type': 'application/json; charset=utf-8'}, data
+
+    def record(self, method, table, status, bytes_in, bytes_out, seconds, rows, injected=False, request=True):
+        """Count one request (request=False: only an injected fault on a request already counted)"""
+        key = (method, (table or '?').split('?')[0])
+        with self.stats_lock:
+            s = self.stats.setdefault(key, {'requests': 0, 'rows': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0,
+                                            'errors': 0, 'injected': 0})
+            s['requests'] += request
+            if injected:
+                s['injected'] += 1
+            s['rows'] += rows
+            s['bytes_in'] += bytes_in
+            s['bytes_out'] += bytes_out
+            s['seconds'] += seconds
+            if status >= 400 or (injected and not status):
+                s['errors'] += 1
+
+    def snapshot(self):
+        """Copy of the request counters"""
+        with self.stats_lock:
+            return {key: dict(s) for key, s in self.stats.items()}
+
+    def count(self, table, params=()):
+        with self.lock:
+            where, values = self.where(table, list(params))
+            return self.conn.execute(f'SELECT COUNT(*) FROM {table}{where}', values).fetchone()[0]
+
+
+NETWORK_PROFILES = {
+    # name: Conditions keyword arguments - latency is the added round trip per request
+    'lan': {},
+    'store_dsl': {'latency_ms': 60, 'jitter_ms': 15, 'up_kbps': 1000, 'down_kbps': 8000, 'loss_pct': 0.5,
+                  'error_rate': 0.005, 'throttle_rate': 0.002},
+    'store_lte': {'latency_ms': 120, 'jitter_ms': 60, 'up_kbps': 3000, 'down_kbps': 10000, 'loss_pct': 1,
+                  'error_rate': 0.01, 'reset_rate': 0.005, 'truncate_rate': 0.002},
+    'flaky_uplink': {'latency_ms': 300, 'jitter_ms': 50, 'up_kbps': 512, 'down_kbps': 2000, 'loss_pct': 2,
+                     'error_rate': 0.02, 'throttle_rate': 0.01, 'reset_rate': 0.01, 'truncate_rate': 0.005},
+    'satellite': {'latency_ms': 650, 'jitter_ms': 100, 'up_kbps': 1000, 'down_kbps': 15000, 'loss_pct': 1},
+    'outage_storm': {'latency_ms': 150, 'error_rate': 0.15, 'throttle_rate': 0.1, 'reset_rate': 0.05, 'truncate_rate': 0.02},
+}
+SEGMENT_BYTES = 1460  # TCP payload per packet, for loss_pct
+MIN_RTO = 0.2  # Seconds - a lost segment costs max(MIN_RTO, 2 x RTT) before it is resent
+FAULTS = ('reset', 'throttle', 'error', 'truncate')
+
+
+class Conditions:
+    """Network conditions the server applies to every request, like a store's uplink:
+
+    latency_ms / jitter_ms   added round trip (uniform jitter)
+    up_kbps / down_kbps      bandwidth cap per request and direction (bandwidth_kbps sets both; 0 = unlimited)
+    loss_pct                 packet loss, as TCP feels it: each lost segment waits out a retransmission timeout
+    error_rate               share of requests answered 500 / 502 / 503 / 504, nothing applied
+    throttle_rate            share answered 429 with Retry-After, nothing applied
+    reset_rate               share whose connection is reset instead of being served - nothing applied
+    truncate_rate            share that IS applied, but whose response body is cut off and the connection closed
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0, bandwidth_kbps=0, error_rate=0.0, seed=None, up_kbps=None,
+                 down_kbps=None, loss_pct=0.0, throttle_rate=0.0, reset_rate=0.0, truncate_rate=0.0, name=None):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.up_kbps = bandwidth_kbps if up_kbps is None else up_kbps
+        self.down_kbps = bandwidth_kbps if down_kbps is None else down_kbps
+        self.loss_pct = loss_pct
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.reset_rate = reset_rate
+        self.truncate_rate = truncate_rate
+        self.faults = dict.fromkeys(FAULTS, 0)  # Injected so far, by kind
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_profile(cls, profile, seed=None, **overrides):
+        """A named profile (NETWORK_PROFILES) or an INI file - 'file.ini' (its first section) or 'file.ini:section' -
+        with the same keys as the constructor. Overrides that aren't None win over the profile."""
+        if profile in NETWORK_PROFILES:
+            values, name = dict(NETWORK_PROFILES[profile]), profile
+        else:
+            # rpartition: a Windows path ('C:\\net.ini:store_k') has a colon of its own
+            path, _, section = profile.rpartition(':') if not os.path.exists(profile) else (profile, '', '')
+            if not path or any(sep in section for sep in '\\/'):
+                path, section = profile, ''  # No section given ('C:\\net.ini' that doesn't exist)
+            parser = ConfigParser()
+            if not parser.read(path, encoding='utf-8'):
+                raise ValueError(f"unknown network profile {profile!r} (presets: {', '.join(NETWORK_PROFILES)})")
+            section = section or (parser.sections() or [''])[0]
+            if not parser.has_section(section):
+                raise ValueError(f"{path}: no section [{section}]")
+            values, name = {key: float(value) for key, value in parser[section].items()}, section
+        values.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(seed=seed, name=name, **values)
+
+    def __bool__(self):
+        return bool(self.latency_ms or self.jitter_ms or self.up_kbps or self.down_kbps or self.loss_pct
+                    or self.error_rate or self.throttle_rate or self.reset_rate or self.truncate_rate)
+
+    def latency(self):
+        with self.lock:
+            jitter = self.rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def transfer_time(self, nbytes, kbps):
+        """Seconds to move nbytes at kbps, plus a retransmission timeout for every segment lost on the way"""
+        seconds = nbytes * 8 / (kbps * 1000) if kbps else 0.0
+        if self.loss_pct:
+            segments = max(1, -(-nbytes // SEGMENT_BYTES))
+            with self.lock:
+                lost = sum(1 for _ in range(segments) if self.rng.random() * 100 < self.loss_pct)
+            seconds += lost * max(MIN_RTO, 2 * self.latency_ms / 1000)
+        return seconds
+
+    def upload_time(self, nbytes):
+        return self.transfer_time(nbytes, self.up_kbps)
+
+    def download_time(self, nbytes):
+        return self.transfer_time(nbytes, self.down_kbps)
+
+    def fault(self):
+        """The fault to inject into this request (one of FAULTS) or None"""
+        rates = (self.reset_rate, self.throttle_rate, self.error_rate, self.truncate_rate)
+        if not any(rates):
+            return None
+        with self.lock:
+            roll = self.rng.random()
+            for kind, rate in zip(FAULTS, rates):
+                if roll < rate:
+                    self.faults[kind] += 1
+                    return kind
+                roll -= rate
+        return None
+
+    def error_status(self):
+        with self.lock:
+            return self.rng.choice((500, 502, 503, 503, 504))
+
+    def describe(self):
+        out = {'latency_ms': self.latency_ms, 'jitter_ms': self.jitter_ms, 'up_kbps': self.up_kbps, 'down_kbps': self.down_kbps,
+               'loss_pct': self.loss_pct, 'error_rate': self.error_rate, 'throttle_rate': self.throttle_rate,
+               'reset_rate': self.reset_rate, 'truncate_rate': self.truncate_rate}
+        return {'profile': self.name, **out} if self.name else out
+
+
+def network_arguments(parser):
+    """--network PROFILE plus one option per condition (each overrides the profile)"""
+    group = parser.add_argument_group('network', 'Emulated store uplink on the mock cloud (mock_postgrest.Conditions)')
+    group.add_argument('--network', default=None, help=f"Profile: {', '.join(NETWORK_PROFILES)}, or file.ini[:section]")
+    group.add_argument('--latency-ms', type=float, default=None, help='Added round trip per request')
+    group.add_argument('--jitter-ms', type=float, default=None)
+    group.add_argument('--bandwidth-kbps', type=float, default=None, help='Both directions')
+    group.add_argument('--up-kbps', type=float, default=None)
+    group.add_argument('--down-kbps', type=float, default=None)
+    group.add_argument('--loss-pct', type=float, default=None, help='Packet loss (retransmission delays)')
+    group.add_argument('--error-rate', type=float, default=None, help='Share of requests answered 5xx')
+    group.add_argument('--throttle-rate', type=float, default=None, help='Share of requests answered 429')
+    group.add_argument('--reset-rate', type=float, default=None, help='Share of connections reset before the request')
+    group.add_argument('--truncate-rate', type=float, default=None, help='Share of responses cut off after the request was applied')
+    return group
+
+
+def conditions_from_args(args, seed=None):
+    overrides = {key: getattr(args, key) for key in ('latency_ms', 'jitter_ms', 'bandwidth_kbps', 'up_kbps', 'down_kbps',
+                                                      'loss_pct', 'error_rate', 'throttle_rate', 'reset_rate', 'truncate_rate')}
+    if args.network:
+        return Conditions.from_profile(args.network, seed=seed, **overrides)
+    return Conditions(seed=seed, **{key: value for key, value in overrides.items() if value is not None})
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API - the agents' pooled sessions reuse connections
+
+    def _dispatch(self):
+        conditions = self.server.conditions
+        fault = conditions.fault() if conditions else None
+        if fault == 'reset':
+            self.send_reset()
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if conditions:
+            time.sleep(conditions.latency() + conditions.upload_time(len(body)))
+            if fault == 'error':
+                self.send_injected(conditions.error_status(), {'code': 'PGRST000', 'message': 'Service unavailable (injected)',
+                                                               'details': None, 'hint': None})
+                return
+            if fault == 'throttle':
+                self.send_injected(429, {'code': 'PGRST000', 'message': 'Too many requests (injected)', 'details': None,
+                                         'hint': None}, {'Retry-After': '1'})
+                return
+        status, headers, data = self.server.mock.handle(self.command, self.path, None, self.headers, body)
+        if conditions:
+            time.sleep(conditions.download_time(len(data)))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        if fault == 'truncate':
+            # The full length is announced, part of the body arrives, then the connection goes away
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = True
+            self.server.mock.record(self.command, self.table(), status, 0, 0, 0.0, 0, injected=True, request=False)
+            return
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _dispatch
+
+    def table(self):
+        return urlsplit(self.path).path.split('/rest/v1/')[-1]
+
+    def send_injected(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.server.mock.record(self.command, self.table(), status, 0, len(data), 0.0, 0, injected=True)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_reset(self):
+        """Drop the connection with a TCP RST (SO_LINGER 0) instead of answering"""
+        self.server.mock.record(self.command, self.table(), 0, 0, 0, 0.0, 0, injected=True)
+        with contextlib.suppress(OSError):
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, mock, host='127.0.0.1', port=0, handler=MockHandler, conditions=None):
+        super().__init__((host, port), handler)
+        self.mock = mock
+        self.conditions = conditions or Conditions()
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='mock-postgrest', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def serve(mock=None, host='127.0.0.1', port=0, conditions=None):
+    """Start a mock on a daemon thread; returns the running MockServer (server.mock, server.url)"""
+    return MockServer(mock or MockPostgREST(), host, port, conditions=conditions).start()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the mock Supabase REST API')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--db', default=':memory:', help='SQLite file to keep the data in')
+    parser.add_argument('--seed', type=int, default=None)
+    network_arguments(parser)
+    args = parser.parse_args()
+    conditions = conditions_from_args(args, seed=args.seed)
+    server = serve(MockPostgREST(args.db), port=args.port, conditions=conditions)
+    print(f'Mock PostgREST on {server.url}/rest/v1 - Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
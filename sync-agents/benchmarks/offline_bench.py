@@ -0,0 +1,303 @@
+"""
+Offline Sync Benchmark
+======================
+Runs the real store agent (store_agent.SyncAgent, unmodified) for full sync
+cycles against a PCAmerica stand-in in SQLite (standin_sql.py) and the mock
+Supabase REST API (mock_postgrest.py), on a synthetic catalogue from
+datagen.py - the same --seed gives the same data and the same edits.
+Nothing touches a real store or the real Supabase project - SUPABASE_URL /
+SUPABASE_KEY are ignored.
+
+For every catalogue size it measures:
+
+    cold_start    empty cloud, N local items: cycles until nothing moves any more
+                  (warm_start with --warm: the cloud already holds the store)
+    idle          steady state, no changes: what one cycle costs for doing nothing
+    local_edits   N * CHANGE_PCT% POS events (sales skewed by velocity) -> pushed up
+    cloud_edits   N * CHANGE_PCT% web-app edits -> pulled down
+    upload_fail   N * CHANGE_PCT% POS events, first cycle with every inventory upload
+                  rejected: the agent must count the failure (metrics 'errors'), then
+                  catch up on the next cycles
+
+Rows for the edit scenarios are the distinct items touched.
+
+and reports cycle latency (p50 / max), rows moved per second, the requests and
+bytes the mock served, and - after every scenario - how many items the store and
+the cloud still disagree on (`diverged`), which is what matters once the mock's
+network misbehaves (--network flaky_uplink, --loss-pct 2, --truncate-rate 0.01 ...).
+
+    python benchmarks/offline_bench.py [--sizes 1000,10000,100000] [--change-pct 1] [--seed 1]
+                                       [--warm] [--network store_dsl] [--out results.json] [--keep] [--verbose]
+
+The agent's log goes to agent.log in the work directory (--verbose: to the
+console). Edits wait out the agent's 3-second clock tolerance first (see
+diff_inventory), as they would between two 30-second cycles in a store.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))  # store_agent & friends
+
+import standin_sql
+standin_sql.install()  # Before store_agent imports pyodbc
+import datagen
+from mock_postgrest import conditions_from_args, network_arguments, serve
+import store_agent
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+LOCAL_STORE_ID = '1001'
+MAX_CYCLES = 100  # Give up converging after this many cycles (reported as not converged)
+CLOCK_TOLERANCE = 3.5  # Seconds - diff_inventory ignores local edits within 3s of the cloud version
+COMPARED = (('ItemName', 'item_name'), ('Price', 'price'), ('Cost', 'cost'), ('In_Stock', 'in_stock'))
+
+
+class Rig:
+    """One stand-in store database, a mock cloud and a real SyncAgent wired to both"""
+
+    def __init__(self, workdir, dataset, store_id='STORE-B', server=None, profile=None, warm=False):
+        """dataset: datagen.Dataset for the local store; warm: the cloud already holds it (an existing store)"""
+        self.workdir = workdir
+        self.store_id = store_id
+        self.dataset = dataset
+        self.stream = datagen.ChangeStream(dataset)
+        self.db_path = os.path.join(workdir, f'{store_id}.db')
+        datagen.load_standin(self.db_path, dataset)
+        self.database = f'bench_{store_id}'.lower().replace('-', '_')
+        standin_sql.register(self.database, self.db_path)
+        self.own_server = server is None
+        self.server = server or serve()
+        self.mock = self.server.mock
+        if warm:
+            datagen.load_cloud(self.mock, dataset, store_id)
+        settings = {
+            'CLOUD_STORE_ID': store_id,
+            'SQL_SERVER': 'localhost',
+            'SQL_DATABASE': self.database,
+            'supa_url': self.server.url,
+            'supa_key': 'bench-key',
+            'METRICS_FILE': '',
+        }
+        settings.update(profile or {})
+        self.agent = store_agent.SyncAgent(settings, state_db=os.path.join(workdir, f'state_{store_id}.db'))
+        if not self.agent.start():
+            raise RuntimeError(f'{store_id}: stand-in database did not connect')
+
+    def cycle(self):
+        """One full agent cycle; returns what it did and what it cost the mock"""
+        before = self.mock.snapshot()
+        self.agent.run_cycle()
+        after = self.mock.snapshot()
+        summary = self.agent.metrics.last_cycle
+        phases = summary['phases']
+        served = {field: sum(s[field] for s in after.values()) - sum(s[field] for s in before.values())
+                  for field in ('requests', 'errors', 'bytes_in', 'bytes_out')}
+        return {
+            'seconds': summary['seconds'],
+            'agent_errors': sum(s.get('errors', 0) for s in phases.values()),
+            'up': phases.get('sync_inventory', {}).get('rows_written', 0),
+            'down': phases.get('sync_down_inventory', {}).get('rows_written', 0),
+            'carry_over': self.agent.metrics.gauges.get('carry_over_depth', 0),
+            **served,
+        }
+
+    def converge(self, max_cycles=MAX_CYCLES):
+        """Run cycles until one moves no rows and leaves nothing queued"""
+        cycles = []
+        while len(cycles) < max_cycles:
+            cycles.append(self.cycle())
+            last = cycles[-1]
+            if not last['up'] and not last['down'] and not last['carry_over']:
+                return cycles, True
+        return cycles, False
+
+    @contextlib.contextmanager
+    def rejecting_uploads(self):
+        """Every inventory POST fails with a 400 while the block runs (the cloud refuses the batch)"""
+        handle = self.mock.handle
+
+        def rejecting(method, path, query, headers, body):
+            if method == 'POST' and path.split('?')[0].rstrip('/').endswith('/rest/v1/inventory'):
+                data = json.dumps({'code': '22P02', 'message': 'Upload rejected (bench)', 'details': None,
+                                   'hint': None}).encode('utf-8')
+                self.mock.record(method, 'inventory', 400, len(body or b''), len(data), 0.0, 0)
+                return 400, {'Content-Type': 'application/json; charset=utf-8'}, data
+            return handle(method, path, query, headers, body)
+
+        self.mock.handle = rejecting
+        try:
+            yield
+        finally:
+            del self.mock.handle
+
+    def pos_traffic(self, events):
+        """Register traffic at the store; returns how many distinct items it touched"""
+        events = self.stream.pos_events(events)
+        datagen.apply_pos(self.db_path, events)
+        return len({(e['item_num'] or e['item']['ItemNum']).rstrip().casefold() for e in events})
+
+    def web_edits(self, edits):
+        """Edits made in the web app; returns how many distinct items they touched"""
+        edits = self.stream.web_edits(edits)
+        datagen.apply_web(self.mock, self.store_id, edits)
+        return len({e['item_num'].casefold() for e in edits})
+
+    def divergence(self):
+        """How far the store and the cloud disagree: items only local, only in the cloud, or with different values"""
+        conn = standin_sql.open_sqlite(self.db_path)
+        try:
+            local = {r[0].strip().casefold(): r[1:] for r in conn.execute(
+                f"SELECT ItemNum, {', '.join(c for c, _ in COMPARED)} FROM Inventory")}
+        finally:
+            conn.close()
+        with self.mock.lock:
+            cloud = {r[0].strip().casefold(): r[1:] for r in self.mock.conn.execute(
+                f"SELECT item_num, {', '.join(c for _, c in COMPARED)} FROM inventory WHERE store_id = ? AND item_name <> 'DELETED'",
+                (self.store_id,))}
+        same = lambda a, b: (a or '').rstrip() == (b or '').rstrip() if isinstance(a, str) or isinstance(b, str) \
+            else abs(float(a or 0) - float(b or 0)) < 1e-6
+        different = sum(1 for key in local.keys() & cloud.keys()
+                        if not all(same(a, b) for a, b in zip(local[key], cloud[key])))
+        return {'local_only': len(local.keys() - cloud.keys()), 'cloud_only': len(cloud.keys() - local.keys()),
+                'different': different}
+
+    def close(self):
+        self.agent.close()
+        if self.own_server:
+            self.server.stop()
+
+
+def summarize(cycles, rows, converged=True, divergence=None):
+    seconds = [c['seconds'] for c in cycles]
+    total = sum(seconds)
+    return {
+        'cycles': len(cycles),
+        'converged': converged,
+        'diverged': sum((divergence or {}).values()),
+        'divergence': divergence or {},
+        'seconds': round(total, 3),
+        'cycle_p50': round(statistics.median(seconds), 3) if seconds else None,
+        'cycle_max': round(max(seconds), 3) if seconds else None,
+        'rows': rows,
+        'rows_per_second': round(rows / total) if rows and total > 0 else None,
+        'rows_up': sum(c['up'] for c in cycles),
+        'rows_down': sum(c['down'] for c in cycles),
+        'requests': sum(c['requests'] for c in cycles),
+        'errors': sum(c['errors'] for c in cycles),
+        'agent_errors': sum(c['agent_errors'] for c in cycles),
+        'kb_up': round(sum(c['bytes_in'] for c in cycles) / 1024, 1),
+        'kb_down': round(sum(c['bytes_out'] for c in cycles) / 1024, 1),
+    }
+
+
+def bench_size(workdir, items, change_pct=1.0, idle_cycles=3, seed=1, warm=False, conditions=None):
+    """All scenarios for one catalogue size on a fresh store + cloud (conditions: the mock's network)"""
+    dataset = datagen.generate_store(items, seed=seed, store_id=LOCAL_STORE_ID)
+    server = serve(conditions=conditions)
+    rig = Rig(workdir, dataset, store_id=f'B{items}'[:10], server=server, warm=warm)
+    results = {}
+    try:
+        cycles, converged = rig.converge()
+        results['warm_start' if warm else 'cold_start'] = summarize(cycles, items, converged, rig.divergence())
+
+        results['idle'] = summarize([rig.cycle() for _ in range(idle_cycles)], 0, divergence=rig.divergence())
+
+        events = max(1, int(items * change_pct / 100))
+        time.sleep(CLOCK_TOLERANCE)
+        changed = rig.pos_traffic(events)
+        cycles, converged = rig.converge()
+        results['local_edits'] = summarize(cycles, changed, converged, rig.divergence())
+
+        time.sleep(CLOCK_TOLERANCE)
+        changed = rig.web_edits(events)
+        cycles, converged = rig.converge()
+        results['cloud_edits'] = summarize(cycles, changed, converged, rig.divergence())
+
+        time.sleep(CLOCK_TOLERANCE)
+        changed = rig.pos_traffic(events)
+        with rig.rejecting_uploads():
+            failed = rig.cycle()
+        cycles, converged = rig.converge()
+        results['upload_fail'] = summarize([failed] + cycles, changed, converged, rig.divergence())
+        results['upload_fail']['failure_counted'] = failed['agent_errors'] > 0
+    finally:
+        rig.close()
+        server.stop()
+    return results
+
+
+def print_report(report):
+    print(f"{'items':>8} {'scenario':<12}{'cycles':>7}{'total s':>9}{'p50 s':>8}{'max s':>8}{'rows':>8}{'rows/s':>9}"
+          f"{'requests':>9}{'errors':>7}{'KB up':>9}{'KB down':>9}")
+    for items, scenarios in report['results'].items():
+        for name, r in scenarios.items():
+            rate = f"{r['rows_per_second']:,}" if r['rows_per_second'] else '-'
+            flag = ('' if r['converged'] else '  (not converged)') + (f"  ({r['diverged']} items diverged)" if r['diverged'] else '')
+            if r.get('failure_counted') is False:
+                flag += '  (failed upload not counted)'
+            print(f"{items:>8} {name:<12}{r['cycles']:>7}{r['seconds']:>9.2f}{r['cycle_p50']:>8.3f}{r['cycle_max']:>8.3f}"
+                  f"{r['rows']:>8}{rate:>9}{r['requests']:>9}{r['errors']:>7}{r['kb_up']:>9.1f}{r['kb_down']:>9.1f}{flag}")
+
+
+def parse_sizes(text):
+    return [int(s) for s in text.split(',') if s.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Full store-agent sync cycles against local stand-ins')
+    parser.add_argument('--sizes', type=parse_sizes, default=list(DEFAULT_SIZES), help='Comma-separated item counts')
+    parser.add_argument('--change-pct', type=float, default=1.0, help='Edits per scenario, as a share of the item count')
+    parser.add_argument('--warm', action='store_true', help='Start with the cloud already holding the store (no initial upload)')
+    parser.add_argument('--idle-cycles', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default=None, help='Also write the results as JSON')
+    parser.add_argument('--workdir', default=None, help='Where the databases go (default: a temp dir)')
+    parser.add_argument('--keep', action='store_true', help="Don't delete the work directory")
+    parser.add_argument('--verbose', action='store_true', help='Agent log to the console instead of agent.log')
+    network_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # Never let the environment point the agent at the real project
+    os.environ.pop('SUPABASE_URL', None)
+    os.environ.pop('SUPABASE_KEY', None)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='sync-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    conditions = conditions_from_args(args, seed=args.seed)
+    report = {'sizes': args.sizes, 'change_pct': args.change_pct, 'seed': args.seed, 'warm': args.warm,
+              'network': conditions.describe(), 'results': {}}
+    log_file = open(os.path.join(workdir, 'agent.log'), 'w', encoding='utf-8')
+    try:
+        for items in args.sizes:
+            print(f"[BENCH] {items} items...", flush=True)
+            started = time.perf_counter()
+            with contextlib.ExitStack() as stack:
+                if not args.verbose:
+                    stack.enter_context(contextlib.redirect_stdout(log_file))
+                report['results'][items] = bench_size(workdir, items, args.change_pct, args.idle_cycles, args.seed, args.warm,
+                                                      conditions)
+            print(f"[BENCH] {items} items done in {time.perf_counter() - started:.1f}s", flush=True)
+    finally:
+        log_file.close()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif args.keep:
+            print(f"[BENCH] Work directory kept: {workdir}")
+    print_report(report)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Propagation Probe on the Stand-ins
+==================================
+Runs the agents' `--probe` (probe.py) against a PCAmerica stand-in (standin_sql.py)
+and the mock Supabase (mock_postgrest.py): a real store_agent syncs the store every
+--interval seconds in a background thread, POS traffic and web edits keep it busy,
+and the probe - in its own connection, like against a real store - times marked
+writes in both directions.
+
+    python benchmarks/probe_standin.py [--items 5000] [--interval 30] [--pos-rate 60] [--web-rate 10]
+                                       [--network store_dsl] [--latency-ms 150] [--seed 1] [--keep]
+                                       --probe-duration 600 --probe-rate 6 ...   (any --probe-* option)
+
+The agent's log and the probe's per-window lines go to agent.log in the work
+directory (kept if the probe failed); the final report goes to the console.
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))  # store_agent & friends
+
+import standin_sql
+standin_sql.install()  # Before store_agent imports pyodbc
+import datagen
+from mock_postgrest import conditions_from_args, network_arguments, serve
+from offline_bench import Rig
+import probe
+import store_agent
+
+
+def agent_loop(rig, stop, interval):
+    """The agent's own loop, cycle by cycle so it can be stopped"""
+    while not stop.is_set():
+        try:
+            rig.agent.run_cycle()
+        except Exception as e:
+            rig.agent.log(f"[ERROR] Cycle failed: {e}", "ERROR")
+        stop.wait(interval)
+
+
+def traffic(rig, stop, pos_per_minute, web_per_minute):
+    """Background POS events and web edits on the ordinary catalogue, applied once a second"""
+    owed = [0.0, 0.0]
+    while not stop.wait(1.0):
+        owed[0] += pos_per_minute / 60
+        owed[1] += web_per_minute / 60
+        if owed[0] >= 1:
+            rig.pos_traffic(int(owed[0]))
+            owed[0] -= int(owed[0])
+        if owed[1] >= 1:
+            rig.web_edits(int(owed[1]))
+            owed[1] -= int(owed[1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Propagation probe against the stand-in store and mock cloud',
+                                     epilog='Every --probe-* option of probe.py is accepted as well.')
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--interval', type=int, default=30, help='Agent sync interval (seconds)')
+    parser.add_argument('--pos-rate', type=float, default=60, help='Background POS events per minute')
+    parser.add_argument('--web-rate', type=float, default=10, help='Background web edits per minute')
+    network_arguments(parser)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--keep', action='store_true')
+    args, probe_argv = parser.parse_known_args(argv)
+    os.environ.pop('SUPABASE_URL', None)
+    os.environ.pop('SUPABASE_KEY', None)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='probe-standin-')
+    os.makedirs(workdir, exist_ok=True)
+    conditions = conditions_from_args(args, seed=args.seed)
+    server = serve(conditions=conditions)
+    stop = threading.Event()
+    threads = []
+    rig = prober = report = None
+    log_file = open(os.path.join(workdir, 'agent.log'), 'w', encoding='utf-8')
+    try:
+        with contextlib.redirect_stdout(log_file):
+            dataset = datagen.generate_store(args.items, seed=args.seed)
+            rig = Rig(workdir, dataset, store_id='STORE-P', server=server, warm=True, profile={'SYNC_INTERVAL': args.interval})
+            rig.agent.run_cycle()  # Settle the warm start before the clock starts
+            threads = [threading.Thread(target=agent_loop, args=(rig, stop, args.interval), daemon=True),
+                       threading.Thread(target=traffic, args=(rig, stop, args.pos_rate, args.web_rate), daemon=True)]
+            for t in threads:
+                t.start()
+            # The probe's own agent object: only its connection, HTTP session and credentials are used
+            prober = store_agent.SyncAgent(dict(rig.agent.profile), http=store_agent.make_http_session(),
+                                           state_db=os.path.join(workdir, 'state_probe.db'))
+            report = probe.run_probe([prober], ['--probe'] + probe_argv)
+            stop.set()
+            for t in threads:
+                t.join(timeout=300)
+    finally:
+        stop.set()
+        with contextlib.redirect_stdout(log_file):
+            if prober is not None:
+                prober.close()
+            if rig is not None:
+                rig.close()
+        server.stop()
+        log_file.close()
+    if report is not None:
+        probe.log_report(prober, report)  # The windows are in agent.log, next to what the agent was doing
+    else:
+        print(f"[PROBE] Probe failed - see {os.path.join(workdir, 'agent.log')}")
+    if not args.keep and not args.workdir and report is not None:
+        shutil.rmtree(workdir, ignore_errors=True)
+    else:
+        print(f"[PROBE] Work directory kept: {workdir}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
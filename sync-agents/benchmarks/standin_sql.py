@@ -0,0 +1,512 @@
+"""
+PCAmerica Stand-in
+==================
+A PCAmerica-shaped store database (Inventory / Departments / Setup) in SQLite,
+behind a pyodbc-compatible module, so the agents run unmodified on a laptop.
+
+    import standin_sql
+    standin_sql.create_database('store_h.db', store_id='1001')
+    standin_sql.register('cresqlh', 'store_h.db')   # DATABASE=cresqlh in a connection string
+    standin_sql.install()                            # sys.modules['pyodbc'] -> this module
+    import store_agent                               # now talks to SQLite
+
+What it keeps from SQL Server, because the agents depend on it:
+- ItemNum / Dept_ID compare like PCAmerica's collation: case-insensitive, trailing spaces ignored
+- GETDATE() is store-local time (STORE_UTC_OFFSET_HOURS); NEWID(); ISNULL(); TOP n;
+  CHECKSUM_AGG(BINARY_CHECKSUM(...)) changes whenever the rows do
+- trg_Inventory_UpdateTimestamp: any UPDATE bumps Local_Updated_At
+- rows answer to row.ColumnName as well as row[i]; errors are pyodbc-style (sqlstate, message)
+
+The handful of T-SQL batches the agents send that SQLite can't run (MERGE, UPDATE ... OUTPUT
+INTO a table variable, DELETE ... JOIN, #temp tables, IF OBJECT_ID ...) are recognised and
+executed with the same effect. Anything else that isn't valid SQLite fails loudly with a
+ProgrammingError naming the statement, so a new agent query can't silently be mis-benchmarked.
+"""
+
+import functools
+import re
+import sqlite3
+import threading
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+DRIVER_NAME = 'ODBC Driver 17 for SQL Server'
+STORE_UTC_OFFSET_HOURS = -6  # PCAmerica boxes run on store-local time; the agents assume CST
+BUSY_TIMEOUT = 30  # Seconds a connection waits for another writer (agent vs. POS traffic generator)
+
+DATABASES = {}  # DATABASE= name (lower case) -> SQLite file
+_lock = threading.Lock()
+
+# --- pyodbc module surface -------------------------------------------------------------------------
+
+apilevel = '2.0'
+threadsafety = 1
+paramstyle = 'qmark'
+
+
+class Error(Exception):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class DataError(DatabaseError):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class IntegrityError(DatabaseError):
+    pass
+
+
+class InternalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+class NotSupportedError(DatabaseError):
+    pass
+
+
+def drivers():
+    return [DRIVER_NAME]
+
+
+def register(database, path):
+    """Make DATABASE=<database> in a connection string open the SQLite file at path"""
+    with _lock:
+        DATABASES[database.lower()] = path
+
+
+def install():
+    """Serve `import pyodbc` from this module - call before importing an agent"""
+    import sys
+    sys.modules['pyodbc'] = sys.modules[__name__]
+
+
+def connect(connection_string='', autocommit=False, timeout=0, **kwargs):
+    attrs = dict(part.split('=', 1) for part in connection_string.split(';') if '=' in part)
+    attrs = {k.strip().upper(): v.strip() for k, v in attrs.items()}
+    database = attrs.get('DATABASE', kwargs.get('database', ''))
+    path = DATABASES.get(database.lower())
+    if path is None:
+        raise InterfaceError('28000', f"[28000] Cannot open database \"{database}\" requested by the login. The login failed.")
+    return Connection(path, autocommit)
+
+
+# --- SQLite plumbing ---------------------------------------------------------------------------------
+
+def getdate():
+    """SQL Server's GETDATE(): store-local wall clock, no time zone"""
+    now = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=STORE_UTC_OFFSET_HOURS)
+    return now.isoformat(' ', timespec='milliseconds')
+
+
+def pca_collate(a, b):
+    """PCAmerica's collation: case-insensitive, trailing spaces ignored"""
+    a, b = a.rstrip().casefold(), b.rstrip().casefold()
+    return (a > b) - (a < b)
+
+
+def binary_checksum(*values):
+    """BINARY_CHECKSUM(...): a signed 32-bit hash of the row's values (exact algorithm doesn't matter, stability does)"""
+    value = zlib.crc32(repr(values).encode('utf-8'))
+    return value - (1 << 32) if value >= 1 << 31 else value
+
+
+class ChecksumAgg:
+    """CHECKSUM_AGG(...): XOR of the group's checksums, NULL for an empty group"""
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is not None:
+            self.value = value if self.value is None else self.value ^ value
+
+    def finalize(self):
+        return self.value
+
+
+def _convert_datetime(value):
+    return datetime.fromisoformat(value.decode())
+
+
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(' ', timespec='milliseconds'))
+sqlite3.register_converter('DATETIME', _convert_datetime)
+
+
+def open_sqlite(path):
+    """Raw sqlite3 connection with the SQL Server functions / collation the schema needs.
+    Used by the shim and by tools that load data directly (much faster than row-by-row through pyodbc)."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    conn.create_collation('PCA', pca_collate)
+    conn.create_function('GETDATE', 0, getdate)
+    conn.create_function('NEWID', 0, lambda: str(uuid.uuid4()).upper())
+    conn.create_function('BINARY_CHECKSUM', -1, binary_checksum, deterministic=True)
+    conn.create_aggregate('CHECKSUM_AGG', 1, ChecksumAgg)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+# Every column the agents and the repo's test scripts read or write, with PCAmerica's NOT NULL defaults
+INVENTORY_FLAGS = (
+    'Reorder_Level', 'Reorder_Quantity', 'Tax_1', 'Tax_2', 'Tax_3', 'IsKit', 'IsModifier', 'Inv_Num_Barcode_Labels',
+    'Use_Serial_Numbers', 'Num_Bonus_Points', 'IsRental', 'Use_Bulk_Pricing', 'Print_Ticket', 'Print_Voucher',
+    'Num_Days_Valid', 'IsMatrixItem', 'AutoWeigh', 'Dirty', 'FoodStampable', 'Exclude_Acct_Limit', 'Check_ID',
+    'Prompt_Price', 'Prompt_Quantity', 'Allow_BuyBack', 'Special_Permission', 'Prompt_Description', 'Check_ID2',
+    'Count_This_Item', 'Print_On_Receipt', 'Transfer_Markup_Enabled', 'As_Is', 'Import_Markup', 'PricePerMeasure',
+    'AvailableOnline', 'DoughnutTax', 'DisableInventoryUpload', 'InvoiceLimitQty', 'ItemCategory', 'IsRestrictedPerInvoice',
+)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS Setup (
+    Store_ID TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS Departments (
+    Dept_ID TEXT COLLATE PCA NOT NULL PRIMARY KEY,
+    Store_ID TEXT NOT NULL,
+    Description TEXT,
+    Type INTEGER DEFAULT 0, TSDisplay INTEGER DEFAULT 0, Cost_MarkUp REAL DEFAULT 0, Dirty INTEGER DEFAULT 1,
+    SubType TEXT DEFAULT 'NONE', Print_Dept_Notes INTEGER DEFAULT 0, Require_Permission INTEGER DEFAULT 0,
+    Require_Serials INTEGER DEFAULT 0, AvailableOnline INTEGER DEFAULT 0, RowID TEXT
+);
+CREATE TABLE IF NOT EXISTS Inventory (
+    ItemNum TEXT COLLATE PCA NOT NULL,
+    ItemName TEXT,
+    Store_ID TEXT NOT NULL,
+    Dept_ID TEXT COLLATE PCA,
+    Cost REAL DEFAULT 0,
+    Price REAL DEFAULT 0,
+    Retail_Price REAL DEFAULT 0,
+    In_Stock REAL DEFAULT 0,
+    ItemType INTEGER DEFAULT 0,
+    Vendor_Number TEXT,
+    Unit_Type TEXT,
+    Unit_Size REAL,
+    Last_Sold DATETIME,
+    Local_Updated_At DATETIME DEFAULT (GETDATE()),
+    RowID TEXT,
+    {', '.join(f'{c} REAL DEFAULT 0' for c in INVENTORY_FLAGS)},
+    PRIMARY KEY (ItemNum, Store_ID)
+);
+CREATE INDEX IF NOT EXISTS IX_Inventory_Store ON Inventory(Store_ID);
+CREATE TRIGGER IF NOT EXISTS trg_Inventory_UpdateTimestamp AFTER UPDATE ON Inventory
+WHEN NEW.Local_Updated_At IS OLD.Local_Updated_At
+BEGIN
+    UPDATE Inventory SET Local_Updated_At = GETDATE() WHERE rowid = NEW.rowid;
+END;
+"""
+
+
+def create_database(path, store_id='1001'):
+    """Create (or open) a stand-in store database at path. Returns path."""
+    conn = open_sqlite(path)
+    with conn:
+        conn.executescript(SCHEMA)
+        if conn.execute('SELECT COUNT(*) FROM Setup').fetchone()[0] == 0:
+            conn.execute('INSERT INTO Setup (Store_ID) VALUES (?)', (str(store_id),))
+    conn.close()
+    return path
+
+
+# --- T-SQL translation ---------------------------------------------------------------------------------
+
+def _sqlstate(error):
+    text = str(error)
+    if isinstance(error, sqlite3.IntegrityError):
+        return IntegrityError, '23000'
+    if 'no such table' in text:
+        return ProgrammingError, '42S02'
+    if 'no such column' in text:
+        return ProgrammingError, '42S22'
+    if 'locked' in text or 'busy' in text:
+        return OperationalError, 'HYT00'
+    if isinstance(error, sqlite3.OperationalError):
+        return ProgrammingError, '42000'
+    return DatabaseError, 'HY000'
+
+
+def _pyodbc_error(error, sql):
+    cls, state = _sqlstate(error)
+    statement = ' '.join(sql.split())[:200]
+    return cls(state, f"[{state}] [Stand-in] {error} (SQLExecDirectW) -- {statement}")
+
+
+RE_TOP = re.compile(r'^\s*SELECT\s+(DISTINCT\s+)?TOP\s*\(?\s*(\d+)\s*\)?\s+', re.I)
+RE_TEMP_DROP = re.compile(r"IF\s+OBJECT_ID\('tempdb\.\.#(\w+)'\)\s+IS\s+NOT\s+NULL\s+DROP\s+TABLE\s+#\w+", re.I)
+RE_CREATE_IF_MISSING = re.compile(r"IF\s+OBJECT_ID\('(?:dbo\.)?(\w+)'\s*,\s*'U'\)\s+IS\s+NULL\s+CREATE\s+TABLE\s+(?:dbo\.)?\w+", re.I)
+RE_DELETE_JOIN = re.compile(r'DELETE\s+(\w+)\s+FROM\s+(\w+)\s+\1\s+INNER\s+JOIN\s+#?(\w+)\s+(\w+)\s+ON\s+\1\.(\w+)\s*=\s*\4\.(\w+)', re.I)
+RE_ALTER_ADD = re.compile(r'ALTER\s+TABLE\s+(\w+)\s+ADD\s+(?!COLUMN)', re.I)
+RE_LEFT = re.compile(r"\bLEFT\s*\(\s*(\w+)\s*,\s*(\d+)\s*\)", re.I)
+RE_CONCAT = re.compile(r"('(?:[^']|'')*')\s*\+\s*(substr\()", re.I)
+RE_GETDATE_DEFAULT = re.compile(r'DEFAULT\s+GETDATE\(\)', re.I)
+
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql):
+    """T-SQL -> (handler name, SQLite statement)"""
+    text = re.sub(r'^\s*SET\s+NOCOUNT\s+ON\s*;', '', sql, flags=re.I).strip()
+    if re.search(r'IF\s+NOT\s+EXISTS\s*\(\s*SELECT\s+\*\s+FROM\s+sys\.triggers', text, re.I):
+        return 'noop', ''  # The stand-in ships with its trigger
+    if re.match(r'MERGE\s+Departments\b', text, re.I):
+        return 'merge_departments', text
+    if re.search(r'DECLARE\s+@\w+\s+TABLE', text, re.I) and re.search(r'OUTPUT\s+inserted\.', text, re.I):
+        return 'adjust_stock', text
+
+    text = RE_TEMP_DROP.sub(lambda m: f'DROP TABLE IF EXISTS temp.{m.group(1)}', text)
+    text = RE_CREATE_IF_MISSING.sub(lambda m: f'CREATE TABLE IF NOT EXISTS {m.group(1)}', text)
+    text = RE_DELETE_JOIN.sub(lambda m: f'DELETE FROM {m.group(2)} WHERE {m.group(5)} IN (SELECT {m.group(6)} FROM {m.group(3)})', text)
+    text = re.sub(r'CREATE\s+TABLE\s+#(\w+)', r'CREATE TEMP TABLE \1', text, flags=re.I)
+    text = re.sub(r'#(\w+)', r'\1', text)
+    text = re.sub(r'\bdbo\.', '', text, flags=re.I)
+    text = re.sub(r'COLLATE\s+DATABASE_DEFAULT', 'COLLATE PCA', text, flags=re.I)
+    text = RE_GETDATE_DEFAULT.sub('DEFAULT (GETDATE())', text)
+    text = RE_ALTER_ADD.sub(r'ALTER TABLE \1 ADD COLUMN ', text)
+    text = re.sub(r'\bISNULL\s*\(', 'IFNULL(', text, flags=re.I)
+    text = RE_LEFT.sub(r'substr(\1, 1, \2)', text)
+    text = RE_CONCAT.sub(r'\1 || \2', text)
+    text = re.sub(r"\bN'", "'", text)
+    top = RE_TOP.match(text)
+    if top:
+        text = f"SELECT {top.group(1) or ''}{text[top.end():].rstrip().rstrip(';')} LIMIT {top.group(2)}"
+    return 'sql', text
+
+
+class Row(tuple):
+    """pyodbc.Row: a tuple whose values are also attributes named after the columns"""
+    _index = {}
+
+    def __getattr__(self, name):
+        try:
+            return self[self._index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    @property
+    def cursor_description(self):
+        return self._description
+
+
+_row_classes = {}
+
+
+def row_class(description):
+    names = tuple(d[0] for d in description)
+    cls = _row_classes.get(names)
+    if cls is None:
+        cls = type('Row', (Row,), {'_index': {n: i for i, n in enumerate(names)}, '_description': description})
+        _row_classes[names] = cls
+    return cls
+
+
+def _params(args):
+    if len(args) == 1 and isinstance(args[0], (list, tuple)):
+        return list(args[0])
+    return list(args)
+
+
+class Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._cur = connection._conn.cursor()
+        self._rows = None  # Result of a translated batch, served instead of the SQLite cursor
+        self.description = None
+        self.rowcount = -1
+        self.fast_executemany = False
+        self.arraysize = 1
+
+    # --- execution ---
+    def execute(self, sql, *args):
+        params = _params(args)
+        handler, text = translate(sql)
+        self._rows = None
+        try:
+            with self.connection._lock:
+                getattr(self, f'_run_{handler}')(text, params)
+        except sqlite3.Error as e:
+            raise _pyodbc_error(e, sql) from e
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        handler, text = translate(sql)
+        if handler != 'sql':
+            for params in seq_of_params:
+                self.execute(sql, params)
+            return self
+        self._rows = None
+        try:
+            with self.connection._lock:
+                self.connection._begin()
+                self._cur.executemany(text, [list(p) for p in seq_of_params])
+                self.description, self.rowcount = None, self._cur.rowcount
+        except sqlite3.Error as e:
+            raise _pyodbc_error(e, sql) from e
+        return self
+
+    def _run_noop(self, text, params):
+        self.description, self.rowcount = None, 0
+
+    def _run_sql(self, text, params):
+        if not re.match(r'\s*(SELECT|WITH)\b', text, re.I):
+            self.connection._begin()
+        self._cur.execute(text, params)
+        self.description = self._cur.description
+        self.rowcount = self._cur.rowcount
+
+    def _run_merge_departments(self, text, params):
+        """MERGE Departments USING (VALUES (Dept_ID, Description), ...) ... ; last parameter is Store_ID"""
+        store_id = params[-1]
+        pairs = list(zip(params[:-1:2], params[1:-1:2]))
+        self.connection._begin()
+        count = 0
+        for dept_id, description in pairs:
+            row = self._cur.execute('SELECT Description FROM Departments WHERE Dept_ID = ?', (dept_id,)).fetchone()
+            if row is None:
+                self._cur.execute(
+                    "INSERT INTO Departments (Dept_ID, Store_ID, Description, RowID) VALUES (?, ?, ?, NEWID())",
+                    (dept_id, store_id, description))
+                count += 1
+            elif row[0] is None or row[0] != description:
+                self._cur.execute('UPDATE Departments SET Description = ? WHERE Dept_ID = ?', (description, dept_id))
+                count += 1
+        self.description, self.rowcount = None, count
+
+    def _run_adjust_stock(self, text, params):
+        """UPDATE i SET In_Stock = ISNULL(In_Stock, 0) + v.Delta OUTPUT ... INTO @changes FROM Inventory i
+        JOIN (VALUES (ItemNum, Delta), ...) v [WHERE i.Store_ID = ?]; SELECT ... FROM @changes"""
+        n = len(re.findall(r'\(\?\s*,\s*\?\)', text))
+        store_filter = re.search(r'WHERE\s+i\.Store_ID\s*=\s*\?', text, re.I)
+        store_id = params[2 * n] if store_filter else None
+        self.connection._begin()
+        changes = []
+        for item_num, delta in zip(params[0:2 * n:2], params[1:2 * n:2]):
+            query = 'SELECT rowid, ItemNum, ItemName, In_Stock FROM Inventory WHERE ItemNum = ?'
+            args = [item_num]
+            if store_filter:
+                query += ' AND Store_ID = ?'
+                args.append(store_id)
+            row = self._cur.execute(query, args).fetchone()
+            if row is None:
+                continue
+            old = row[3] or 0
+            self._cur.execute('UPDATE Inventory SET In_Stock = ? WHERE rowid = ?', (old + float(delta), row[0]))
+            changes.append((row[1], row[2], row[3], old + float(delta)))
+        description = tuple((name, None, None, None, None, None, None) for name in ('ItemNum', 'ItemName', 'OldStock', 'NewStock'))
+        cls = row_class(description)
+        self._rows = [cls(r) for r in changes]
+        self.description, self.rowcount = description, len(changes)
+
+    # --- results ---
+    def _wrap(self, rows):
+        if not rows or self.description is None:
+            return list(rows)
+        cls = row_class(self.description)
+        return [cls(r) for r in rows]
+
+    def fetchone(self):
+        if self._rows is not None:
+            return self._rows.pop(0) if self._rows else None
+        row = self._cur.fetchone()
+        return row_class(self.description)(row) if row is not None else None
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        if self._rows is not None:
+            rows, self._rows = self._rows[:size], self._rows[size:]
+            return rows
+        return self._wrap(self._cur.fetchmany(size))
+
+    def fetchall(self):
+        if self._rows is not None:
+            rows, self._rows = self._rows, []
+            return rows
+        return self._wrap(self._cur.fetchall())
+
+    def fetchval(self):
+        row = self.fetchone()
+        return row[0] if row is not None else None
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def nextset(self):
+        return False
+
+    def close(self):
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Connection:
+    def __init__(self, path, autocommit=False):
+        self.path = path
+        self._conn = open_sqlite(path)
+        self._conn.isolation_level = None  # Transactions are opened explicitly (_begin) like pyodbc's implicit ones
+        self._lock = threading.RLock()
+        self._in_txn = False
+        self.autocommit = autocommit
+        self.timeout = 0
+
+    def _begin(self):
+        if not self.autocommit and not self._in_txn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._in_txn = True
+
+    def cursor(self):
+        if self._conn is None:
+            raise ProgrammingError('08003', '[08003] Attempt to use a closed connection.')
+        return Cursor(self)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def commit(self):
+        with self._lock:
+            if self._in_txn:
+                self._conn.execute('COMMIT')
+                self._in_txn = False
+
+    def rollback(self):
+        with self._lock:
+            if self._in_txn:
+                self._conn.execute('ROLLBACK')
+                self._in_txn = False
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                if self._in_txn:
+                    self._conn.execute('ROLLBACK')
+                    self._in_txn = False
+                self._conn.close()
+                self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
@@ -0,0 +1,376 @@
+"""
+Transfer Load Test
+==================
+Month-end volume for the transfer engine: hundreds of approved multi-line transfers
+between S stores at once, against the mock Supabase (mock_postgrest.py) and one
+PCAmerica stand-in per store (standin_sql.py), with every store's agent syncing in
+this process (fleet_sim.SimStore) and POS sales running alongside.
+
+    store agents   approved -> source decrements, in_transit -> destination increments, completed
+    legacy agents  approved -> source decrements, completed -> destination increments, received
+                   (claim_transfers RPC)
+
+It reports:
+
+    approved -> shipped -> received   per transfer, p50 / p90 / p99 / max, from the cloud's status
+    throughput                        transfer lines and units applied per second, both sides
+    stuck                             transfers not received within --drain-timeout, by status
+    ledger                            (transfer, direction) applied more than once at a store
+    stock                             every item's final In_Stock against initial + POS + transfers,
+                                      over (double-applied) / under (lost or overwritten)
+
+--twins gives every store a second agent on the same database with its own state -
+two installs of the agent on one store, the way transfers get applied twice.
+
+    python benchmarks/transfer_load.py [--stores 4] [--transfers 300] [--max-lines 12] [--kind store]
+                                       [--rate 0] [--interval 10] [--pos-rate 30] [--twins]
+                                       [--network flaky_uplink] [--error-rate 0.02] [--out transfers.json]
+
+All stores share one catalogue (the same --seed), so every line exists at both ends.
+Stock expectations count a transfer's decrement once the cloud shows it shipped and
+its increment once it shows it received - a transfer stuck in between after the
+drain shows up in `stuck`, not as a stock error.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from fleet_sim import SimStore  # Sets up sys.path, the stand-in and logging for both agent kinds
+import datagen
+import probe
+import standin_sql
+from mock_postgrest import conditions_from_args, network_arguments, serve
+
+TERMINAL = {'store': 'completed', 'legacy': 'received'}  # Status once the destination has applied it
+REPEAT_LINE_PCT = 5  # Lines that repeat an item already on the transfer (the agents sum them)
+
+
+def make_transfers(stores, dataset, count, max_lines, max_qty, rng):
+    """count approved-to-be transfers between random store pairs: ([transfer row], [transfer_items row])"""
+    items = dataset.items
+    transfers, lines = [], []
+    for n in range(count):
+        source, destination = rng.sample(stores, 2)
+        transfer_id = str(uuid.uuid4())
+        transfers.append({'id': transfer_id, 'transfer_number': f'LT{dataset.seed % 100:02d}-{n + 1:06d}',
+                          'from_store_id': source.store_id, 'to_store_id': destination.store_id,
+                          'status': 'pending', 'created_by': 'transfer_load'})
+        picked = rng.sample(items, min(len(items), rng.randint(1, max_lines)))
+        for item in picked:
+            line = {'transfer_id': transfer_id, 'item_num': item['ItemNum'].strip(), 'item_name': item['ItemName'].strip(),
+                    'quantity': rng.randint(1, max_qty), 'unit_cost': item['Cost']}
+            lines.append(line)
+            if rng.random() * 100 < REPEAT_LINE_PCT:
+                lines.append({**line, 'quantity': rng.randint(1, max_qty)})
+    return transfers, lines
+
+
+class Watcher:
+    """Polls the mock's transfers table (in-process) and keeps the first time each status was seen"""
+
+    def __init__(self, mock, terminal):
+        self.mock = mock
+        self.terminal = terminal
+        self.approved = {}  # transfer_id -> wall time it was approved
+        self.shipped = {}
+        self.received = {}
+        self.status = {}
+        self.lock = threading.Lock()
+
+    def approve(self, transfer_ids):
+        """Flip pending transfers to approved, as the web app's approve button does"""
+        now = datetime.now(timezone.utc).isoformat()
+        with self.mock.lock:
+            for i in range(0, len(transfer_ids), 500):
+                batch = transfer_ids[i:i + 500]
+                self.mock.update('transfers', {'status': 'approved', 'approved_at': now, 'approved_by': 'transfer_load'},
+                                 [('id', f"in.({','.join(batch)})")])
+        at = time.time()
+        with self.lock:
+            for transfer_id in transfer_ids:
+                self.approved[transfer_id] = at
+
+    def poll(self):
+        with self.mock.lock:
+            rows = self.mock.conn.execute('SELECT id, status, shipped_at FROM transfers').fetchall()
+        now = time.time()
+        with self.lock:
+            for transfer_id, status, shipped_at in rows:
+                if transfer_id not in self.approved:
+                    continue
+                self.status[transfer_id] = status
+                if shipped_at and transfer_id not in self.shipped:
+                    self.shipped[transfer_id] = now
+                if status == self.terminal and transfer_id not in self.received:
+                    self.received[transfer_id] = now
+                    self.shipped.setdefault(transfer_id, now)
+
+    def run(self, stop, every=0.25):
+        while not stop.wait(every):
+            self.poll()
+        self.poll()
+
+    def done(self):
+        with self.lock:
+            return len(self.received) == len(self.approved)
+
+
+def release(watcher, transfers, rate, stop):
+    """Approve everything at once (rate 0, the month-end burst) or at rate transfers per minute"""
+    ids = [t['id'] for t in transfers]
+    if not rate:
+        watcher.approve(ids)
+        return
+    pause = 60 / rate
+    for transfer_id in ids:
+        watcher.approve([transfer_id])
+        if stop.wait(pause):
+            return
+
+
+def read_stock(store):
+    conn = standin_sql.open_sqlite(store.db_path)
+    try:
+        return {num.rstrip().casefold(): stock for num, stock in conn.execute('SELECT ItemNum, In_Stock FROM Inventory')}
+    finally:
+        conn.close()
+
+
+def ledger_counts(store):
+    """(transfer_id, direction) -> times applied at this store, from Sync_Transfer_Ledger - both agent kinds
+    write it next to the stock it guards, one row per item, so count per item first"""
+    counts = {}
+    conn = standin_sql.open_sqlite(store.db_path)
+    try:
+        rows = conn.execute('SELECT Transfer_ID, Direction, Item_Num, COUNT(*) FROM Sync_Transfer_Ledger '
+                            'GROUP BY Transfer_ID, Direction, Item_Num').fetchall()
+    except sqlite3.OperationalError:
+        rows = []  # No transfer applied yet - the legacy agent creates the table on first use
+    finally:
+        conn.close()
+    for transfer_id, direction, _, times in rows:
+        key = (transfer_id, direction)
+        counts[key] = max(counts.get(key, 0), times)
+    return counts
+
+
+def stock_check(stores, initial, final, transfers, lines, watcher):
+    """Per store: items whose In_Stock isn't initial + POS + applied transfer lines"""
+    by_id = {t['id']: t for t in transfers}
+    expected = {s.store_id: dict(initial[s.store_id]) for s in stores}
+    for s in stores:
+        for key, delta in s.pos_deltas.items():
+            if key in expected[s.store_id]:
+                expected[s.store_id][key] += delta
+    for line in lines:
+        t = by_id[line['transfer_id']]
+        key = line['item_num'].casefold()
+        if line['transfer_id'] in watcher.shipped:
+            expected[t['from_store_id']][key] -= line['quantity']
+        if line['transfer_id'] in watcher.received:
+            expected[t['to_store_id']][key] += line['quantity']
+    result = {}
+    for s in stores:
+        over = under = 0.0
+        wrong = 0
+        for key, want in expected[s.store_id].items():
+            diff = (final[s.store_id].get(key) or 0) - want
+            if abs(diff) > 1e-6:
+                wrong += 1
+                over += max(diff, 0)
+                under += max(-diff, 0)
+        result[s.store_id] = {'items_wrong': wrong, 'units_over': round(over, 2), 'units_under': round(under, 2)}
+    return result
+
+
+def run(workdir, args):
+    conditions = conditions_from_args(args, seed=args.seed)
+    server = serve(conditions=conditions)
+    rng = random.Random(args.seed)
+    dataset = datagen.generate_store(args.items, seed=args.seed)
+    stores, threads = [], []
+    stop, stop_release = threading.Event(), threading.Event()
+    watcher = Watcher(server.mock, TERMINAL[args.kind])
+    try:
+        for i in range(args.stores):
+            store = SimStore(i + 1, args.kind, workdir, server, dataset, args.interval)
+            if args.twins:
+                store.add_agent()
+            stores.append(store)
+        initial = {s.store_id: read_stock(s) for s in stores}
+        transfers, lines = make_transfers(stores, dataset, args.transfers, args.max_lines, args.max_qty, rng)
+        with server.mock.lock:
+            server.mock.insert('transfers', transfers)
+            for i in range(0, len(lines), 1000):
+                server.mock.insert('transfer_items', lines[i:i + 1000])
+        before = server.mock.snapshot()
+
+        for store in stores:
+            for agent in store.agents:
+                threads.append(threading.Thread(target=store.run, args=(stop, rng.uniform(0, args.interval), agent), daemon=True))
+            if args.pos_rate:
+                threads.append(threading.Thread(target=store.traffic, args=(stop, args.pos_rate), daemon=True))
+        poller = threading.Thread(target=watcher.run, args=(stop,), daemon=True)
+        releaser = threading.Thread(target=release, args=(watcher, transfers, args.rate, stop_release), daemon=True)
+        for t in threads + [poller, releaser]:
+            t.start()
+        started = time.time()
+        releaser.join()
+        released = time.time()
+        while time.time() - released < args.drain_timeout and not watcher.done():
+            time.sleep(0.5)
+        stop.set()
+        for t in threads:
+            t.join(timeout=max(60, 3 * args.interval))
+        poller.join(timeout=60)
+        wall = time.time() - started
+        after = server.mock.snapshot()
+        final = {s.store_id: read_stock(s) for s in stores}
+        ledgers = {s.store_id: ledger_counts(s) for s in stores}
+    finally:
+        stop.set()
+        stop_release.set()
+        for store in stores:
+            store.close()
+        server.stop()
+
+    return report(args, stores, transfers, lines, watcher, initial, final, ledgers, before, after, wall, conditions)
+
+
+def report(args, stores, transfers, lines, watcher, initial, final, ledgers, before, after, wall, conditions):
+    ids = [t['id'] for t in transfers]
+    shipping = [watcher.shipped[i] - watcher.approved[i] for i in ids if i in watcher.shipped]
+    receiving = [watcher.received[i] - watcher.shipped[i] for i in ids if i in watcher.received]
+    end_to_end = [watcher.received[i] - watcher.approved[i] for i in ids if i in watcher.received]
+    stuck = {}
+    for i in ids:
+        if i not in watcher.received:
+            status = watcher.status.get(i, 'pending')
+            stuck[status] = stuck.get(status, 0) + 1
+
+    lines_by_transfer = {}
+    for line in lines:
+        entry = lines_by_transfer.setdefault(line['transfer_id'], [0, 0])
+        entry[0] += 1
+        entry[1] += line['quantity']
+    applied_lines = sum(lines_by_transfer[i][0] for i in watcher.shipped) + sum(lines_by_transfer[i][0] for i in watcher.received)
+    applied_units = sum(lines_by_transfer[i][1] for i in watcher.shipped) + sum(lines_by_transfer[i][1] for i in watcher.received)
+    first = min(watcher.approved.values()) if watcher.approved else 0
+    last = max(list(watcher.received.values()) + list(watcher.shipped.values()) or [first])
+    span = max(last - first, 1e-9)
+
+    twice = {s.store_id: sum(1 for times in ledgers[s.store_id].values() if times > 1) for s in stores}
+    served = {key: {f: s[f] - before.get(key, {}).get(f, 0) for f in s} for key, s in after.items()}
+    total = lambda field: sum(s[field] for s in served.values())
+    return {
+        'kind': args.kind,
+        'stores': args.stores,
+        'twins': args.twins,
+        'transfers': len(transfers),
+        'lines': len(lines),
+        'network': conditions.describe(),
+        'seconds': round(wall, 1),
+        'received': len(watcher.received),
+        'stuck': stuck,
+        'approved_to_shipped': probe.latency_summary(shipping),
+        'shipped_to_received': probe.latency_summary(receiving),
+        'approved_to_received': probe.latency_summary(end_to_end),
+        'lines_per_second': round(applied_lines / span, 1),
+        'units_per_second': round(applied_units / span, 1),
+        'applied_twice': twice,
+        'stock': stock_check(stores, initial, final, transfers, lines, watcher),
+        'requests': total('requests'),
+        'errors': total('errors'),
+        'injected': total('injected'),
+        'faults': dict(conditions.faults),
+    }
+
+
+def print_report(r):
+    network = ', '.join(f'{k}={v}' for k, v in r['network'].items() if v) or 'unthrottled'
+    print(f"{r['transfers']} transfers ({r['lines']} lines) between {r['stores']} {r['kind']} stores"
+          f"{' with twin agents' if r['twins'] else ''}, network: {network}")
+    print(f"  received {r['received']}/{r['transfers']} in {r['seconds']:.0f}s"
+          f"{'' if not r['stuck'] else '  stuck: ' + ', '.join(f'{k} {v}' for k, v in r['stuck'].items())}")
+    fmt = lambda v: f'{v:.1f}s' if v is not None else '-'
+    for name in ('approved_to_shipped', 'shipped_to_received', 'approved_to_received'):
+        s = r[name]
+        print(f"  {name:<21} p50 {fmt(s['p50'])}  p90 {fmt(s['p90'])}  p99 {fmt(s['p99'])}  max {fmt(s['max'])}  (n={s['arrived']})")
+    print(f"  throughput            {r['lines_per_second']} lines/s, {r['units_per_second']} units/s  "
+          f"({r['requests']} requests, {r['errors']} errors, {r['injected']} injected)")
+    if r['injected']:
+        print(f"  faults                {', '.join(f'{kind} {n}' for kind, n in r['faults'].items() if n)}")
+    twice = sum(r['applied_twice'].values())
+    print(f"  ledger                {twice} transfer sides applied more than once")
+    for store_id, s in r['stock'].items():
+        flag = '' if not s['items_wrong'] else f"  <- {s['items_wrong']} items wrong: +{s['units_over']:g} / -{s['units_under']:g} units"
+        print(f"  stock {store_id:<15} {'ok' if not s['items_wrong'] else 'MISMATCH'}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Concurrent multi-line transfers between stand-in stores')
+    parser.add_argument('--stores', type=int, default=4)
+    parser.add_argument('--kind', choices=tuple(TERMINAL), default='store')
+    parser.add_argument('--items', type=int, default=2000, help='Catalogue size (shared by every store)')
+    parser.add_argument('--transfers', type=int, default=300)
+    parser.add_argument('--max-lines', type=int, default=12, help='Lines per transfer: 1 to this')
+    parser.add_argument('--max-qty', type=int, default=5, help='Units per line: 1 to this')
+    parser.add_argument('--rate', type=float, default=0, help='Approvals per minute (0: all at once)')
+    parser.add_argument('--interval', type=int, default=10, help='Agent sync interval (seconds)')
+    parser.add_argument('--pos-rate', type=float, default=30, help='POS events per store and minute')
+    parser.add_argument('--twins', action='store_true', help='A second agent per store, on the same database')
+    parser.add_argument('--drain-timeout', type=float, default=300, help='Seconds to wait for the last transfer after release')
+    network_arguments(parser)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING', help='Agent log level (the log goes to agents.log)')
+    parser.add_argument('--out', default=None, help='Also write the results as JSON')
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--keep', action='store_true')
+    args = parser.parse_args(argv)
+    if args.stores < 2:
+        parser.error('--stores must be at least 2')
+    os.environ.pop('SUPABASE_URL', None)
+    os.environ.pop('SUPABASE_KEY', None)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='transfer-load-')
+    os.makedirs(workdir, exist_ok=True)
+    log_file = open(os.path.join(workdir, 'agents.log'), 'w', encoding='utf-8')
+    root = logging.getLogger()
+    root.setLevel(args.log_level.upper())
+    handler = logging.StreamHandler(log_file)
+    root.addHandler(handler)
+    print(f"[TRANSFERS] {args.transfers} transfers between {args.stores} {args.kind} stores...", flush=True)
+    try:
+        with contextlib.redirect_stdout(log_file):
+            result = run(workdir, args)
+    finally:
+        root.removeHandler(handler)
+        log_file.close()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif args.keep:
+            print(f"[TRANSFERS] Work directory kept: {workdir}")
+    print_report(result)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -6,5 +6,8 @@ pyinstaller --onefile --console --name "JD-GURUS-StoreH-Sync" store-h-agent.py
 echo Building Store K Agent...
 pyinstaller --onefile --console --name "JD-GURUS-StoreK-Sync" store-k-agent.py
 
+echo Building Multi-Store Agent...
+pyinstaller --onefile --console --name "JD-GURUS-MultiStore-Sync" multi-store-agent.py
+
 echo Done!
 pause
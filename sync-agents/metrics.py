@@ -0,0 +1,218 @@
+"""
+Sync Metrics
+============
+In-process metrics for the store agents, exported in Prometheus text format.
+
+One Metrics registry per store. Work is attributed to the phase running on the
+current thread (set by Metrics.phase()), so the HTTP hook on the shared session
+and the metered SQL cursor don't need to know which store or phase they serve.
+
+Per phase and cycle: wall time, rows read / written, batches, HTTP requests,
+bytes sent / received, SQL statements and errors. Running totals and latency
+histograms (phase, HTTP, SQL) are kept for the Prometheus export; the per-cycle
+breakdown is logged as a one-line summary and kept as `last_cycle`.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PHASE_FIELDS = ('rows_read', 'rows_written', 'batches', 'http_requests', 'bytes_sent', 'bytes_received', 'sql_statements', 'errors')
+
+_current = threading.local()  # .metrics / .phase of the phase running on this thread
+
+
+def current():
+    """(metrics, phase) for the calling thread, or (None, None) outside a metered phase"""
+    return getattr(_current, 'metrics', None), getattr(_current, 'phase', None)
+
+
+def count(field, n=1):
+    """Add n to a field of the phase running on this thread (no-op outside a phase)"""
+    metrics, phase = current()
+    if metrics is not None:
+        metrics.add(phase, field, n)
+
+
+def record_http(response, *args, **kwargs):
+    """requests response hook - install once on the shared session"""
+    metrics, phase = current()
+    if metrics is not None:
+        body = response.request.body
+        sent = len(body) if isinstance(body, (bytes, str)) else 0
+        metrics.observe_http(phase, response.request.method, response.status_code,
+                             response.elapsed.total_seconds(), sent, len(response.content or b''))
+    return response
+
+
+def record_sql(seconds):
+    metrics, phase = current()
+    if metrics is not None:
+        metrics.observe_sql(phase, seconds)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value):
+        self.total += value
+        self.n += 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    def __init__(self, store_id):
+        self.store_id = store_id
+        self.lock = threading.Lock()
+        self.totals = {}  # (phase, field) -> running total
+        self.histograms = {}  # (metric, phase) -> Histogram
+        self.gauges = {}  # name -> value (queue depths, reconnects, ...)
+        self.cycle = {}  # phase -> {'seconds', field: n} for the running cycle
+        self.cycle_started = None
+        self.cycles = 0
+        self.last_cycle = None  # Summary of the last finished cycle
+
+    # --- Recording ---
+    def add(self, phase, field, n=1):
+        phase = phase or 'other'
+        with self.lock:
+            stats = self.cycle.setdefault(phase, {'seconds': 0.0})
+            stats[field] = stats.get(field, 0) + n
+            self.totals[(phase, field)] = self.totals.get((phase, field), 0) + n
+
+    def observe(self, metric, phase, seconds):
+        with self.lock:
+            self.histograms.setdefault((metric, phase or 'other'), Histogram()).observe(seconds)
+
+    def observe_http(self, phase, method, status, seconds, sent, received):
+        self.add(phase, 'http_requests')
+        self.add(phase, 'bytes_sent', sent)
+        self.add(phase, 'bytes_received', received)
+        if status >= 400:
+            self.add(phase, 'http_errors')
+        self.observe('http_request_seconds', phase, seconds)
+
+    def observe_sql(self, phase, seconds):
+        self.add(phase, 'sql_statements')
+        self.observe('sql_statement_seconds', phase, seconds)
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def phase(self, name):
+        """Attribute everything the current thread does to phase `name` and time it"""
+        previous = current()
+        _current.metrics, _current.phase = self, name
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - started
+            _current.metrics, _current.phase = previous
+            with self.lock:
+                stats = self.cycle.setdefault(name, {'seconds': 0.0})
+                stats['seconds'] += seconds
+                self.totals[(name, 'seconds')] = self.totals.get((name, 'seconds'), 0) + seconds
+            self.observe('phase_seconds', name, seconds)
+
+    # --- Cycles ---
+    def begin_cycle(self):
+        with self.lock:
+            self.cycle = {}
+            self.cycle_started = time.time()
+
+    def end_cycle(self):
+        """Close the running cycle; returns its summary {'started_at', 'seconds', 'phases': {...}}"""
+        with self.lock:
+            finished = time.time()
+            self.cycles += 1
+            self.last_cycle = {
+                'started_at': self.cycle_started,
+                'finished_at': finished,
+                'seconds': finished - (self.cycle_started or finished),
+                'phases': {name: dict(stats) for name, stats in self.cycle.items()},
+            }
+            return self.last_cycle
+
+    def summary_line(self, summary=None):
+        """One log line: total time, then per phase time / rows / HTTP / SQL"""
+        summary = summary or self.last_cycle
+        if not summary:
+            return ''
+        parts = []
+        for name, s in summary['phases'].items():
+            part = f"{name} {s.get('seconds', 0):.1f}s"
+            if s.get('rows_read') or s.get('rows_written'):
+                part += f" r{s.get('rows_read', 0)}/w{s.get('rows_written', 0)}"
+            if s.get('http_requests'):
+                part += f" http {s['http_requests']} ({(s.get('bytes_sent', 0) + s.get('bytes_received', 0)) / 1024:.0f}KB)"
+            if s.get('sql_statements'):
+                part += f" sql {s['sql_statements']}"
+            if s.get('errors'):
+                part += f" ERR {s['errors']}"
+            parts.append(part)
+        return f"{summary['seconds']:.1f}s | " + ' | '.join(parts)
+
+    # --- Export ---
+    def families(self):
+        """Metric family -> (type, [sample lines]), in export order"""
+        store = self.store_id.replace('"', '')
+        families = {}
+        with self.lock:
+            families['inventory_sync_cycles_total'] = ('counter', [f'inventory_sync_cycles_total{{store="{store}"}} {self.cycles}'])
+            # Every phase seen exports every PHASE_FIELDS counter (0 until it happens), so series don't appear mid-run
+            phases = sorted({p for p, _ in self.totals})
+            fields = ['seconds', *PHASE_FIELDS] + sorted({f for _, f in self.totals} - {'seconds', *PHASE_FIELDS})
+            for field in fields:
+                name = 'inventory_sync_phase_' + ('seconds_total' if field == 'seconds' else f'{field}_total')
+                families[name] = ('counter', [f'{name}{{store="{store}",phase="{phase}"}} {self.totals.get((phase, field), 0):g}'
+                                              for phase in phases])
+            for metric in sorted({m for m, _ in self.histograms}):
+                name = f'inventory_sync_{metric}'
+                samples = []
+                for (m, phase), h in sorted(self.histograms.items()):
+                    if m != metric:
+                        continue
+                    labels = f'store="{store}",phase="{phase}"'
+                    for bound, n in zip(LATENCY_BUCKETS, h.counts):
+                        samples.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {n}')
+                    samples.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.n}')
+                    samples.append(f'{name}_sum{{{labels}}} {h.total:.6f}')
+                    samples.append(f'{name}_count{{{labels}}} {h.n}')
+                families[name] = ('histogram', samples)
+            for gauge, value in sorted(self.gauges.items()):
+                families[f'inventory_sync_{gauge}'] = ('gauge', [f'inventory_sync_{gauge}{{store="{store}"}} {value:g}'])
+        return families
+
+    def render(self):
+        """Prometheus text exposition format"""
+        return render([self])
+
+    def write_textfile(self, path):
+        """Write the export atomically (for node_exporter's textfile collector or any file scraper)"""
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+def render(all_metrics):
+    """Prometheus text export of several stores: one TYPE line per family, then every store's samples"""
+    merged = {}
+    for m in all_metrics:
+        for name, (kind, samples) in m.families().items():
+            merged.setdefault(name, (kind, []))[1].extend(samples)
+    lines = []
+    for name, (kind, samples) in merged.items():
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
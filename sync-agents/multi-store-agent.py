@@ -0,0 +1,127 @@
+"""
+Multi-Store Sync Agent
+======================
+Serves every store profile in stores.ini from ONE process instead of one EXE per store.
+
+- [supabase] and [SETTINGS] are shared; every other section is a store (section name = CLOUD_STORE_ID)
+- One HTTP session / connection pool and one scheduler for all stores
+- Each store keeps its own SQL connection and its own state store (state_<STORE_ID>.db)
+- Stores are interleaved fairly: the store that has waited longest runs next, at most WORKERS at a time
+"""
+
+import os
+import time
+import heapq
+import itertools
+from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from store_agent import SyncAgent, BASE_DIR, make_http_session, log
+from status_server import start_status_server
+from bench import wants_bench, run_bench
+from probe import wants_probe, run_probe
+
+CONFIG_FILE = os.path.join(BASE_DIR, 'stores.ini')
+RECONNECT_DELAY = 60  # Seconds before retrying a store whose database was unreachable
+
+
+def load_profiles(path):
+    """Return (shared settings, [store profile, ...]) from a multi-store config"""
+    parser = ConfigParser()
+    parser.optionxform = str  # Keep SQL_SERVER etc. upper case like the single-store config.ini
+    parser.read(path, encoding='utf-8')
+
+    shared = {}
+    if parser.has_section('SETTINGS'):
+        shared.update(parser['SETTINGS'])
+    if parser.has_section('supabase'):
+        shared['supa_url'] = parser['supabase'].get('url', '')
+        shared['supa_key'] = parser['supabase'].get('key', '')
+
+    profiles = []
+    for section in parser.sections():
+        if section in ('SETTINGS', 'supabase'):
+            continue
+        profile = dict(shared)
+        profile['CLOUD_STORE_ID'] = section
+        profile.update(parser[section])
+        profiles.append(profile)
+    return shared, profiles
+
+
+def run_store_cycle(agent):
+    """Run one cycle for one store; connects (or reconnects) first if needed. Returns seconds until the next run."""
+    if agent.sql_conn is None and not agent.start():
+        agent.log(f"[WARN] Database connection failed, retrying in {RECONNECT_DELAY}s", "WARNING")
+        return RECONNECT_DELAY
+    try:
+        agent.run_cycle()
+    except Exception as e:
+        agent.log(f"[ERROR] Cycle failed: {e}", "ERROR")
+    return agent.sync_interval
+
+
+def run(agents, workers):
+    """Fair scheduler: (due time, FIFO sequence) queue feeding a bounded worker pool"""
+    seq = itertools.count()
+    queue = [(0, next(seq), agent) for agent in agents]
+    heapq.heapify(queue)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='store') as pool:
+        while True:
+            now = time.monotonic()
+            # A store is never queued while it is running, so its SQL connection is only used by one thread
+            while queue and queue[0][0] <= now and len(running) < workers:
+                _, _, agent = heapq.heappop(queue)
+                running[pool.submit(run_store_cycle, agent)] = agent
+
+            timeout = max(0, queue[0][0] - now) if queue and len(running) < workers else None
+            if not running:
+                time.sleep(timeout)
+                continue
+
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                agent = running.pop(future)
+                delay = future.result()
+                heapq.heappush(queue, (time.monotonic() + delay, next(seq), agent))
+
+
+def main():
+    log(f" Loading config from: {CONFIG_FILE}")
+    shared, profiles = load_profiles(CONFIG_FILE)
+    if not profiles:
+        log(f"[ERROR] No store sections found in {CONFIG_FILE}", "ERROR")
+        input("Press Enter to exit...")
+        return
+
+    workers = max(1, min(len(profiles), int(shared.get('WORKERS', 4))))
+    http = make_http_session(pool_size=workers)
+    agents = [SyncAgent(p, http=http) for p in profiles]
+    log(f" Starting Multi-Store Agent - {len(agents)} stores ({', '.join(a.store_id for a in agents)}), {workers} workers")
+
+    if wants_bench() or wants_probe():
+        try:
+            if wants_bench():
+                run_bench(agents)
+            else:
+                run_probe(agents)
+        finally:
+            for agent in agents:
+                agent.close()
+        return
+
+    status = start_status_server(agents, shared, http=http, workers=workers, log=log)
+    try:
+        run(agents, workers)
+    except KeyboardInterrupt:
+        log("⏹️ Agent stopped by user")
+    finally:
+        if status is not None:
+            status.stop()
+        for agent in agents:
+            agent.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Propagation Probe
+=================
+`--probe` measures how long a change takes to cross the sync, end to end, while the
+store's agent keeps running as it always does (the installed service, another
+process). Marked writes go out at a steady rate and are timestamped when they show
+up on the other side:
+
+    web_to_local   probe item renamed in Supabase (as the web app would), seen in the store's Inventory
+    pos_to_cloud   probe item renamed in the store's Inventory (as the POS would), seen in Supabase
+
+Only dedicated probe items are ever written - SYNCPROBE-D01.. (web -> local) and
+SYNCPROBE-U01.. (pos -> cloud). Missing ones are created in the cloud at start-up
+and the agent brings them down like any web-created item. They are left behind
+afterwards (price 0, in the POS and in the cloud) and reused by the next run -
+--probe-cleanup deletes them instead, the way the web app does: marked DELETED in
+the cloud, removed from the store by the agent's tombstone phase. Each item has at most one marker in flight, and rests
+PROBE_COOLDOWN seconds after it arrived, so the next marker on it isn't caught by
+the agent's 3-second same-version rule (diff_inventory) - that would measure the
+conflict rule, not the propagation delay.
+
+Latency percentiles are logged per --probe-window and for the whole run. A marker
+not seen within --probe-timeout counts as lost (overwritten, or stuck); skipped
+means every probe item was still busy when a write was due - the sync can't keep
+up with --probe-rate.
+
+    store-h-agent.py --probe [--probe-rate=6] [--probe-duration=600] [--probe-window=60]
+                             [--probe-items=4] [--probe-dept=PROBE] [--probe-out=probe.json] [--probe-cleanup]
+    multi-store-agent.py --probe [--probe-store=STORE-K] ...   (default: the first store)
+
+benchmarks/probe_standin.py runs the same probe against the stand-in database and
+the mock cloud, with an agent syncing in-process.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+
+DIRECTIONS = ('web_to_local', 'pos_to_cloud')
+PREFIX = {'web_to_local': 'SYNCPROBE-D', 'pos_to_cloud': 'SYNCPROBE-U'}
+PROBE_COOLDOWN = 5  # Seconds an item rests after its marker arrived (agent's clock tolerance is 3s)
+
+
+def wants_probe(argv=None):
+    return '--probe' in (sys.argv[1:] if argv is None else argv)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='--probe', description='Measure end-to-end sync propagation delay',
+                                     epilog='Probe items (SYNCPROBE-*, price 0) are left in the store and the cloud '
+                                            'for the next run unless --probe-cleanup is given.')
+    parser.add_argument('--probe', action='store_true')
+    parser.add_argument('--probe-store', default=None, help='Store to probe (multi-store config; default: the first)')
+    parser.add_argument('--probe-rate', type=float, default=6, help='Marked writes per minute and direction')
+    parser.add_argument('--probe-duration', type=float, default=600, help='Seconds to probe for')
+    parser.add_argument('--probe-window', type=float, default=60, help='Seconds per reported window')
+    parser.add_argument('--probe-timeout', type=float, default=300, help='Seconds before a marker counts as lost')
+    parser.add_argument('--probe-items', type=int, default=4, help='Probe items per direction (markers in flight at once)')
+    parser.add_argument('--probe-poll', type=float, default=1.0, help='Seconds between checks of both sides')
+    parser.add_argument('--probe-dept', default=None, help='Department for new probe items (default: the first local one)')
+    parser.add_argument('--probe-out', default=None, help='Also write the results as JSON')
+    parser.add_argument('--probe-cleanup', action='store_true', help='Delete the probe items afterwards (needs the agent running)')
+    return parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def latency_summary(seconds):
+    summary = {'arrived': len(seconds)}
+    for name, pct in (('p50', 50), ('p90', 90), ('p99', 99)):
+        value = percentile(seconds, pct)
+        summary[name] = round(value, 2) if value is not None else None
+    summary['max'] = round(max(seconds), 2) if seconds else None
+    return summary
+
+
+class Tracker:
+    """Marked writes in flight, and when (or whether) they arrived - thread-safe"""
+
+    def __init__(self, timeout, window=60):
+        self.timeout = timeout
+        self.window = window
+        self.started = time.time()
+        self.in_flight = []  # (direction, key, marker, written_at)
+        self.arrivals = {d: [] for d in DIRECTIONS}  # (written_at, seconds)
+        self.lost = {d: [] for d in DIRECTIONS}  # written_at
+        self.skipped = {d: [] for d in DIRECTIONS}  # due_at
+        self.unresolved = {d: 0 for d in DIRECTIONS}  # Still in flight when the run ended
+        self.lock = threading.Lock()
+
+    def sent(self, direction, key, marker, at=None):
+        with self.lock:
+            self.in_flight.append((direction, key, marker, at or time.time()))
+
+    def skip(self, direction, at=None):
+        with self.lock:
+            self.skipped[direction].append(at or time.time())
+
+    def pending(self):
+        with self.lock:
+            return list(self.in_flight)
+
+    def busy(self, direction):
+        """Keys with a marker in flight"""
+        with self.lock:
+            return {key for d, key, _, _ in self.in_flight if d == direction}
+
+    def settle(self, seen, final=False):
+        """seen(direction, key, marker) -> bool; records arrivals and expiries. Returns [(direction, key)] that arrived."""
+        now = time.time()
+        arrived = []
+        for entry in self.pending():
+            direction, key, marker, written = entry
+            if seen(direction, key, marker):
+                outcome = ('arrived', now - written)
+            elif now - written > self.timeout:
+                outcome = ('lost', None)
+            elif final:
+                outcome = ('unresolved', None)
+            else:
+                continue
+            with self.lock:
+                self.in_flight.remove(entry)
+                if outcome[0] == 'arrived':
+                    self.arrivals[direction].append((written, outcome[1]))
+                elif outcome[0] == 'lost':
+                    self.lost[direction].append(written)
+                else:
+                    self.unresolved[direction] += 1
+            if outcome[0] == 'arrived':
+                arrived.append((direction, key))
+        return arrived
+
+    def summary(self, direction, since=None, until=None):
+        """Latency summary of the markers written in [since, until)"""
+        inside = lambda t: (since is None or t >= since) and (until is None or t < until)
+        with self.lock:
+            seconds = [s for written, s in self.arrivals[direction] if inside(written)]
+            lost = sum(1 for written in self.lost[direction] if inside(written))
+            skipped = sum(1 for due in self.skipped[direction] if inside(due))
+        return {**latency_summary(seconds), 'lost': lost, 'skipped': skipped}
+
+    def report(self):
+        """Whole run per direction, plus one entry per window (by write time)"""
+        now = time.time()
+        windows = []
+        start = self.started
+        while start < now:
+            windows.append({'start': round(start - self.started),
+                            **{d: self.summary(d, start, start + self.window) for d in DIRECTIONS}})
+            start += self.window
+        totals = {d: {**self.summary(d), 'unresolved': self.unresolved[d]} for d in DIRECTIONS}
+        return {'seconds': round(now - self.started, 1), **totals, 'windows': windows}
+
+
+class Probe:
+    """Marked writes on one store's probe items, through its own SQL connection and the cloud REST API"""
+
+    def __init__(self, agent, args):
+        self.agent = agent
+        self.args = args
+        self.headers = {'apikey': agent.supa_key, 'Authorization': f'Bearer {agent.supa_key}'}
+        self.items = {d: [f'{PREFIX[d]}{n:02d}' for n in range(1, args.probe_items + 1)] for d in DIRECTIONS}
+        self.resting = {}  # item_num -> time it may take a marker again
+        self.run_tag = time.strftime('%H%M')
+        self.seq = 0
+        self.tracker = Tracker(args.probe_timeout, args.probe_window)
+
+    @property
+    def all_items(self):
+        return [i for d in DIRECTIONS for i in self.items[d]]
+
+    def marker(self, direction):
+        """Fits ItemName (30): SYNCPROBE D 1402-000017"""
+        self.seq += 1
+        return f"SYNCPROBE {'D' if direction == 'web_to_local' else 'U'} {self.run_tag}-{self.seq:06d}"
+
+    def cloud_names(self):
+        url = f"{self.agent.supa_url}/rest/v1/inventory"
+        params = {'select': 'item_num,item_name', 'store_id': f'eq.{self.agent.store_id}',
+                  'item_num': f"in.({','.join(self.all_items)})"}
+        res = self.agent.http.get(url, params=params, headers=self.headers, timeout=30)
+        res.raise_for_status()
+        return {r['item_num'].strip(): (r['item_name'] or '').strip() for r in res.json()}
+
+    def local_names(self):
+        cursor = self.agent.sql_conn.cursor()
+        marks = ','.join('?' for _ in self.all_items)
+        cursor.execute(f"SELECT ItemNum, ItemName FROM Inventory WHERE ItemNum IN ({marks})", self.all_items)
+        names = {str(r.ItemNum).strip(): (r.ItemName or '').strip() for r in cursor.fetchall()}
+        self.agent.sql_conn.commit()  # End the read transaction so the next poll sees the agent's commits
+        return names
+
+    def default_dept(self):
+        cursor = self.agent.sql_conn.cursor()
+        cursor.execute("SELECT TOP 1 Dept_ID FROM Departments ORDER BY Dept_ID")
+        row = cursor.fetchone()
+        self.agent.sql_conn.commit()
+        return str(row.Dept_ID).strip() if row else 'NONE'
+
+    def setup(self):
+        """Create missing probe items in the cloud and wait for the agent to bring them down. Returns seconds waited."""
+        missing = [i for i in self.all_items if i not in self.cloud_names()]
+        if missing:
+            dept = self.args.probe_dept or self.default_dept()
+            rows = [{'item_num': i, 'item_name': f'SYNCPROBE {i[-3:]}', 'store_id': self.agent.store_id, 'dept_id': dept,
+                     'in_stock': 0, 'cost': 0, 'price': 0, 'retail_price': 0} for i in missing]
+            headers = {**self.headers, 'Content-Type': 'application/json', 'Prefer': 'resolution=merge-duplicates,return=minimal'}
+            res = self.agent.http.post(f"{self.agent.supa_url}/rest/v1/inventory?on_conflict=item_num,store_id",
+                                       json=rows, headers=headers, timeout=30)
+            res.raise_for_status()
+            self.agent.log(f"[PROBE] Created {len(missing)} probe items in the cloud (dept {dept})")
+        started = time.time()
+        while time.time() - started < self.args.probe_timeout:
+            local = self.local_names()
+            if all(i in local for i in self.all_items):
+                return time.time() - started
+            time.sleep(self.args.probe_poll)
+        raise RuntimeError(f"probe items did not reach the store within {self.args.probe_timeout:.0f}s - is its agent running?")
+
+    def cleanup(self):
+        """Delete the probe items: marked DELETED in the cloud, then wait for the agent's tombstone phase to
+        remove them locally (and hard-delete them in the cloud). Returns seconds waited."""
+        headers = {**self.headers, 'Content-Type': 'application/json', 'Prefer': 'return=minimal'}
+        params = {'store_id': f'eq.{self.agent.store_id}', 'item_num': f"in.({','.join(self.all_items)})"}
+        res = self.agent.http.patch(f"{self.agent.supa_url}/rest/v1/inventory", params=params,
+                                    json={'item_name': 'DELETED'}, headers=headers, timeout=30)
+        res.raise_for_status()
+        started = time.time()
+        while time.time() - started < self.args.probe_timeout:
+            if not self.local_names():
+                return time.time() - started
+            time.sleep(self.args.probe_poll)
+        raise RuntimeError(f"probe items still in the store after {self.args.probe_timeout:.0f}s - is its agent running?")
+
+    def free_item(self, direction):
+        now = time.time()
+        busy = self.tracker.busy(direction)
+        for item in self.items[direction]:
+            if item not in busy and self.resting.get(item, 0) <= now:
+                return item
+        return None
+
+    def write(self, direction):
+        item = self.free_item(direction)
+        if item is None:
+            self.tracker.skip(direction)
+            return
+        marker = self.marker(direction)
+        if direction == 'web_to_local':
+            headers = {**self.headers, 'Content-Type': 'application/json', 'Prefer': 'return=minimal'}
+            params = {'store_id': f'eq.{self.agent.store_id}', 'item_num': f'eq.{item}'}
+            res = self.agent.http.patch(f"{self.agent.supa_url}/rest/v1/inventory", params=params,
+                                        json={'item_name': marker}, headers=headers, timeout=30)
+            res.raise_for_status()
+        else:
+            cursor = self.agent.sql_conn.cursor()
+            cursor.execute("UPDATE Inventory SET ItemName = ? WHERE ItemNum = ?", (marker, item))
+            self.agent.sql_conn.commit()
+        self.tracker.sent(direction, item, marker)
+
+    def check(self, final=False):
+        local = self.local_names()
+        cloud = self.cloud_names()
+        sides = {'web_to_local': local, 'pos_to_cloud': cloud}
+        for direction, item in self.tracker.settle(lambda d, key, marker: sides[d].get(key) == marker, final):
+            self.resting[item] = time.time() + PROBE_COOLDOWN
+
+    def log_window(self, start):
+        parts = []
+        for direction in DIRECTIONS:
+            s = self.tracker.summary(direction, start, start + self.args.probe_window)
+            fmt = lambda v: f'{v:.1f}s' if v is not None else '-'
+            parts.append(f"{direction} p50 {fmt(s['p50'])} p99 {fmt(s['p99'])} (n={s['arrived']}, lost {s['lost']}, skipped {s['skipped']})")
+        self.agent.log(f"[PROBE] {time.strftime('%H:%M:%S', time.localtime(start))} | {' | '.join(parts)}")
+
+    def run(self):
+        waited = self.setup()
+        self.agent.log(f"[PROBE] Probe items in place after {waited:.1f}s - probing for {self.args.probe_duration:.0f}s "
+                       f"at {self.args.probe_rate:g}/min per direction")
+        self.tracker = Tracker(self.args.probe_timeout, self.args.probe_window)
+        pause = 60 / self.args.probe_rate if self.args.probe_rate > 0 else None
+        started = self.tracker.started
+        next_write = {d: started + (pause or 0) * i / len(DIRECTIONS) for i, d in enumerate(DIRECTIONS)}
+        window = started
+        # Writes stop at the end of the duration; markers still in flight get up to --probe-timeout to land
+        while True:
+            now = time.time()
+            writing = now - started < self.args.probe_duration
+            if not writing and not self.tracker.pending():
+                break
+            if not writing and now - started > self.args.probe_duration + self.args.probe_timeout:
+                break
+            if writing and pause:
+                for direction in DIRECTIONS:
+                    if now >= next_write[direction]:
+                        try:
+                            self.write(direction)
+                        except Exception as e:
+                            self.agent.log(f"[PROBE] {direction} write failed: {e}", "WARNING")
+                        next_write[direction] += pause
+            try:
+                self.check()
+            except Exception as e:
+                self.agent.log(f"[PROBE] Check failed: {e}", "WARNING")
+            if now >= window + self.args.probe_window:
+                self.log_window(window)
+                window += self.args.probe_window
+            time.sleep(self.args.probe_poll)
+        self.check(final=True)
+        self.log_window(window)
+        report = self.tracker.report()
+        report.update({'store_id': self.agent.store_id, 'setup_seconds': round(waited, 1), 'rate_per_minute': self.args.probe_rate})
+        return report
+
+
+def log_report(agent, report):
+    agent.log(f"[PROBE] {agent.store_id}: {report['seconds']:.0f}s")
+    for direction in DIRECTIONS:
+        s = report[direction]
+        fmt = lambda v: f'{v:.1f}s' if v is not None else '-'
+        agent.log(f"[PROBE]   {direction:<13} p50 {fmt(s['p50'])}  p90 {fmt(s['p90'])}  p99 {fmt(s['p99'])}  max {fmt(s['max'])}  "
+                  f"arrived {s['arrived']}  lost {s['lost']}  skipped {s['skipped']}  unresolved {s['unresolved']}")
+
+
+def run_probe(agents, argv=None):
+    """Probe one store (--probe-store, default the first) while its agent runs elsewhere; returns the report"""
+    args = parse_args(argv)
+    agent = next((a for a in agents if a.store_id == args.probe_store), None) if args.probe_store else agents[0]
+    if agent is None:
+        raise SystemExit(f"--probe-store {args.probe_store}: no such store")
+    agent.log("[PROBE] Connecting to local SQL Server (writes go to SYNCPROBE-* items only)...")
+    if agent.sql_conn is None and not agent.connect_sql():
+        agent.log("[PROBE] Database connection failed", "ERROR")
+        return None
+    prober = Probe(agent, args)
+    try:
+        report = prober.run()
+    except Exception as e:
+        agent.log(f"[PROBE] Failed: {e}", "ERROR")
+        report = None
+    if args.probe_cleanup:
+        try:
+            agent.log(f"[PROBE] Probe items removed after {prober.cleanup():.1f}s")
+        except Exception as e:
+            agent.log(f"[PROBE] Cleanup failed: {e}", "ERROR")
+    if report is None:
+        return None
+    log_report(agent, report)
+    if args.probe_out:
+        with open(args.probe_out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
@@ -0,0 +1,225 @@
+"""
+SQL Session
+===========
+Long-lived, self-healing wrapper around the agent's pyodbc connection.
+
+Drop-in for the raw connection (cursor / commit / rollback / close), plus:
+- a liveness check (SELECT 1) before handing out a cursor after the connection sat idle
+- transparent reconnect when the connection is dead, with exponential backoff between
+  failed attempts - a phase never sleeps waiting for SQL Server, it fails fast until the
+  next attempt is due
+- query() for read-only / idempotent statements, retried once on a fresh connection
+- reconnect counters in `stats` for status reporting and metrics
+
+Statements that are not idempotent (relative stock updates, inserts) must not be
+retried blindly: they go through cursor() and simply fail the current batch. A
+transaction that spans a reconnect is never committed - its first half died with
+the old connection - commit() raises instead. Transactions are tracked per thread,
+and a phase thread the watchdog abandoned is cut off: its connection is closed and
+anything it still does through the session raises, so it can never run on, or
+commit, the fresh connection the later phases share.
+"""
+
+import random
+import threading
+import time
+import weakref
+
+import pyodbc
+import metrics
+
+LIVENESS_IDLE_SECONDS = 30  # Ping before use if the connection was idle longer than this
+BACKOFF_INITIAL = 2  # Seconds before the first reconnect retry
+BACKOFF_MAX = 120  # Cap for the exponential backoff
+# SQLSTATEs that mean "the connection is gone" rather than "this statement failed"
+CONNECTION_LOST_STATES = {'08S01', '08001', '08003', '08004', '08007', 'HYT01'}
+CONNECTION_LOST_MARKERS = ('Communication link failure', 'TCP Provider', 'connection is broken', 'Connection is busy')
+
+
+class SqlUnavailable(Exception):
+    """SQL Server is unreachable and the next reconnect attempt isn't due yet"""
+
+
+def is_connection_error(error):
+    """True if a pyodbc error means the connection itself is dead"""
+    if not isinstance(error, pyodbc.Error):
+        return False
+    state = error.args[0] if error.args else ''
+    text = str(error)
+    return state in CONNECTION_LOST_STATES or any(marker in text for marker in CONNECTION_LOST_MARKERS)
+
+
+class MeteredCursor:
+    """pyodbc cursor proxy that counts and times every statement for the running phase"""
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, *args):
+        started = time.monotonic()
+        try:
+            self._cursor.execute(*args)
+        finally:
+            metrics.record_sql(time.monotonic() - started)
+        return self
+
+    def executemany(self, *args):
+        started = time.monotonic()
+        try:
+            self._cursor.executemany(*args)
+        finally:
+            metrics.record_sql(time.monotonic() - started)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class SqlSession:
+    def __init__(self, conn, reconnect, log):
+        """conn: an open pyodbc connection; reconnect: callable returning a new connection or None"""
+        self._conn = conn
+        self._reconnect = reconnect
+        self.log = log
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+        self.backoff = 0
+        self.next_attempt = 0
+        self.generation = 0  # Bumped on every reconnect and detach
+        self.txn = threading.local()  # .generation: generation this thread's open transaction started on
+        self.abandoned = weakref.WeakSet()  # Phase threads cut off by detach()
+        self.stats = {'reconnects': 0, 'reconnect_failures': 0, 'liveness_failures': 0, 'retried_queries': 0}
+
+    # --- Connection management ---
+    def connection(self):
+        """The live raw connection, reconnecting (subject to backoff) if needed"""
+        with self.lock:
+            if self._conn is not None and time.monotonic() - self.last_used > LIVENESS_IDLE_SECONDS:
+                if not self.ping():
+                    self.stats['liveness_failures'] += 1
+                    self.log("[SQL] Liveness check failed - reconnecting", "WARNING")
+                    self.drop()
+            if self._conn is None:
+                self.reconnect()
+            self.last_used = time.monotonic()
+            return self._conn
+
+    def ping(self):
+        try:
+            cursor = self._conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def drop(self):
+        """Forget the current connection (it is dead or was abandoned)"""
+        with self.lock:
+            if self._conn is not None:
+                try: self._conn.close()
+                except Exception: pass
+            self._conn = None
+
+    def detach(self, thread=None):
+        """Cut off a thread the watchdog abandoned while it used the connection: close that connection
+        (rolling back its open transaction and releasing its locks) and open a fresh one for everyone
+        else on next use. Whatever the thread still does through the session raises SqlUnavailable."""
+        with self.lock:
+            if thread is not None:
+                self.abandoned.add(thread)
+            conn, self._conn = self._conn, None
+            self.generation += 1
+        if conn is not None:
+            try:
+                conn.rollback()
+                conn.close()
+            except Exception as e:
+                # Still busy in the stuck statement - the server releases it when that statement times out
+                self.log(f"[SQL] Could not close the abandoned connection: {e}", "WARNING")
+
+    def check_thread(self):
+        if threading.current_thread() in self.abandoned:
+            raise SqlUnavailable("Phase was abandoned by the watchdog - its SQL connection is gone")
+
+    def reconnect(self):
+        now = time.monotonic()
+        if now < self.next_attempt:
+            raise SqlUnavailable(f"SQL Server unavailable, next reconnect attempt in {self.next_attempt - now:.0f}s")
+        conn = None
+        try:
+            conn = self._reconnect()
+        except Exception as e:
+            self.log(f"[SQL] Reconnect error: {e}", "WARNING")
+        if conn is None:
+            self.stats['reconnect_failures'] += 1
+            self.backoff = min(BACKOFF_MAX, self.backoff * 2 if self.backoff else BACKOFF_INITIAL)
+            self.next_attempt = now + self.backoff * random.uniform(0.8, 1.2)
+            raise SqlUnavailable(f"SQL reconnect failed, retrying in {self.backoff}s")
+        self._conn = conn
+        self.generation += 1
+        self.backoff = 0
+        self.next_attempt = 0
+        self.stats['reconnects'] += 1
+        self.log(f"[SQL] Reconnected (reconnect #{self.stats['reconnects']})")
+
+    def handle_error(self, error):
+        """Drop the connection if an error says it is dead, so the next use reconnects"""
+        if is_connection_error(error):
+            self.log(f"[SQL] Connection lost: {str(error).splitlines()[0][:120]}", "WARNING")
+            self.drop()
+            return True
+        return False
+
+    # --- pyodbc.Connection surface ---
+    def cursor(self):
+        self.check_thread()
+        conn = self.connection()
+        if getattr(self.txn, 'generation', None) is None:
+            self.txn.generation = self.generation
+        return MeteredCursor(conn.cursor())
+
+    def commit(self):
+        """Commit on the connection the transaction started on - never on a fresh one"""
+        started_on, self.txn.generation = getattr(self.txn, 'generation', None), None
+        self.check_thread()
+        if self._conn is None or started_on not in (None, self.generation):
+            if self._conn is not None:
+                self._conn.rollback()  # Only the half that ran after the reconnect is in it
+            raise SqlUnavailable("SQL connection was lost during the transaction - changes were not committed")
+        try:
+            self._conn.commit()
+        except pyodbc.Error as e:
+            self.handle_error(e)
+            raise
+
+    def rollback(self):
+        self.txn.generation = None
+        if threading.current_thread() in self.abandoned:
+            return  # Its connection was rolled back and closed by detach()
+        try:
+            if self._conn is not None:
+                self._conn.rollback()
+        except pyodbc.Error as e:
+            self.handle_error(e)
+
+    def close(self):
+        self.drop()
+
+    # --- Idempotent statements ---
+    def query(self, sql, params=(), retries=1):
+        """Run a read-only / idempotent statement and return all rows; retried on a fresh connection if it dropped"""
+        for attempt in range(retries + 1):
+            try:
+                cursor = self.cursor()
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+                cursor.close()
+                return rows
+            except pyodbc.Error as e:
+                if not self.handle_error(e) or attempt == retries:
+                    raise
+                self.stats['retried_queries'] += 1
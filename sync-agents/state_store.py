@@ -0,0 +1,297 @@
+"""
+Sync Agent State Store
+======================
+Small embedded SQLite (WAL mode) store for everything the store agents need to
+survive a restart: phase watermarks, row digests, the cloud version mirror, the
+echo ledger, the outbox of pending cloud writes and a cache of the transfer ledger
+(Sync_Transfer_Ledger in SQL Server, committed with the stock change).
+
+It also holds the carry-over work queue: rows a phase fetched but had no room
+to apply this cycle.
+
+Every write runs in its own transaction, so a crash leaves either the old or
+the new state on disk - never a half-written file like the old sync_state.json.
+"""
+
+import sqlite3
+import threading
+import json
+import os
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS row_digests (
+    item_num TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cloud_versions (
+    item_num TEXT PRIMARY KEY,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS echo_ledger (
+    item_num TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    cloud_updated_at TEXT,
+    applied_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transfer_ledger (
+    transfer_id TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    status TEXT NOT NULL,
+    deltas TEXT,
+    applied_at TEXT NOT NULL,
+    PRIMARY KEY (transfer_id, direction)
+);
+CREATE TABLE IF NOT EXISTS work_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phase TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    UNIQUE (phase, item_key)
+);
+"""
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def row_digest(row, fields):
+    """Stable digest of the given fields (strings trimmed, numbers rounded) so local and cloud rows compare equal"""
+    values = []
+    for f in fields:
+        v = row.get(f)
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            v = round(float(v), 4)
+        elif v is None:
+            v = ''
+        else:
+            v = str(v).strip()
+        values.append(v)
+    return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+
+
+class StateStore:
+    """Transactional key/value + ledger store backed by SQLite in WAL mode"""
+
+    def __init__(self, path: str, legacy_json: str = None):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if legacy_json:
+            self._import_legacy_json(legacy_json)
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT; rolls back if the block raises"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def _import_legacy_json(self, legacy_json):
+        """One-time import of the old sync_state.json checkpoint"""
+        if self.get('legacy_json_imported') or not os.path.exists(legacy_json):
+            return
+        try:
+            with open(legacy_json, 'r') as f:
+                data = json.load(f)
+        except Exception:
+            data = {}
+        data['legacy_json_imported'] = True
+        self.set(**data)
+
+    # --- Watermarks ---
+    def get(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM watermarks WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, **values):
+        """Write one or more watermarks atomically"""
+        now = _now()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO watermarks (key, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                [(k, json.dumps(v), now) for k, v in values.items()]
+            )
+
+    # --- Row digests (last pushed version of each local row) ---
+    def get_digests(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT item_num, digest FROM row_digests").fetchall())
+
+    def put_digests(self, digests: dict):
+        """Record versions as pushed (item_num -> digest), retiring any echo row they supersede"""
+        now = _now()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO row_digests (item_num, digest, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(item_num) DO UPDATE SET digest = excluded.digest, updated_at = excluded.updated_at",
+                [(k, v, now) for k, v in digests.items()]
+            )
+            # A different version went up: Cloud no longer holds the one it last sent us, so
+            # a later revert to that version is a real change, not an echo
+            conn.executemany("DELETE FROM echo_ledger WHERE item_num = ? AND digest != ?", list(digests.items()))
+
+    # --- Cloud version mirror (item_num -> cloud updated_at) ---
+    def get_cloud_versions(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT item_num, updated_at FROM cloud_versions").fetchall())
+
+    def put_cloud_versions(self, versions: dict, replace: bool = False, **watermarks):
+        """Merge (or with replace=True, swap in) mirror rows and move their watermarks in the same transaction"""
+        now = _now()
+        with self.transaction() as conn:
+            if replace:
+                conn.execute("DELETE FROM cloud_versions")
+            conn.executemany(
+                "INSERT INTO cloud_versions (item_num, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(item_num) DO UPDATE SET updated_at = excluded.updated_at",
+                list(versions.items())
+            )
+            conn.executemany(
+                "INSERT INTO watermarks (key, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                [(k, json.dumps(v), now) for k, v in watermarks.items()]
+            )
+
+    def forget_items(self, item_nums):
+        """Drop mirror, digest and echo rows for items deleted on both sides"""
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM cloud_versions WHERE item_num = ?", [(k,) for k in item_nums])
+            conn.executemany("DELETE FROM row_digests WHERE item_num = ?", [(k,) for k in item_nums])
+            conn.executemany("DELETE FROM echo_ledger WHERE item_num = ?", [(k,) for k in item_nums])
+
+    # --- Echo ledger (exact version last applied locally FROM cloud) ---
+    def get_echo_digests(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT item_num, digest FROM echo_ledger").fetchall())
+
+    def put_echoes(self, echoes: dict):
+        """echoes: item_num -> (digest, cloud_updated_at)"""
+        now = _now()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO echo_ledger (item_num, digest, cloud_updated_at, applied_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(item_num) DO UPDATE SET digest = excluded.digest, "
+                "cloud_updated_at = excluded.cloud_updated_at, applied_at = excluded.applied_at",
+                [(k, d, u, now) for k, (d, u) in echoes.items()]
+            )
+
+    # --- Outbox (cloud writes that must eventually be delivered) ---
+    def enqueue(self, kind: str, payload: dict, conn=None):
+        """Queue a cloud write. Pass conn to join an open transaction()"""
+        sql = "INSERT INTO outbox (kind, payload, created_at) VALUES (?, ?, ?)"
+        params = (kind, json.dumps(payload), _now())
+        if conn is not None:
+            conn.execute(sql, params)
+            return
+        with self.transaction() as c:
+            c.execute(sql, params)
+
+    def pending(self, kind: str = None, limit: int = 100):
+        """Oldest queued writes as (id, kind, payload) tuples"""
+        with self.lock:
+            if kind:
+                rows = self.conn.execute("SELECT id, kind, payload FROM outbox WHERE kind = ? ORDER BY id LIMIT ?", (kind, limit)).fetchall()
+            else:
+                rows = self.conn.execute("SELECT id, kind, payload FROM outbox ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(r[0], r[1], json.loads(r[2])) for r in rows]
+
+    def ack(self, ids):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def retry_later(self, ids):
+        with self.transaction() as conn:
+            conn.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", [(i,) for i in ids])
+
+    def outbox_depth(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    # --- Transfer ledger (transfers whose stock change was applied locally) ---
+    # A cache of Sync_Transfer_Ledger in SQL Server, which commits with the stock change and is what
+    # guards against applying a transfer twice; an entry here also carries the transfer's queued status update.
+    def ledger_get(self, transfer_id, direction):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, deltas, applied_at FROM transfer_ledger WHERE transfer_id = ? AND direction = ?",
+                (str(transfer_id), direction)
+            ).fetchone()
+        if not row:
+            return None
+        return {'status': row[0], 'deltas': json.loads(row[1]) if row[1] else {}, 'applied_at': row[2]}
+
+    def ledger_record(self, transfer_id, direction, deltas: dict, status: str = 'applied', outbox: list = None):
+        """Record an applied transfer and queue its follow-up cloud writes in ONE transaction"""
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO transfer_ledger (transfer_id, direction, status, deltas, applied_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(transfer_id, direction) DO UPDATE SET status = excluded.status, deltas = excluded.deltas",
+                (str(transfer_id), direction, status, json.dumps(deltas), _now())
+            )
+            for kind, payload in (outbox or []):
+                self.enqueue(kind, payload, conn=conn)
+
+    # --- Carry-over work queue (one entry per item and phase; newer payloads replace older ones) ---
+    def queue_put(self, phase: str, items: dict, **watermarks):
+        """Queue item_key -> payload for a phase (keeping each item's place in line) and move watermarks atomically"""
+        now = _now()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO work_queue (phase, item_key, payload) VALUES (?, ?, ?) "
+                "ON CONFLICT(phase, item_key) DO UPDATE SET payload = excluded.payload",
+                [(phase, k, json.dumps(v)) for k, v in items.items()]
+            )
+            conn.executemany(
+                "INSERT INTO watermarks (key, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                [(k, json.dumps(v), now) for k, v in watermarks.items()]
+            )
+
+    def queue_take(self, phase: str, limit: int):
+        """Oldest queued entries of a phase as (item_key, payload) - they stay queued until queue_done()"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT item_key, payload FROM work_queue WHERE phase = ? ORDER BY id LIMIT ?", (phase, limit)
+            ).fetchall()
+        return [(r[0], json.loads(r[1])) for r in rows]
+
+    def queue_done(self, phase: str, keys):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM work_queue WHERE phase = ? AND item_key = ?", [(phase, k) for k in keys])
+
+    def queue_depth(self, phase: str = None):
+        with self.lock:
+            if phase:
+                return self.conn.execute("SELECT COUNT(*) FROM work_queue WHERE phase = ?", (phase,)).fetchone()[0]
+            return self.conn.execute("SELECT COUNT(*) FROM work_queue").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,133 @@
+"""
+Status Server
+=============
+Optional localhost HTTP endpoint for in-store IT: is the agent alive, what is it
+doing right now, and how did the last cycle go - without tailing the log.
+
+    GET /health   200 {"status": "ok", ...} or 503 if any store is unhealthy
+    GET /status   per store: current phase, last cycle breakdown, queue depths,
+                  SQL session / HTTP pool stats, watchdog state, effective config
+    GET /metrics  Prometheus text export of every store
+
+Enabled with STATUS_PORT in [SETTINGS] / config.ini (0 or missing = off). It
+binds to 127.0.0.1 unless STATUS_HOST says otherwise.
+
+Requests are served on their own threads and only read snapshots the agents keep
+in memory (SyncAgent.status()) - never the SQL connection or the state store -
+so a slow or stuck client can't hold up a sync cycle.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+
+DEFAULT_HOST = '127.0.0.1'
+
+
+def http_pool_stats(session):
+    """Connection pool usage of a requests session, per host"""
+    stats = {}
+    adapters = {id(a): a for a in session.adapters.values()}.values()  # https:// and http:// share one adapter
+    for adapter in adapters:
+        manager = getattr(adapter, 'poolmanager', None)
+        if manager is None:
+            continue
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            stats[f'{pool.scheme}://{pool.host}:{pool.port}'] = {
+                'maxsize': pool.pool.maxsize if pool.pool else 0,
+                'idle': pool.pool.qsize() if pool.pool else 0,
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+            }
+    return stats
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    server_version = 'InventorySyncAgent'
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].rstrip('/') or '/'
+        try:
+            if path == '/health':
+                health = self.server.health()
+                self.send_json(health, 200 if health['status'] == 'ok' else 503)
+            elif path in ('/', '/status'):
+                self.send_json(self.server.status())
+            elif path == '/metrics':
+                body = metrics.render([agent.metrics for agent in self.server.agents])
+                self.send_body(body.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+            else:
+                self.send_json({'error': f'Unknown path {path}', 'paths': ['/health', '/status', '/metrics']}, 404)
+        except Exception as e:
+            self.send_json({'error': str(e)}, 500)
+
+    def send_json(self, data, code=200):
+        self.send_body(json.dumps(data, indent=2, default=str).encode('utf-8'), 'application/json', code)
+
+    def send_body(self, body, content_type, code=200):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Don't interleave request lines with the agent log
+
+
+class StatusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, agents, port, host=DEFAULT_HOST, http=None, workers=None):
+        """agents: the SyncAgents served by this process; http: their (shared) requests session"""
+        super().__init__((host, int(port)), StatusHandler)
+        self.agents = list(agents)
+        self.http = http
+        self.workers = workers
+        self.thread = None
+
+    def health(self):
+        stores = {agent.store_id: agent.health() for agent in self.agents}
+        healthy = all(s['healthy'] for s in stores.values())
+        return {'status': 'ok' if healthy else 'unhealthy', 'stores': stores}
+
+    def status(self):
+        status = {'stores': {agent.store_id: agent.status() for agent in self.agents}}
+        if self.http is not None:
+            status['http_pool'] = http_pool_stats(self.http)
+        if self.workers is not None:
+            status['workers'] = self.workers
+        return status
+
+    def start(self):
+        """Serve on a daemon thread; returns immediately"""
+        self.thread = threading.Thread(target=self.serve_forever, name='status-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def start_status_server(agents, settings, http=None, workers=None, log=None):
+    """Start the server if settings has a STATUS_PORT; returns it (or None when disabled / the port is taken)"""
+    port = int(settings.get('STATUS_PORT', 0) or 0)
+    if not port:
+        return None
+    host = settings.get('STATUS_HOST', DEFAULT_HOST) or DEFAULT_HOST
+    try:
+        server = StatusServer(agents, port, host, http=http, workers=workers).start()
+    except OSError as e:
+        if log:
+            log(f"[WARN] Status server not started on {host}:{port}: {e}", "WARNING")
+        return None
+    if log:
+        log(f"[INFO] Status server listening on http://{host}:{port}/status")
+    return server
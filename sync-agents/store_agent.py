@@ -0,0 +1,1416 @@
+"""
+Store Sync Agent
+================
+Two-way sync between one PCAmerica store database (local SQL Server) and Supabase.
+
+store-h-agent.py / store-k-agent.py run a single store profile;
+multi-store-agent.py runs many profiles in one process with a shared HTTP pool.
+"""
+
+import pyodbc 
+import requests
+from requests.adapters import HTTPAdapter
+import time
+import os
+import sys
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from state_store import StateStore, row_digest
+from watchdog import Watchdog
+from sql_session import SqlSession, SqlUnavailable, is_connection_error
+import metrics
+from status_server import start_status_server
+
+# When running as frozen EXE, use the directory where the EXE is located
+# When running as script, use the directory where the script is located
+if getattr(sys, 'frozen', False):
+    BASE_DIR = os.path.dirname(sys.executable)
+else:
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TOMBSTONE_PAGE_SIZE = 1000  # Tombstones fetched per request
+CLOUD_IN_BATCH = 200  # Max keys per item_num=in.(...) request (keeps URLs short)
+UPLOAD_BATCH = 500  # Inventory rows per upsert request
+SQL_VALUES_BATCH = 900  # Max rows per INSERT ... VALUES (SQL Server caps at 1000 rows / 2100 params)
+MIRROR_FULL_REFRESH_HOURS = 24  # Re-scan cloud versions fully once a day to catch rows deleted outside the agent
+DIGEST_FIELDS = ('item_name', 'dept_id', 'itemtype', 'in_stock', 'cost', 'price')
+HTTP_TIMEOUT = (10, 60)  # (connect, read) seconds for every Supabase request - no request may hang forever
+SQL_LOGIN_TIMEOUT = 15  # Seconds for the cached connection path
+SQL_PROBE_TIMEOUT = 5  # Seconds per candidate while probing drivers x servers in parallel
+SQL_QUERY_TIMEOUT = 120  # Seconds before a local query is aborted by the driver
+# Most work one cycle may do per phase (override in the profile); the rest carries over to the next cycle
+DOWN_ROWS_PER_CYCLE = 5000  # Cloud rows applied locally
+UP_ROWS_PER_CYCLE = 5000  # Local rows pushed to cloud
+TOMBSTONES_PER_CYCLE = 5000  # Soft deletes consumed
+TRANSFERS_PER_CYCLE = 50  # Per direction and pass - transfers get two passes every cycle regardless of the backlog
+# Wall-clock budget per cycle phase (override with PHASE_BUDGET_<NAME> in the profile)
+PHASE_BUDGETS = {'transfers': 60, 'departments': 60, 'sync_down_inventory': 300, 'sync_inventory': 300, 'soft_deletes': 120}
+# Local inventory as pushed to cloud (fetch_inventory, bench.py)
+INVENTORY_QUERY = """
+    SELECT ItemNum, ItemName, Dept_ID, In_Stock, Cost, Price, ItemType, Local_Updated_At
+    FROM Inventory
+    WHERE Store_ID = ?
+"""
+
+def load_config(path):
+    """Flat key=value reader for the store config.ini files ([supabase] url/key -> supa_url/supa_key)"""
+    config = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or line.startswith('['): continue
+                if '=' in line:
+                    key, val = line.split('=', 1)
+                    # Handle normal keys and mapping [supabase] keys
+                    if key.strip() == 'url': config['supa_url'] = val.strip()
+                    elif key.strip() == 'key': config['supa_key'] = val.strip()
+                    else: config[key.strip()] = val.strip()
+    return config
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies HTTP_TIMEOUT to every request that doesn't pass its own"""
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = HTTP_TIMEOUT
+        return super().send(request, **kwargs)
+
+def make_http_session(pool_size=4):
+    """Keep-alive HTTP session; one is shared by every store in a multi-store process"""
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.hooks['response'].append(metrics.record_http)  # Counted against the store/phase running on the calling thread
+    return session
+
+def log(msg, level="INFO"):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] [{level}] {msg}", flush=True)
+
+def chunked(seq, size):
+    for i in range(0, len(seq), size):
+        yield seq[i:i+size]
+
+def canonical_item_num(value):
+    """Trimmed item number - the only cleanup applied to transfer/cloud item keys"""
+    return str(value).strip() if value is not None else ''
+
+def item_key(value):
+    """Lookup key: PCAmerica's collation ignores case and trailing spaces"""
+    return canonical_item_num(value).casefold()
+
+def pg_value(value):
+    """Quote one value for a PostgREST logic tree, e.g. and=(...,item_num.gt."A 1")"""
+    return urllib.parse.quote('"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"', safe='')
+
+def keyset_after(ts_col, key_col, ts, key):
+    """PostgREST filter for rows strictly after (ts, key) in ORDER BY ts_col, key_col"""
+    ts = pg_value(ts)
+    return f'and=(or({ts_col}.gt.{ts},and({ts_col}.eq.{ts},{key_col}.gt.{pg_value(key)})))'
+
+def pg_in(values):
+    """Build a PostgREST in.(...) filter value with every key quoted"""
+    quoted = ','.join('"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values)
+    return urllib.parse.quote(f'in.({quoted})', safe='.(),')
+
+class SyncAgent:
+    def __init__(self, profile, http=None, state_db=None, legacy_state=None):
+        """profile: one store's settings (CLOUD_STORE_ID, SQL_SERVER, SQL_DATABASE, ... as read by load_config)"""
+        self.profile = profile
+        self.store_id = profile.get('CLOUD_STORE_ID', 'STORE-UNKNOWN')
+        self.sql_server = profile.get('SQL_SERVER', 'localhost')
+        self.sql_database = profile.get('SQL_DATABASE', 'cresql')
+        self.windows_auth = str(profile.get('WINDOWS_AUTH', 'true')).strip().lower() == 'true'
+        self.sync_interval = int(profile.get('SYNC_INTERVAL', 30))
+        # Supabase Credentials (Env > Config > Default)
+        self.supa_url = os.getenv('SUPABASE_URL') or profile.get('supa_url') or 'https://xsyduihbgizgfvqucioq.supabase.co'
+        self.supa_key = os.getenv('SUPABASE_KEY') or profile.get('supa_key') or ''
+        if not self.supa_key:
+            self.log("[ERROR] [WARN] SUPABASE_KEY is missing! Agent will fail.", "ERROR")
+        self.http = http or make_http_session()  # Shared across stores by multi-store-agent.py
+        self.sql_conn = None
+        self.dept_map = {} # Cache trimmed -> real DeptID mapping
+        self.departments = [] # Cached local departments, rebuilt only when dept_checksum changes
+        self.dept_checksum = None
+        self.local_item_keys = None # item_key -> local ItemNum, for validating transfer lines
+        self.state = StateStore(state_db or os.path.join(BASE_DIR, f'state_{self.store_id}.db'), legacy_json=legacy_state)
+        self.last_sync_time = None
+        self.cycle = 0
+        budgets = {name: float(profile.get(f'PHASE_BUDGET_{name.upper()}', seconds)) for name, seconds in PHASE_BUDGETS.items()}
+        self.watchdog = Watchdog(self.log, budgets)
+        self.metrics = metrics.Metrics(self.store_id)
+        # Prometheus text export, rewritten every cycle ('' disables it)
+        self.metrics_file = profile.get('METRICS_FILE', os.path.join(BASE_DIR, f'metrics_{self.store_id}.prom'))
+        self.down_rows_per_cycle = int(profile.get('DOWN_ROWS_PER_CYCLE', DOWN_ROWS_PER_CYCLE))
+        self.up_rows_per_cycle = int(profile.get('UP_ROWS_PER_CYCLE', UP_ROWS_PER_CYCLE))
+        self.tombstones_per_cycle = int(profile.get('TOMBSTONES_PER_CYCLE', TOMBSTONES_PER_CYCLE))
+        self.transfers_per_cycle = int(profile.get('TRANSFERS_PER_CYCLE', TRANSFERS_PER_CYCLE))
+        # Read by the status server (status_server.py) from its own thread - plain values, no locks needed
+        self.started_at = time.time()
+        self.current_phase = None  # (name, wall time it started) while a phase runs
+        self.last_cycle_error = None
+
+    def log(self, msg, level="INFO"):
+        if level == "ERROR":
+            metrics.count('errors')
+        log(f"[{self.store_id}] {msg}", level)
+
+    def open_sql(self, server, driver, login_timeout):
+        """Open one connection to server with driver. Returns (connection, seconds taken)."""
+        conn_str = f'DRIVER={{{driver}}};SERVER={server};DATABASE={self.sql_database};'
+        if self.windows_auth:
+            conn_str += 'Trusted_Connection=yes;TrustServerCertificate=yes;'
+        else:
+            conn_str += f'UID={self.profile.get("SQL_USER")};PWD={self.profile.get("SQL_PASSWORD")};TrustServerCertificate=yes;'
+        started = time.monotonic()
+        conn = pyodbc.connect(conn_str, timeout=login_timeout)
+        conn.timeout = SQL_QUERY_TIMEOUT  # A stuck query raises instead of hanging the phase
+        return conn, time.monotonic() - started
+
+    def probe_sql(self):
+        """Try every driver x server candidate in parallel with a short login timeout.
+        Returns (connection, server, driver) for the first one that answers, or None."""
+        drivers = [d for d in pyodbc.drivers() if 'SQL' in d]
+        self.log(f"Installed Drivers: {drivers}")
+        # Configured server first, then localhost
+        servers = list(dict.fromkeys([self.sql_server, 'localhost', '127.0.0.1']))
+        candidates = [(server, driver) for server in servers for driver in drivers]
+        if not candidates:
+            return None
+
+        started = time.monotonic()
+        pool = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix='sql-probe')
+        futures = {pool.submit(self.open_sql, server, driver, SQL_PROBE_TIMEOUT): (server, driver) for server, driver in candidates}
+        winner = None
+        winning_future = None
+        try:
+            for future in as_completed(futures):
+                server, driver = futures[future]
+                try:
+                    conn, elapsed = future.result()
+                except Exception as e:
+                    self.log(f"  probe {server} | {driver}: failed after {time.monotonic() - started:.2f}s ({str(e).splitlines()[0][:120]})")
+                    continue
+                self.log(f"  probe {server} | {driver}: connected in {elapsed:.2f}s")
+                winner, winning_future = (conn, server, driver), future
+                break
+        finally:
+            # Don't wait for slower probes - close whatever they open once they finish
+            for future in futures:
+                if future is not winning_future:
+                    future.add_done_callback(lambda f: f.exception() is None and f.result()[0].close())
+            pool.shutdown(wait=False)
+        self.log(f"Probed {len(candidates)} candidates in {time.monotonic() - started:.2f}s")
+        return winner
+
+    def discover_sql(self, remember=True):
+        """Open a connection to local SQL Server: the cached winning path first, parallel auto-discovery on a miss.
+        Returns the raw connection or None. remember=False leaves a newly discovered path out of the state store."""
+        started = time.monotonic()
+        cached = self.state.get('sql_path')  # {'server', 'driver'} that worked last time - no credentials stored
+        conn = None
+        if cached:
+            try:
+                conn, elapsed = self.open_sql(cached['server'], cached['driver'], SQL_LOGIN_TIMEOUT)
+                server, driver, how = cached['server'], cached['driver'], 'cached path'
+            except Exception as e:
+                self.log(f"[WARN] Cached SQL path {cached['server']} | {cached['driver']} failed: {str(e).splitlines()[0][:120]}", "WARNING")
+        if conn is None:
+            found = self.probe_sql()
+            if not found:
+                self.log(f"[ERROR] No SQL Server answered ({time.monotonic() - started:.2f}s)", "ERROR")
+                return None
+            conn, server, driver = found
+            how = 'probe'
+            if remember:
+                self.state.set(sql_path={'server': server, 'driver': driver})
+
+        self.log(f"[INFO] SUCCESS! Connected to: {server} | {driver} via {how} in {time.monotonic() - started:.2f}s")
+        return conn
+
+    def connect_sql(self, read_only=False):
+        """Open the managed SQL session (reconnects on its own from then on).
+        read_only=True (benchmarks) neither alters the POS schema nor writes the state store."""
+        discover = (lambda: self.discover_sql(remember=False)) if read_only else self.discover_sql
+        conn = discover()
+        if conn is None:
+            return False
+        self.sql_conn = SqlSession(conn, discover, self.log)
+        try:
+            self.fetch_local_store_id()
+            if not read_only:
+                self.ensure_schema()
+        except Exception as e:
+            self.log(f"[WARN] Post-connect setup failed: {e}", "WARNING")
+        return True
+
+    def fetch_local_store_id(self):
+        # Explicit override, e.g. when several stores are simulated on the same DB
+        if self.profile.get('LOCAL_STORE_ID'):
+            self.local_store_id = str(self.profile['LOCAL_STORE_ID'])
+            self.log(f"[INFO] SIMULATION MODE: Forcing Local Store ID to {self.local_store_id}")
+            return
+        try:
+            cursor = self.sql_conn.cursor()
+            cursor.execute("SELECT TOP 1 Store_ID FROM Inventory")
+            row = cursor.fetchone()
+            if row and row.Store_ID:
+                self.local_store_id = str(row.Store_ID)
+                self.log(f"[INFO] Detected Local Store ID: {self.local_store_id}")
+            else:
+                self.local_store_id = str(self.store_id)
+                self.log(f"[WARN] Could not detect Local Store ID. Using Config: {self.local_store_id}")
+        except:
+            self.local_store_id = str(self.store_id)
+            self.log(f"[WARN] Failed to fetch Local Store ID. Defaulting to: {self.local_store_id}", "WARNING")
+
+    def ensure_schema(self):
+        """Ensure ItemType column exists"""
+        try:
+            cursor = self.sql_conn.cursor()
+            cursor.execute("SELECT TOP 1 ItemType FROM Inventory")
+        except:
+            self.log("[WARN] ItemType column missing. Adding it...")
+            try:
+                cursor = self.sql_conn.cursor()
+                cursor.execute("ALTER TABLE Inventory ADD ItemType INT DEFAULT 0")
+                self.sql_conn.commit()
+                self.log("[INFO] Added ItemType column to Inventory table.")
+            except Exception as e:
+                self.log(f"[ERROR] Failed to add ItemType column: {e}", "ERROR")
+
+        # Check Local_Updated_At
+        try:
+            cursor = self.sql_conn.cursor()
+            cursor.execute("SELECT TOP 1 Local_Updated_At FROM Inventory")
+        except:
+            self.log("[WARN] Local_Updated_At column missing. Adding it...")
+            try:
+                cursor.execute("ALTER TABLE Inventory ADD Local_Updated_At DATETIME DEFAULT GETDATE()")
+                self.sql_conn.commit()
+                self.log("[INFO] Added Local_Updated_At column to Inventory table.")
+                
+                # Create trigger for auto-updating timestamp
+                try:
+                    cursor.execute("""
+                        IF NOT EXISTS (SELECT * FROM sys.triggers WHERE name = 'trg_Inventory_UpdateTimestamp')
+                        BEGIN
+                            EXEC('CREATE TRIGGER trg_Inventory_UpdateTimestamp ON Inventory AFTER UPDATE AS BEGIN SET NOCOUNT ON; UPDATE Inventory SET Local_Updated_At = GETDATE() FROM Inventory i INNER JOIN inserted ins ON i.ItemNum = ins.ItemNum END')
+                        END
+                    """)
+                    self.sql_conn.commit()
+                    self.log("[INFO] Created auto-update trigger for Local_Updated_At.")
+                except Exception as te:
+                    self.log(f"[WARN] Could not create trigger: {te}")
+            except Exception as e:
+                self.log(f"[ERROR] Failed to add Local_Updated_At column: {e}", "ERROR")
+
+        # Transfer ledger - same table as sync-agent/sync_agent.py, so both agents see each other's transfers
+        try:
+            cursor = self.sql_conn.cursor()
+            cursor.execute("""
+                IF OBJECT_ID('dbo.Sync_Transfer_Ledger', 'U') IS NULL
+                CREATE TABLE dbo.Sync_Transfer_Ledger (
+                    Transfer_ID NVARCHAR(64) NOT NULL,
+                    Direction CHAR(3) NOT NULL,
+                    Item_Num NVARCHAR(50) NOT NULL,
+                    Quantity_Change FLOAT NOT NULL,
+                    Applied_At DATETIME NOT NULL DEFAULT GETDATE(),
+                    PRIMARY KEY (Transfer_ID, Direction, Item_Num)
+                )
+            """)
+            self.sql_conn.commit()
+        except Exception as e:
+            self.log(f"[ERROR] Failed to create Sync_Transfer_Ledger: {e}", "ERROR")
+
+    def load_last_sync(self):
+        return self.state.get('last_sync', "2000-01-01T00:00:00")
+
+    def save_last_sync(self, timestamp):
+        try:
+            self.state.set(last_sync=timestamp)
+        except Exception as e:
+            self.log(f"[WARN] Failed to save sync state: {e}", "WARNING")
+
+    def flush_outbox(self):
+        """Deliver queued cloud writes (e.g. transfer status updates). Entries are removed only once accepted."""
+        headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}', 'Content-Type': 'application/json', 'Prefer': 'return=minimal'}
+        delivered = []
+        failed = []
+        for entry_id, kind, payload in self.state.pending():
+            try:
+                res = self.http.request(payload['method'], f"{self.supa_url}/rest/v1/{payload['path']}", headers=headers, json=payload.get('json'))
+                if res.status_code in [200, 201, 204]:
+                    delivered.append(entry_id)
+                else:
+                    self.log(f"[WARN] Outbox {kind} #{entry_id} rejected: {res.status_code} {res.text}", "ERROR")
+                    failed.append(entry_id)
+            except Exception as e:
+                self.log(f"[WARN] Outbox {kind} #{entry_id} failed: {e}", "ERROR")
+                failed.append(entry_id)
+        if delivered: self.state.ack(delivered)
+        if failed: self.state.retry_later(failed)
+        return len(delivered)
+
+    def dept_digest(self, dept):
+        return row_digest(dept, ('dept_id', 'dept_name'))
+
+    def fetch_local_departments(self):
+        """Return local departments, re-reading the table only when its checksum changed"""
+        try:
+            checksum = tuple(self.sql_conn.query("SELECT CHECKSUM_AGG(BINARY_CHECKSUM(Dept_ID, Description)), COUNT(*) FROM Departments")[0])
+            if checksum == self.dept_checksum:
+                return self.departments
+
+            depts = []
+            dept_map = {}
+            for row in self.sql_conn.query("SELECT Dept_ID, Description FROM Departments"):
+                raw_id = row.Dept_ID
+                stripped_id = str(raw_id).strip()
+                dept_map[stripped_id] = raw_id # Caching raw ID for lookups
+                
+                depts.append({
+                    'dept_id': stripped_id,
+                    'dept_name': row.Description,
+                    'store_id': self.store_id
+                })
+            self.dept_map = dept_map
+            self.departments = depts
+            self.dept_checksum = checksum
+            self.log(f"Loaded {len(depts)} local departments (changed)")
+            return depts
+        except Exception as e:
+            self.log(f"[ERROR] Error fetching departments: {e}", "ERROR")
+            return self.departments
+
+    def sync_departments(self, departments):
+        """Push only departments that changed since the last push, in ONE bulk upsert"""
+        if not departments: return
+        try:
+            pushed = self.state.get('dept_digests', {})
+            digests = {d['dept_id']: self.dept_digest(d) for d in departments}
+            changed = [d for d in departments if pushed.get(d['dept_id']) != digests[d['dept_id']]]
+            if not changed: return
+
+            headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}', 'Content-Type': 'application/json', 'Prefer': 'resolution=merge-duplicates,return=minimal'}
+            res = self.http.post(f'{self.supa_url}/rest/v1/departments?on_conflict=dept_id,store_id', headers=headers, json=changed)
+            if res.status_code in [200, 201, 204]:
+                pushed.update({d['dept_id']: digests[d['dept_id']] for d in changed})
+                self.state.set(dept_digests=pushed)
+                metrics.count('rows_written', len(changed))
+                self.log(f"[OK] Synced {len(changed)}/{len(departments)} departments (changed only)")
+            else:
+                self.log(f"[ERR] Department upsert failed: {res.status_code} {res.text}", "ERROR")
+        except Exception as e:
+            self.log(f"[ERROR] Sync departments failed: {e}", "ERROR")
+
+    def map_inventory_row(self, row):
+        """One Inventory row -> the cloud inventory payload"""
+        try: item_type = int(row.ItemType or 0)
+        except: item_type = 0
+        
+        return {
+            'item_num': str(row.ItemNum).strip(),
+            'item_name': row.ItemName,
+            'dept_id': str(row.Dept_ID).strip() if row.Dept_ID else 'OTHER',
+            'itemtype': item_type,
+            'in_stock': float(row.In_Stock or 0),
+            'cost': float(row.Cost or 0),
+            'price': float(row.Price or 0),
+            'store_id': self.store_id,
+            'last_synced_at': datetime.now(timezone.utc).isoformat(),
+            'retail_price': float(row.Price or 0),
+            '_local_updated_at': row.Local_Updated_At  # Internal use for timestamp comparison
+        }
+
+    def fetch_inventory(self):
+        """Fetch inventory from local SQL Server"""
+        try:
+            items = [self.map_inventory_row(row) for row in self.sql_conn.query(INVENTORY_QUERY, (self.local_store_id,))]
+            self.log(f" Fetched {len(items)} inventory items")
+            metrics.count('rows_read', len(items))
+            return items
+        except Exception as e:
+            self.log(f"[ERROR] Error fetching inventory: {e}", "ERROR")
+            return []
+
+    def diff_inventory(self, items, cloud_timestamps, pushed_digests, echo_digests):
+        """Split local items into what must be pushed and what Cloud already has.
+        Returns (to_push, digests, echoes, counts); counts = {'unchanged', 'recent', 'skipped'}."""
+        to_push = []
+        digests = {}
+        echoes = {}
+        counts = {'unchanged': 0, 'recent': 0, 'skipped': 0}
+        
+        for item in items:
+            local_updated = item.pop('_local_updated_at', None)  # Remove internal field
+            item_num = item['item_num']
+            digests[item_num] = row_digest(item, DIGEST_FIELDS)
+
+            # Check 0: Unchanged since our last successful push (and still present in Cloud)
+            if item_num in cloud_timestamps and pushed_digests.get(item_num) == digests[item_num]:
+                counts['unchanged'] += 1
+                continue
+            
+            # Check 1: Skip if the row is exactly what Cloud last sent us (Break Ping-Pong, survives restarts)
+            if echo_digests.get(item_num) == digests[item_num]:
+                counts['recent'] += 1
+                echoes[item_num] = digests[item_num]
+                continue
+
+            cloud_updated = cloud_timestamps.get(item_num, '')
+            
+            # Check 2: Timestamp Comparison
+            should_push = True
+            if local_updated and cloud_updated:
+                from datetime import datetime, timedelta, timezone as tz
+                try:
+                    cloud_dt = datetime.fromisoformat(cloud_updated.replace('Z', '+00:00'))
+                    local_dt = local_updated.replace(tzinfo=None)
+                    local_dt_utc = local_dt + timedelta(hours=6)  # CST to UTC
+                    local_dt_utc = local_dt_utc.replace(tzinfo=tz.utc)
+                    
+                    # Tolerance of 3 seconds to avoid micro-diff ping-pong
+                    if cloud_dt >= (local_dt_utc - timedelta(seconds=3)):
+                        should_push = False
+                except: pass
+            
+            if should_push:
+                to_push.append(item)
+            else:
+                counts['skipped'] += 1
+        return to_push, digests, echoes, counts
+
+    def sync_inventory(self, items):
+        """Sync inventory to Supabase with timestamp comparison + BATCH UPLOAD"""
+        if not items: return
+        try:
+            headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}', 'Content-Type': 'application/json', 'Prefer': 'resolution=merge-duplicates'}
+            
+            # 1. Cloud Timestamps (incremental refresh of the local mirror)
+            cloud_timestamps = self.refresh_cloud_versions()
+            pushed_digests = self.state.get_digests()
+            echo_digests = self.state.get_echo_digests()
+
+            # 2. Filter Items to Push
+            to_push, digests, echoes, counts = self.diff_inventory(items, cloud_timestamps, pushed_digests, echo_digests)
+            unchanged_count, recent_count, skipped_count = counts['unchanged'], counts['recent'], counts['skipped']
+
+            if unchanged_count > 0:
+                 self.log(f"[SKIP] Ignored {unchanged_count} items unchanged since last push.")
+            if recent_count > 0:
+                 self.log(f"[SKIP] Ignored {recent_count} items matching the version synced down from Cloud.")
+                 self.state.put_digests(echoes)  # Cloud already holds this exact version
+            if skipped_count > 0:
+                 self.log(f"[SKIP] Ignored {skipped_count} items (Cloud newer/same).")
+            if len(to_push) > self.up_rows_per_cycle:
+                 # No digest is stored for the rest, so they still count as changed next cycle
+                 self.log(f"[PUSH] {len(to_push) - self.up_rows_per_cycle} items carried over to the next cycle")
+                 to_push = to_push[:self.up_rows_per_cycle]
+
+            # 3. Batch Upload
+            if to_push:
+                self.log(f"[PUSH] Uploading {len(to_push)} items in batches...")
+                total_uploaded = 0
+                for batch in chunked(to_push, UPLOAD_BATCH):
+                    self.watchdog.check()
+                    try:
+                        res = self.http.post(f'{self.supa_url}/rest/v1/inventory?on_conflict=item_num,store_id', headers=headers, json=batch)
+                        if res.status_code in [200, 201, 204]:
+                            total_uploaded += len(batch)
+                            metrics.count('rows_written', len(batch))
+                            metrics.count('batches')
+                            self.state.put_digests({b['item_num']: digests[b['item_num']] for b in batch})
+                        else:
+                            self.log(f"[ERR] Batch upload failed: {res.status_code} {res.text}", "ERROR")
+                    except Exception as be:
+                        self.log(f"[ERR] Batch upload error: {be}", "ERROR")
+                
+                self.log(f"[OK] Successfully pushed {total_uploaded} items.")
+            else:
+                 self.log("[OK] No local updates to push.")
+
+        except Exception as e:
+            self.log(f"[ERROR] Sync inventory failed: {e}", "ERROR")
+
+    def refresh_cloud_versions(self):
+        """Fetch only cloud rows changed since the last refresh into the state store mirror, return the full mirror"""
+        since = self.state.get('cloud_versions_since')
+        last_full = self.state.get('cloud_versions_full_at')
+        full = not since or not last_full or \
+            (datetime.now(timezone.utc) - datetime.fromisoformat(last_full)).total_seconds() > MIRROR_FULL_REFRESH_HOURS * 3600
+        refresh_start = datetime.now(timezone.utc).isoformat()
+
+        url = f'{self.supa_url}/rest/v1/inventory?store_id=eq.{self.store_id}&select=item_num,updated_at&order=updated_at.asc,item_num.asc'
+        if not full:
+            url += f'&updated_at=gte.{urllib.parse.quote(since)}'
+
+        # Keyset pages. An incremental refresh saves every page with its watermark, so it resumes where it stopped;
+        # a full refresh swaps the whole mirror at the end (it only reads two columns, a restart just redoes it).
+        changed = {}
+        fetched = 0
+        newest = since
+        limit = 1000
+        cloud_headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}'}
+        last = None
+        while True:
+            self.watchdog.check()
+            page_url = f'{url}&limit={limit}'
+            if last:
+                page_url += '&' + keyset_after('updated_at', 'item_num', last['updated_at'], last['item_num'])
+            cloud_res = self.http.get(page_url, headers=cloud_headers)
+            if cloud_res.status_code != 200:
+                self.log(f"[WARN] Failed to refresh cloud versions: {cloud_res.status_code}", "ERROR")
+                return self.state.get_cloud_versions()  # Keep the watermark, retry next cycle
+            batch = cloud_res.json()
+            page = {}
+            for c in batch:
+                page[c['item_num']] = c.get('updated_at', '')
+                if c.get('updated_at') and (not newest or c['updated_at'] > newest): newest = c['updated_at']
+            fetched += len(page)
+            if full:
+                changed.update(page)
+            elif page:
+                self.state.put_cloud_versions(page, cloud_versions_since=newest)
+            if len(batch) < limit: break
+            last = batch[-1]
+            if not last.get('updated_at'): break  # Can't build a keyset cursor past a NULL timestamp
+
+        if full:
+            self.state.put_cloud_versions(changed, replace=True, cloud_versions_since=newest or refresh_start, cloud_versions_full_at=refresh_start)
+            self.log(f"Fetched {fetched} cloud timestamps (full refresh)")
+        else:
+            self.log(f"Fetched {fetched} changed cloud timestamps since {since}")
+        return self.state.get_cloud_versions()
+
+    def process_soft_deletes(self):
+        """Consume the inventory_tombstones feed past our watermark, one page (= one batch) at a time.
+        The watermark moves after every page, so a restart resumes at the first unapplied page.
+        Items that can't be deleted locally are parked and retried every cycle instead of blocking the feed."""
+        try:
+            headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}'}
+            self.retry_parked_deletes()
+            consumed = 0
+            while consumed < self.tombstones_per_cycle:  # Rest after the watermark, next cycle
+                self.watchdog.check()
+                after_id = int(self.state.get('tombstone_id', 0))
+                url = (f'{self.supa_url}/rest/v1/inventory_tombstones?store_id=eq.{self.store_id}&id=gt.{after_id}'
+                       f'&select=id,item_num,deleted_at&order=id.asc&limit={TOMBSTONE_PAGE_SIZE}')
+                res = self.http.get(url, headers=headers)
+                if res.status_code != 200:
+                    self.log(f"[WARN] Failed to fetch tombstones: {res.status_code} {res.text}", "ERROR")
+                    return
+                page = res.json()
+                if not page: return
+
+                item_nums = sorted({str(t['item_num']).strip() for t in page})
+                self.log(f"[DELETE] Found {len(item_nums)} items in tombstone feed (deleted up to {page[-1].get('deleted_at')})")
+
+                # 1. Local - one set-based transaction (item by item if that fails)
+                failed = self.apply_local_deletes(item_nums)
+                if failed is None:
+                    return  # SQL is down - watermark not advanced, page is retried next cycle
+                applied = [i for i in item_nums if i not in failed]
+
+                # 2. Cloud - hard delete the DELETED markers with item_num=in.(...)
+                if applied and not self.delete_cloud_items(applied):
+                    return  # Local deletes are idempotent, retry the cloud cleanup next cycle
+
+                self.state.forget_items(applied)
+                parked = sorted(set(self.state.get('tombstones_parked', [])) | set(failed))
+                self.state.set(tombstone_id=page[-1]['id'], tombstones_parked=parked)
+                consumed += len(page)
+                metrics.count('rows_read', len(page))
+                metrics.count('rows_written', len(applied))
+                metrics.count('batches')
+                if len(page) < TOMBSTONE_PAGE_SIZE: return
+        except Exception as e:
+            self.log(f"[ERROR] Soft Delete processing failed: {e}", "ERROR")
+
+    def retry_parked_deletes(self):
+        """Retry the tombstoned items an earlier page could not delete locally"""
+        parked = self.state.get('tombstones_parked', [])
+        if not parked: return
+        failed = self.apply_local_deletes(parked)
+        if failed is None: return
+        done = [i for i in parked if i not in failed]
+        if done and not self.delete_cloud_items(done): return
+        self.state.forget_items(done)
+        self.state.set(tombstones_parked=failed)
+        if failed:
+            self.log(f"[DELETE] {len(failed)} items still parked (local delete keeps failing)", "WARNING")
+
+    def delete_local_item(self, cursor, item_num):
+        """Delete one item; one held by an FK is marked [DELETED] instead. Returns (deleted, marked)."""
+        try:
+            cursor.execute("DELETE FROM Inventory WHERE ItemNum = ?", (item_num,))
+            return cursor.rowcount, 0
+        except pyodbc.Error as row_err:
+            if not ('547' in str(row_err) or 'REFERENCE' in str(row_err).upper()): raise
+            cursor.execute("UPDATE Inventory SET ItemName = '[DELETED] ' + LEFT(ItemName, 15), In_Stock = 0 WHERE ItemNum = ?", (item_num,))
+            return 0, 1
+
+    def apply_local_deletes(self, item_nums):
+        """Delete a batch of items from Local SQL in ONE transaction. Items held by an FK are marked [DELETED] instead.
+        If the batch fails, every item is retried in its own transaction.
+        Returns the item_nums that could not be deleted, or None if SQL Server is unreachable."""
+        deleted = 0
+        marked = 0
+        failed = []
+        try:
+            cursor = self.sql_conn.cursor()
+            cursor.execute("IF OBJECT_ID('tempdb..#tombstones') IS NOT NULL DROP TABLE #tombstones")
+            cursor.execute("CREATE TABLE #tombstones (ItemNum NVARCHAR(20) COLLATE DATABASE_DEFAULT PRIMARY KEY)")
+            for batch in chunked(item_nums, SQL_VALUES_BATCH):
+                cursor.execute(f"INSERT INTO #tombstones (ItemNum) VALUES {','.join(['(?)'] * len(batch))}", batch)
+
+            try:
+                cursor.execute("DELETE i FROM Inventory i INNER JOIN #tombstones t ON i.ItemNum = t.ItemNum")
+                deleted = cursor.rowcount
+            except pyodbc.Error as del_err:
+                if not ('547' in str(del_err) or 'REFERENCE' in str(del_err).upper()): raise
+                # FK constraint on some rows - only the failed statement was undone, the transaction is
+                # still open, so resolve row by row and commit everything together
+                for item_num in item_nums:
+                    d, m = self.delete_local_item(cursor, item_num)
+                    deleted += d
+                    marked += m
+
+            cursor.execute("DROP TABLE #tombstones")
+            self.sql_conn.commit()
+        except Exception as e:
+            try: self.sql_conn.rollback()
+            except: pass
+            if isinstance(e, SqlUnavailable) or is_connection_error(e):
+                self.log(f"[WARN] Failed to apply local deletes: {e}", "WARNING")
+                return None
+            # One bad row must not hold up the whole page - isolate it
+            self.log(f"[WARN] Batch delete failed ({e}) - retrying item by item", "WARNING")
+            deleted = marked = 0
+            for item_num in item_nums:
+                try:
+                    d, m = self.delete_local_item(self.sql_conn.cursor(), item_num)
+                    self.sql_conn.commit()
+                    deleted += d
+                    marked += m
+                except Exception as row_err:
+                    try: self.sql_conn.rollback()
+                    except: pass
+                    if isinstance(row_err, SqlUnavailable) or is_connection_error(row_err):
+                        self.log(f"[WARN] Failed to apply local deletes: {row_err}", "WARNING")
+                        return None
+                    self.log(f"[ERROR] Failed to delete {item_num} locally, parked for retry: {row_err}", "ERROR")
+                    failed.append(item_num)
+        self.log(f"[DELETE] Removed {deleted} items from Local DB" + (f", marked {marked} as [DELETED] (FK constraint)" if marked else ""))
+        return failed
+
+    def delete_cloud_items(self, item_nums):
+        """Hard delete the DELETED markers from Cloud (one request per CLOUD_IN_BATCH keys)"""
+        headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}', 'Prefer': 'return=minimal'}
+        ok = True
+        for batch in chunked(item_nums, CLOUD_IN_BATCH):
+            try:
+                res = self.http.delete(f'{self.supa_url}/rest/v1/inventory?store_id=eq.{self.store_id}&item_name=eq.DELETED&item_num={pg_in(batch)}', headers=headers)
+                if res.status_code in [200, 204]:
+                    self.log(f"[DELETE] Cleaned up {len(batch)} items from Cloud")
+                else:
+                    self.log(f"[WARN] Cloud cleanup failed: {res.status_code} {res.text}", "ERROR")
+                    ok = False
+            except Exception as e:
+                self.log(f"[WARN] Cloud cleanup error: {e}", "ERROR")
+                ok = False
+        return ok
+
+    def sync_down_departments(self, last_sync):
+        """Fetch updated departments from Cloud -> Local with ONE set-based MERGE (one department at a time if it fails)"""
+        try:
+            safe_sync = urllib.parse.quote(last_sync)
+            headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}'}
+            url = f"{self.supa_url}/rest/v1/departments?store_id=eq.{self.store_id}&updated_at=gt.{safe_sync}&select=dept_id,dept_name"
+            res = self.http.get(url, headers=headers)
+            if res.status_code == 200:
+                depts = {str(d['dept_id']).strip(): d for d in res.json()}  # Last one wins per dept_id
+                # Skip anything identical to what we hold locally (usually our own push coming back)
+                local = {d['dept_id']: self.dept_digest(d) for d in self.departments}
+                changed = [d for k, d in depts.items() if local.get(k) != self.dept_digest({'dept_id': k, 'dept_name': d.get('dept_name')})]
+                if not changed: return
+
+                applied = 0
+                try:
+                    cursor = self.sql_conn.cursor()
+                    for batch in chunked(changed, SQL_VALUES_BATCH // 2):
+                        applied += self.merge_departments(cursor, batch)
+                    self.sql_conn.commit()
+                except Exception as e:
+                    self.sql_conn.rollback()
+                    if isinstance(e, SqlUnavailable) or is_connection_error(e):
+                        self.log(f"[WARN] Failed to apply department updates: {e}", "WARNING")
+                        return
+                    # One bad row must not hold every department back - apply them one at a time
+                    self.log(f"[WARN] Department batch failed ({e}) - applying one at a time", "WARNING")
+                    applied = 0
+                    failed = set()
+                    for d in changed:
+                        try:
+                            applied += self.merge_departments(self.sql_conn.cursor(), [d])
+                            self.sql_conn.commit()
+                        except Exception as row_err:
+                            self.sql_conn.rollback()
+                            if isinstance(row_err, SqlUnavailable) or is_connection_error(row_err):
+                                self.log(f"[WARN] Failed to apply department updates: {row_err}", "WARNING")
+                                return
+                            self.log(f"[ERROR] Failed to apply department {d['dept_id']}: {row_err}", "ERROR")
+                            failed.add(str(d['dept_id']).strip())
+                    changed = [d for d in changed if str(d['dept_id']).strip() not in failed]
+
+                # These now match Cloud - record them as pushed so they don't echo back up
+                pushed = self.state.get('dept_digests', {})
+                pushed.update({str(d['dept_id']).strip(): self.dept_digest({'dept_id': str(d['dept_id']).strip(), 'dept_name': d.get('dept_name')}) for d in changed})
+                self.state.set(dept_digests=pushed)
+                if applied > 0:
+                    self.log(f"[OK] Applied {applied} department updates from Cloud")
+        except Exception as e:
+            self.log(f"[ERROR] Sync Down Depts failed: {e}", "ERROR")
+
+    def merge_departments(self, cursor, depts):
+        """MERGE a batch of cloud departments into Departments (no commit). Returns the rows affected."""
+        params = []
+        for d in depts:
+            dept_id = str(d['dept_id']).strip()
+            params += [self.dept_map.get(dept_id, dept_id), d.get('dept_name')]
+        cursor.execute(f"""
+            MERGE Departments AS t
+            USING (VALUES {','.join(['(?, ?)'] * len(depts))}) AS s (Dept_ID, Description)
+            ON t.Dept_ID = s.Dept_ID
+            WHEN MATCHED AND (t.Description <> s.Description OR t.Description IS NULL) THEN
+                UPDATE SET Description = s.Description
+            WHEN NOT MATCHED THEN
+                INSERT (Dept_ID, Store_ID, Description, Type, TSDisplay, Cost_MarkUp, Dirty, SubType, Print_Dept_Notes, Require_Permission, Require_Serials, AvailableOnline, RowID)
+                VALUES (s.Dept_ID, ?, s.Description, 0, 0, 0.0, 1, 'NONE', 0, 0, 0, 0, NEWID());
+        """, params + [self.local_store_id])
+        return cursor.rowcount
+
+    def sync_down_inventory(self, last_sync):
+        """Cloud -> Local in two steps so a large backlog can't monopolise a cycle:
+        1. queue every row changed since last_sync in the persistent carry-over queue (newest version per item wins)
+        2. apply at most DOWN_ROWS_PER_CYCLE queued rows; the rest carry over to the next cycle.
+        Pages are read by keyset (updated_at, item_num) and each page is queued together with its cursor,
+        so after a crash the fetch resumes right after the last queued page instead of at page 1.
+        Returns True once every page was queued (only then may the checkpoint advance)."""
+        complete = False
+        try:
+            safe_sync = urllib.parse.quote(last_sync)
+            limit = 1000
+            headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}'}
+
+            cursor_state = self.state.get('down_cursor') or {}
+            if cursor_state.get('since') != last_sync:
+                cursor_state = {'since': last_sync}  # Checkpoint moved on - start a fresh pass
+            if cursor_state.get('updated_at'):
+                self.log(f"[DOWN] Resuming updates since {last_sync} after {cursor_state['updated_at']} / {cursor_state['item_num']}...")
+            else:
+                self.log(f"[DOWN] Checking for updates since {last_sync}...")
+
+            while True:
+                self.watchdog.check()  # Between pages: every page before this one is queued
+                url = (f"{self.supa_url}/rest/v1/inventory?store_id=eq.{self.store_id}&or=(updated_at.gt.{safe_sync},created_at.gt.{safe_sync})"
+                       f"&order=updated_at.asc,item_num.asc&limit={limit}")
+                if cursor_state.get('updated_at'):
+                    url += '&' + keyset_after('updated_at', 'item_num', cursor_state['updated_at'], cursor_state['item_num'])
+                
+                try:
+                    res = self.http.get(url, headers=headers)
+                except Exception as net_err:
+                     self.log(f"[WARN] Network error during sync down: {net_err}", "ERROR")
+                     break
+
+                if res.status_code == 200:
+                    items = res.json()
+                    metrics.count('rows_read', len(items))
+                    if items:
+                        cursor_state = {'since': last_sync, 'updated_at': items[-1]['updated_at'], 'item_num': items[-1]['item_num']}
+                        # Page and cursor in one transaction - either both are saved or neither
+                        self.state.queue_put('sync_down', {str(i['item_num']).strip(): i for i in items}, down_cursor=cursor_state)
+                    if len(items) < limit: # End of pages
+                        complete = True
+                        break
+                else:
+                    self.log(f"[WARN] Failed to fetch batch: {res.status_code}", "ERROR")
+                    break
+        except Exception as e:
+            self.log(f"[ERROR] Sync Down Inventory failed: {e}", "ERROR")
+
+        self.drain_down_queue()
+        return complete
+
+    def drain_down_queue(self):
+        """Apply up to DOWN_ROWS_PER_CYCLE rows from the sync_down carry-over queue, oldest first"""
+        total_synced = 0
+        try:
+            while total_synced < self.down_rows_per_cycle:
+                self.watchdog.check()  # Between batches: every batch before this one is committed
+                batch = self.state.queue_take('sync_down', min(1000, self.down_rows_per_cycle - total_synced))
+                if not batch: break
+                applied = self.apply_cloud_items([row for _, row in batch])
+                total_synced += applied
+                metrics.count('rows_written', applied)
+                metrics.count('batches')
+                self.state.queue_done('sync_down', [key for key, _ in batch])
+        except Exception as e:
+            self.log(f"[ERROR] Applying queued cloud rows failed: {e}", "ERROR")
+
+        if total_synced > 0:
+            self.log(f"[OK] Successfully synced down {total_synced} items.")
+        backlog = self.state.queue_depth('sync_down')
+        if backlog:
+            self.log(f"[DOWN] {backlog} items carried over to the next cycle")
+
+    def apply_cloud_items(self, items):
+        """Write one batch of cloud inventory rows to the local DB and commit. Returns the number applied."""
+        cursor = self.sql_conn.cursor()
+        count = 0
+        skipped = 0
+        echoes = {}  # item_num -> (digest of the version written locally, cloud updated_at)
+
+        for i in items:
+            try:
+                i_num = str(i['item_num']).strip()
+                cloud_updated = i.get('updated_at', '')
+
+                # --- SOFT DELETE: applied in batch from the tombstone feed (process_soft_deletes) ---
+                if i.get('item_name') == 'DELETED':
+                    continue
+
+                # Check if item exists and get local timestamp
+                cursor.execute("SELECT Local_Updated_At, Dept_ID FROM Inventory WHERE ItemNum = ?", (i_num,))
+                row = cursor.fetchone()
+
+                # Calculate mapped Dept ID once
+                target_dept_id = self.dept_map.get(str(i['dept_id']).strip(), str(i['dept_id']).strip())
+
+                # Retry loop for Deadlock Handling (Error 1205) and FK Auto-Heal
+                max_retries = 3
+                for attempt in range(max_retries):
+                    try:
+                        if row:
+                            local_updated = row.Local_Updated_At
+                            if local_updated and cloud_updated:
+                                from datetime import datetime
+                                try:
+                                    cloud_dt = datetime.fromisoformat(cloud_updated.replace('Z', '+00:00'))
+                                    local_dt = local_updated.replace(tzinfo=None)
+                                    from datetime import timedelta, timezone as tz
+                                    local_dt_utc = local_dt + timedelta(hours=6)
+                                    local_dt_utc = local_dt_utc.replace(tzinfo=tz.utc)
+                                    if local_dt_utc > cloud_dt:
+                                        skipped += 1
+                                        break # Skip this item, no need to retry
+                                except: pass
+
+                            cursor.execute("""
+                                UPDATE Inventory 
+                                SET ItemName=?, Price=?, Cost=?, In_Stock=?, ItemType=?, Local_Updated_At=GETDATE()
+                                WHERE ItemNum=?
+                            """, (i['item_name'], i['price'], i['cost'], i['in_stock'], i.get('itemtype', 0), i_num))
+                        else:
+                            cursor.execute("""
+                                INSERT INTO Inventory (ItemNum, ItemName, Price, Cost, Dept_ID, In_Stock, ItemType, Store_ID, Local_Updated_At, Reorder_Level, Reorder_Quantity, Tax_1, Tax_2, Tax_3, IsKit, IsModifier, Inv_Num_Barcode_Labels, Use_Serial_Numbers, Num_Bonus_Points, IsRental, Use_Bulk_Pricing, Print_Ticket, Print_Voucher, Num_Days_Valid, IsMatrixItem, AutoWeigh, Dirty, FoodStampable, Exclude_Acct_Limit, Check_ID, Prompt_Price, Prompt_Quantity, Allow_BuyBack, Special_Permission, Prompt_Description, Check_ID2, Count_This_Item, Print_On_Receipt, Transfer_Markup_Enabled, As_Is)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, GETDATE(), 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0)
+                            """, (i_num, i['item_name'], i['price'], i['cost'], target_dept_id, i['in_stock'], i.get('itemtype', 0), self.local_store_id))
+
+
+                        # Batch Commit (every 50 items)
+                        if count % 50 == 0:
+                            self.sql_conn.commit()
+
+                        # UPDATE leaves Dept_ID alone, so the local row keeps its own department
+                        local_dept = str(row.Dept_ID).strip() if row and row.Dept_ID else (str(target_dept_id).strip() if not row else 'OTHER')
+                        echoes[i_num] = (row_digest({
+                            'item_name': i['item_name'], 'dept_id': local_dept, 'itemtype': int(i.get('itemtype') or 0),
+                            'in_stock': float(i['in_stock'] or 0), 'cost': float(i['cost'] or 0), 'price': float(i['price'] or 0)
+                        }, DIGEST_FIELDS), cloud_updated)
+                        count += 1
+                        break # Success, exit retry loop
+
+                    except pyodbc.Error as db_err:
+                        # Check for Deadlock (1205)
+                        if '1205' in str(db_err) or '40001' in str(db_err):
+                            if attempt < max_retries - 1:
+                                import time, random
+                                sleep_time = random.uniform(0.1, 0.5)
+                                self.log(f"[RETRY] Deadlock detected for {i_num}. Retrying in {sleep_time:.2f}s...")
+                                time.sleep(sleep_time)
+                                continue
+                            else:
+                                self.log(f"[ERROR] Deadlock persisted for {i_num} after retries. Skipping.", "ERROR")
+                        # Check for FK Constraint (547 / 23000)
+                        elif "fkInventoryDepartments" in str(db_err) or '547' in str(db_err):
+                             try:
+                                 self.log(f"[FIX] Missing Department '{target_dept_id}' detected. Auto-creating...")
+                                 # Auto-Create Missing Department
+                                 cursor.execute("""
+                                    INSERT INTO Departments (Dept_ID, Store_ID, Description, Type, TSDisplay, Cost_MarkUp, Dirty, SubType, Print_Dept_Notes, Require_Permission, Require_Serials, AvailableOnline, RowID) 
+                                    VALUES (?, ?, ?, 0, 0, 0.0, 1, 'NONE', 0, 0, 0, 0, NEWID())
+                                 """, (target_dept_id, self.local_store_id, target_dept_id))
+                                 self.sql_conn.commit()
+                                 self.log(f"[FIX] Successfully created department '{target_dept_id}'. Retrying item...")
+                                 continue # Retry immediately
+                             except Exception as fix_err:
+                                 self.log(f"[ERROR] Failed to auto-create department '{target_dept_id}': {fix_err}", "WARNING")
+                                 raise db_err
+                        else:
+                            raise db_err # Re-raise other errors
+            except Exception as e:
+                if "fkInventoryDepartments" in str(e):
+                    # DIAGNOSTIC LOGGING
+                    self.log(f"[ERROR] FK Constraint Failure for Item {i_num} ({i['item_name']})", "WARNING")
+                    self.log(f" - Cloud Dept_ID: '{i['dept_id']}'")
+                    mapped_dept = self.dept_map.get(str(i['dept_id']).strip(), str(i['dept_id']).strip())
+                    self.log(f" - Mapped/Used Dept_ID: '{mapped_dept}'")
+
+                    # Dump existing departments
+                    try:
+                        cursor.execute("SELECT Dept_ID FROM Departments")
+                        existing_depts = [r[0] for r in cursor.fetchall()]
+                        self.log(f" - Existing Local Depts ({len(existing_depts)}): {existing_depts}")
+                        if mapped_dept in existing_depts:
+                             self.log(" -> WEIRD: Mapped Dept IS in the list?! Check whitespace/encoding.")
+                        else:
+                             self.log(" -> ROOT CAUSE: Mapped Dept is NOT in the local Departments table.")
+                    except: pass
+
+                self.log(f"[WARN] Failed to apply item {i['item_num']}: {e}", "ERROR")
+
+        self.sql_conn.commit()
+        if echoes: self.state.put_echoes(echoes)  # Only after the local commit
+        return count
+
+    def adjust_local_stock(self, cursor, deltas):
+        """In_Stock = In_Stock + delta for every {item_num: delta} in ONE statement (no commit).
+
+        Returns {item_num: {'old_stock', 'new_stock', 'item_name'}} for the items that exist locally.
+        OUTPUT goes INTO a table variable because of the trg_Inventory_UpdateTimestamp trigger.
+        """
+        if not deltas: return {}
+        params = []
+        for item_num, delta in deltas.items():
+            params += [item_num, float(delta)]
+        cursor.execute(f"""
+            SET NOCOUNT ON;
+            DECLARE @changes TABLE (ItemNum NVARCHAR(50), ItemName NVARCHAR(100), OldStock FLOAT, NewStock FLOAT);
+            UPDATE i SET In_Stock = ISNULL(i.In_Stock, 0) + v.Delta
+            OUTPUT inserted.ItemNum, inserted.ItemName, deleted.In_Stock, inserted.In_Stock INTO @changes
+            FROM Inventory i
+            INNER JOIN (VALUES {','.join(['(?, ?)'] * len(deltas))}) AS v (ItemNum, Delta) ON i.ItemNum = v.ItemNum;
+            SELECT ItemNum, ItemName, OldStock, NewStock FROM @changes;
+        """, params)
+        return {canonical_item_num(r[0]): {'old_stock': float(r[2] or 0), 'new_stock': float(r[3] or 0), 'item_name': r[1]} for r in cursor.fetchall()}
+
+    def load_local_item_keys(self):
+        """(Re)load the cached local item numbers used to validate transfer lines"""
+        self.local_item_keys = {item_key(r[0]): canonical_item_num(r[0]) for r in self.sql_conn.query("SELECT ItemNum FROM Inventory")}
+
+    def normalize_transfer_lines(self, items, sign):
+        """Canonicalize + aggregate transfer lines into {local ItemNum: signed delta} before any SQL write.
+
+        Repeated lines are summed, zero nets dropped, and items missing locally (after one cache
+        reload) are returned separately instead of costing a failed UPDATE. Returns (deltas, missing).
+        """
+        if self.local_item_keys is None:
+            self.load_local_item_keys()
+        totals = {}
+        for i in items:
+            key = canonical_item_num(i.get('item_num'))
+            if key:
+                totals[key] = totals.get(key, 0.0) + sign * float(i['quantity'])
+        totals = {k: v for k, v in totals.items() if v != 0}
+        if any(item_key(k) not in self.local_item_keys for k in totals):
+            self.load_local_item_keys()  # Item may have been created since the cache was loaded
+        deltas, missing = {}, []
+        for key, delta in totals.items():
+            local = self.local_item_keys.get(item_key(key))
+            if local is None:
+                missing.append(key)
+            else:
+                deltas[local] = deltas.get(local, 0.0) + delta
+        return deltas, missing
+
+    def transfer_applied(self, cursor, transfer_id, direction):
+        """True if the SQL ledger holds this transfer - its stock change is committed locally"""
+        cursor.execute("SELECT TOP 1 Transfer_ID FROM Sync_Transfer_Ledger WHERE Transfer_ID = ? AND Direction = ?",
+                       (str(transfer_id), direction))
+        return cursor.fetchone() is not None
+
+    def record_transfer(self, cursor, transfer_id, direction, deltas):
+        """Ledger rows for a transfer, in the SAME transaction as its stock change (no commit).
+        The primary key makes a second install applying the same transfer fail instead of double-counting."""
+        rows = list(deltas.items()) or [('', 0.0)]  # An empty transfer still gets a marker row
+        for batch in chunked(rows, SQL_VALUES_BATCH // 2):  # 4 parameters per row
+            cursor.execute(
+                f"INSERT INTO Sync_Transfer_Ledger (Transfer_ID, Direction, Item_Num, Quantity_Change) VALUES {','.join(['(?, ?, ?, ?)'] * len(batch))}",
+                [v for item_num, delta in batch for v in (str(transfer_id), direction, item_num, float(delta))]
+            )
+
+    def process_transfers(self):
+        """Process incoming transfers"""
+        try:
+            headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}'}
+            # Fetch Transfers + Items
+            res = self.http.get(f'{self.supa_url}/rest/v1/transfers?to_store_id=eq.{self.store_id}&status=eq.in_transit&select=*,transfer_items(*)&order=created_at.asc&limit={self.transfers_per_cycle}', headers=headers)
+            if res.status_code == 200:
+                transfers = res.json()
+                metrics.count('rows_read', len(transfers))
+                if transfers:
+                    self.log(f"[IN] Found {len(transfers)} incoming transfers")
+                    for t in transfers:
+                        try:
+                            if self.state.ledger_get(t['id'], 'in'):
+                                # Stock already added before a failed PATCH - only the status update is outstanding (outbox)
+                                continue
+                            items = t.get('transfer_items', [])
+                            all_items_ok = True
+                            applied_before = False
+                            deltas = {}
+                            
+                            try:
+                                cursor = self.sql_conn.cursor()
+                                if self.transfer_applied(cursor, t['id'], 'in'):
+                                    # Committed before a crash (or by another install) - don't add the stock again
+                                    applied_before = True
+                                else:
+                                    deltas, missing = self.normalize_transfer_lines(items, 1)
+                                    for item_num in missing:
+                                        self.log(f"[WARN] Transfer item {item_num} not found locally, skipping stock add.", "WARNING")
+                                        # Optionally Auto-Create item here if needed
+                                    # Update Local Stock - all lines in one statement, ledger rows in the same transaction
+                                    self.adjust_local_stock(cursor, deltas)
+                                    self.record_transfer(cursor, t['id'], 'in', deltas)
+                            except Exception as item_err:
+                                self.log(f"[ERROR] Failed to process incoming items for transfer {t['id']}: {item_err}", "ERROR")
+                                all_items_ok = False
+                            
+                            if all_items_ok:
+                                self.sql_conn.commit()
+                                # Cache the ledger entry + queue "Mark Complete" together, then deliver
+                                metrics.count('rows_written', len(deltas))
+                                self.state.ledger_record(t['id'], 'in', deltas, outbox=[
+                                    ('transfer_status', {'method': 'PATCH', 'path': f'transfers?id=eq.{t["id"]}',
+                                                         'json': {'status': 'completed', 'completed_at': datetime.now(timezone.utc).isoformat()}})
+                                ])
+                                self.flush_outbox()
+                                
+                                if applied_before:
+                                    self.log(f"[OK] Transfer {t['id']} already in the local ledger - status update only")
+                                else:
+                                    self.log(f"[OK] Processed transfer {t['id']} (Items: {len(items)})")
+                            else:
+                                self.sql_conn.rollback()
+                                self.log(f"[ERR] Skipped transfer {t['id']} due to item errors.", "WARNING")
+
+                        except Exception as ex:
+                            self.log(f"[ERROR] Failed transfer {t['id']}: {ex}", "ERROR")
+            else:
+                self.log(f"[WARN] Failed to fetch transfers: {res.status_code} {res.text}", "ERROR")
+        except Exception as e:
+            self.log(f"[ERROR] Error processing transfers: {e}", "ERROR")
+
+    def process_outgoing_transfers(self):
+        """Process outgoing transfers - decrement stock and move to in-transit"""
+        try:
+            headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}', 'Content-Type': 'application/json'}
+            # Find approved transfers FROM this store
+            res = self.http.get(f'{self.supa_url}/rest/v1/transfers?from_store_id=eq.{self.store_id}&status=eq.approved&select=*,transfer_items(*)&order=created_at.asc&limit={self.transfers_per_cycle}', headers=headers)
+            if res.status_code == 200:
+                transfers = res.json()
+                metrics.count('rows_read', len(transfers))
+                if transfers:
+                    self.log(f"[OUT] Found {len(transfers)} approved outgoing transfers")
+                    for t in transfers:
+                        try:
+                            if self.state.ledger_get(t['id'], 'out'):
+                                # Stock already decremented - only the status update is outstanding (outbox)
+                                continue
+                            items = t.get('transfer_items', [])
+                            all_items_ok = True
+                            applied_before = False
+                            deltas = {}
+                            
+                            try:
+                                cursor = self.sql_conn.cursor()
+                                if self.transfer_applied(cursor, t['id'], 'out'):
+                                    # Committed before a crash (or by another install) - don't decrement again
+                                    applied_before = True
+                                else:
+                                    deltas, missing = self.normalize_transfer_lines(items, -1)
+                                    for item_num in missing:
+                                        self.log(f"[WARN] Outgoing Item {item_num} not found locally for transfer {t['id']}. Skipping local stock update.", "WARNING")
+                                        # If not local, we can't decrement local. This item won't prevent the transfer from being marked in-transit.
+                                    # ALWAYS decrement - relative update in one statement, no read-then-write race with POS sales
+                                    changes = self.adjust_local_stock(cursor, deltas)
+                                    for item_num, change in changes.items():
+                                        if change['new_stock'] < 0:
+                                            self.log(f"[WARN] Insufficient stock for item {item_num}. Had {change['old_stock']}, need {-deltas[item_num]}. Allowing negative stock.", "WARNING")
+                                    self.record_transfer(cursor, t['id'], 'out', deltas)
+                            except Exception as item_err:
+                                self.log(f"[ERROR] Failed to process outgoing items for transfer {t['id']}: {item_err}", "ERROR")
+                                all_items_ok = False
+                            
+                            if all_items_ok:
+                                self.sql_conn.commit()
+                                # Cache the ledger entry + queue Cloud Status -> in_transit. The local commit (stock + SQL
+                                # ledger) can't be undone, so a failed PATCH stays in the outbox instead of re-decrementing stock.
+                                metrics.count('rows_written', len(deltas))
+                                self.state.ledger_record(t['id'], 'out', deltas, outbox=[
+                                    ('transfer_status', {'method': 'PATCH', 'path': f'transfers?id=eq.{t["id"]}',
+                                                         'json': {'status': 'in_transit', 'shipped_at': datetime.now(timezone.utc).isoformat()}})
+                                ])
+                                self.flush_outbox()
+                                if applied_before:
+                                    self.log(f"[OK] Outgoing transfer {t['id']} already in the local ledger - status update only")
+                                else:
+                                    self.log(f"[OK] Processed outgoing transfer {t['id']}")
+                            else:
+                                self.sql_conn.rollback()
+                                self.log(f"[ERR] Skipped outgoing transfer {t['id']} due to item errors or insufficient stock.", "WARNING")
+                        
+                        except Exception as ex:
+                            self.log(f"[ERROR] Failed outgoing transfer {t['id']}: {ex}", "ERROR")
+            else:
+                 self.log(f"[WARN] Failed to fetch outgoing transfers: {res.status_code}", "ERROR")
+        except Exception as e:
+            self.log(f"[ERROR] Error processing outgoing transfers: {e}", "ERROR")
+
+    def start(self):
+        """Connect to SQL and load the checkpoint. Returns False if the database is unreachable."""
+        if not self.connect_sql():
+            return False
+
+        self.last_sync_time = self.load_last_sync()
+        self.log(f"[INFO] Last Sync Checkpoint: {self.last_sync_time}")
+        return True
+
+    def sync_transfers(self):
+        """Transfers phase - deliver anything left in the outbox first"""
+        self.flush_outbox()
+        self.process_transfers()
+        self.process_outgoing_transfers()
+
+    def sync_all_departments(self, last_sync):
+        """Departments phase: prime the Dept Map, push local changes FIRST, then pull new ones from cloud"""
+        departments = self.fetch_local_departments()  # Cached, re-read only when the Departments checksum changes
+        self.sync_departments(departments)
+        self.sync_down_departments(last_sync)
+
+    def metered(self, name, fn, *args):
+        with self.metrics.phase(name):
+            return fn(*args)
+
+    def run_phase(self, name, fn, *args):
+        """Run one phase under its watchdog budget, metered. Returns (completed, result)."""
+        self.current_phase = (name, time.time())
+        try:
+            completed, result, abandoned = self.watchdog.run(name, self.metered, name, fn, *args)
+        finally:
+            self.current_phase = None
+        if abandoned is not None:
+            # Cut the thread just abandoned off its SQL connection - the remaining phases get a fresh one.
+            # A phase skipped because an earlier thread is still stuck was cut off back then.
+            self.sql_conn.detach(abandoned)
+        return completed, result
+
+    def run_cycle(self):
+        """Run every sync phase once, then publish the cycle's metrics"""
+        self.cycle += 1
+        self.log(f"[INFO] --- Cycle #{self.cycle} ---")
+        self.metrics.begin_cycle()
+        error = "Cycle aborted"
+        try:
+            error = self.run_phases()
+        finally:
+            self.finish_cycle(error)
+
+    def finish_cycle(self, error=None):
+        """Close the cycle's metrics: gauges, one-line summary, sync_log row, Prometheus text file"""
+        try:
+            self.metrics.set_gauge('outbox_depth', self.state.outbox_depth())
+            self.metrics.set_gauge('carry_over_depth', self.state.queue_depth())
+            if self.sql_conn is not None:
+                for name, value in self.sql_conn.stats.items():
+                    self.metrics.set_gauge(f'sql_{name}', value)
+            self.metrics.set_gauge('watchdog_overruns', sum(self.watchdog.overruns.values()))
+        except Exception as e:
+            self.log(f"[WARN] Could not read metrics gauges: {e}", "WARNING")
+        summary = self.metrics.end_cycle()
+        self.last_cycle_error = error
+        self.log(f"[METRICS] Cycle #{self.cycle}: {self.metrics.summary_line(summary)}")
+        self.log_sync(summary, error)
+        if self.metrics_file:
+            try:
+                self.metrics.write_textfile(self.metrics_file)
+            except Exception as e:
+                self.log(f"[WARN] Could not write {self.metrics_file}: {e}", "WARNING")
+        return summary
+
+    # --- Status (status_server.py) - in-memory snapshots only, never SQL or the state store ---
+    def config_view(self):
+        """Effective settings, with secrets masked"""
+        view = {k: ('***' if k.lower() in ('supa_key', 'key', 'sql_password') or 'PASSWORD' in k.upper() else v)
+                for k, v in self.profile.items()}
+        view.update({
+            'supa_url': self.supa_url,
+            'sync_interval': self.sync_interval,
+            'phase_budgets': dict(self.watchdog.budgets),
+            'down_rows_per_cycle': self.down_rows_per_cycle,
+            'up_rows_per_cycle': self.up_rows_per_cycle,
+            'tombstones_per_cycle': self.tombstones_per_cycle,
+            'transfers_per_cycle': self.transfers_per_cycle,
+            'metrics_file': self.metrics_file,
+        })
+        return view
+
+    def health(self):
+        """Healthy = connected, no phase stuck, and a cycle finished recently enough"""
+        stale_after = 3 * self.sync_interval + sum(self.watchdog.budgets.values())
+        last = self.metrics.last_cycle
+        last_finished = last['finished_at'] if last else self.started_at
+        problems = []
+        if self.sql_conn is None:
+            problems.append('SQL Server not connected')
+        if self.watchdog.stuck:
+            problems.append(f"stuck phases: {', '.join(self.watchdog.stuck)}")
+        if time.time() - last_finished > stale_after:
+            problems.append(f"no cycle finished in {time.time() - last_finished:.0f}s")
+        if self.last_cycle_error:
+            problems.append(f"last cycle: {self.last_cycle_error}")
+        return {
+            'healthy': not problems,
+            'problems': problems,
+            'cycle': self.cycle,
+            'last_cycle_finished_at': datetime.fromtimestamp(last['finished_at'], timezone.utc).isoformat() if last else None,
+        }
+
+    def status(self):
+        phase = self.current_phase
+        with self.metrics.lock:
+            gauges = dict(self.metrics.gauges)
+            running = {name: dict(stats) for name, stats in self.metrics.cycle.items()}
+        return {
+            'health': self.health(),
+            'uptime_seconds': round(time.time() - self.started_at),
+            'cycle': self.cycle,
+            'current_phase': {'name': phase[0], 'running_seconds': round(time.time() - phase[1], 1)} if phase else None,
+            'running_cycle': running,
+            'last_cycle': self.metrics.last_cycle,
+            # Depths as of the end of the last cycle (reading them live would touch the state store)
+            'queues': {'outbox': gauges.get('outbox_depth'), 'carry_over': gauges.get('carry_over_depth')},
+            'sql_session': dict(self.sql_conn.stats) if self.sql_conn is not None else None,
+            'watchdog': {'overruns': dict(self.watchdog.overruns), 'stuck': list(self.watchdog.stuck)},
+            'config': self.config_view(),
+        }
+
+    def log_sync(self, summary, error=None):
+        """One sync_log row per cycle: real start / end, wall time and the per-phase breakdown"""
+        phases = {name: {k: round(v, 3) if isinstance(v, float) else v for k, v in stats.items()}
+                  for name, stats in summary['phases'].items()}
+        total = lambda field: sum(stats.get(field, 0) for stats in phases.values())
+        errors = total('errors')
+        status = 'failed' if error else 'completed'  # Skipped or aborted; errors inside phases don't fail the cycle
+        if error is None and errors:
+            error = ', '.join(f"{name}: {stats['errors']} errors" for name, stats in phases.items() if stats.get('errors'))
+        row = {
+            'store_id': self.store_id,
+            'sync_type': 'incremental',
+            'status': status,
+            'records_synced': total('rows_written'),
+            'error_message': error,
+            'started_at': datetime.fromtimestamp(summary['started_at'], timezone.utc).isoformat(),
+            'completed_at': datetime.fromtimestamp(summary['finished_at'], timezone.utc).isoformat(),
+            'duration_ms': int(summary['seconds'] * 1000),
+            'bytes_sent': total('bytes_sent'),
+            'bytes_received': total('bytes_received'),
+            'errors': errors,
+            'phases': phases,
+        }
+        headers = {'apikey': self.supa_key, 'Authorization': f'Bearer {self.supa_key}', 'Content-Type': 'application/json', 'Prefer': 'return=minimal'}
+        try:
+            res = self.http.post(f'{self.supa_url}/rest/v1/sync_log', headers=headers, json=row)
+            if res.status_code == 400:
+                # sync_log_metrics.sql not deployed yet - keep logging the basic row
+                for column in ('duration_ms', 'bytes_sent', 'bytes_received', 'errors', 'phases'):
+                    row.pop(column)
+                res = self.http.post(f'{self.supa_url}/rest/v1/sync_log', headers=headers, json=row)
+            if res.status_code not in [200, 201, 204]:
+                self.log(f"[WARN] sync_log insert failed: {res.status_code} {res.text[:200]}", "WARNING")
+        except Exception as e:
+            self.log(f"[WARN] Could not write sync_log: {e}", "WARNING")
+
+    def run_phases(self):
+        """Every sync phase once, each bounded by its time budget. Returns why the cycle was skipped, or None."""
+        if self.sql_conn is None and not self.connect_sql():
+            self.log("[WARN] Database unavailable, skipping cycle", "WARNING")
+            return "Database unavailable"
+        try:
+            self.sql_conn.connection()  # Liveness check / reconnect with backoff
+        except SqlUnavailable as e:
+            self.log(f"[WARN] {e} - skipping cycle", "WARNING")
+            return str(e)
+        
+        current_sync_start = datetime.now(timezone.utc).isoformat()
+
+        # 1. Transfers (High Priority)
+        self.run_phase('transfers', self.sync_transfers)
+
+        # 2. Departments (Up, then Down)
+        depts_done, _ = self.run_phase('departments', self.sync_all_departments, self.last_sync_time)
+        
+        # 3. Inventory (Down)
+        inv_done, inv_complete = self.run_phase('sync_down_inventory', self.sync_down_inventory, self.last_sync_time)
+        
+        # Update checkpoint - only if both down phases finished, otherwise the next cycle re-reads from the old one
+        if depts_done and inv_done and inv_complete:
+            self.save_last_sync(current_sync_start)
+            self.last_sync_time = current_sync_start
+
+        # 4. Transfers again - a reserved slot, so transfers never wait behind a full down + up backlog
+        self.run_phase('transfers', self.sync_transfers)
+
+        # 5. Inventory (Up)
+        self.run_phase('sync_inventory', lambda: self.sync_inventory(self.fetch_inventory()))
+        
+        # 6. Process Soft Deletes (tombstone feed, incremental)
+        self.run_phase('soft_deletes', self.process_soft_deletes)
+
+    def close(self):
+        if self.sql_conn:
+            try: self.sql_conn.close()
+            except: pass
+            self.sql_conn = None
+        self.state.close()
+
+    def run(self):
+        self.log(f" Starting {self.store_id} Agent - TWO-WAY SYNC ENABLED")
+        
+        if not self.start():
+            self.log("[STOP] EXITING: Database connection failed", "ERROR")
+            self.log("[ERROR] EXITING: Database connection failed", "ERROR")
+            input("Press Enter to exit...")
+            return
+
+        self.log("[INFO] Database Connected! Starting sync loop...")
+        status = start_status_server([self], self.profile, http=self.http, log=self.log)
+        
+        try:
+            while True:
+                self.run_cycle()
+                self.log(f" Waiting {self.sync_interval}s...")
+                time.sleep(self.sync_interval)
+        except KeyboardInterrupt:
+            self.log("⏹️ Agent stopped by user")
+        except Exception as e:
+            self.log(f"[ERROR] Agent crashed: {e}", "ERROR")
+        finally:
+            if status is not None:
+                status.stop()
+            self.close()
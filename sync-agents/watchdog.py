@@ -0,0 +1,99 @@
+"""
+Phase Watchdog
+==============
+Bounds the worst-case time of a sync cycle.
+
+Each phase runs in its own thread and gets a time budget. When a phase overruns:
+  1. its stack is dumped to the log (where exactly it hangs),
+  2. it is asked to stop (cancel event, checked by the paged loops between pages),
+  3. if it still hasn't returned after a short grace period it is abandoned - the
+     cycle moves on to the next phase and the stuck thread is left to die on its
+     own (HTTP / ODBC timeouts make sure it eventually does).
+
+A phase that is still running from an earlier cycle is skipped, never started twice.
+"""
+
+import sys
+import threading
+import time
+import traceback
+
+CANCEL_GRACE_SECONDS = 10  # How long an overrunning phase gets to notice the cancel flag
+
+
+class PhaseCancelled(BaseException):
+    """Raised by Watchdog.check() inside a phase whose budget has run out.
+    A BaseException so the phases' broad `except Exception` handlers don't swallow it."""
+
+
+class Watchdog:
+    def __init__(self, log, budgets: dict, default_budget: float = 120):
+        """log: callable(msg, level); budgets: phase name -> seconds"""
+        self.log = log
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.stuck = {}  # phase name -> thread still running after being abandoned
+        self.overruns = {}  # phase name -> count, for status/metrics
+
+    def budget(self, name):
+        return float(self.budgets.get(name, self.default_budget))
+
+    @staticmethod
+    def check():
+        """Call between units of work inside a phase; raises PhaseCancelled once its budget is gone.
+        A no-op outside a watched phase (e.g. when a phase is called directly)."""
+        cancel = getattr(threading.current_thread(), 'cancel_event', None)
+        if cancel is not None and cancel.is_set():
+            raise PhaseCancelled()
+
+    def run(self, name, fn, *args):
+        """Run one phase under its budget. Returns (completed, result, abandoned): completed is False if it overran
+        or was skipped; abandoned is the thread THIS call gave up on (None otherwise)."""
+        thread = self.stuck.get(name)
+        if thread is not None:
+            if thread.is_alive():
+                self.log(f"[WATCHDOG] Phase '{name}' is still stuck from an earlier cycle - skipping it", "WARNING")
+                return False, None, None
+            del self.stuck[name]
+
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = fn(*args)
+            except PhaseCancelled:
+                outcome['cancelled'] = True
+            except BaseException as e:
+                outcome['error'] = e
+
+        budget = self.budget(name)
+        started = time.monotonic()
+        thread = threading.Thread(target=target, name=f'phase-{name}', daemon=True)
+        thread.cancel_event = threading.Event()  # Per phase thread, so an abandoned thread keeps seeing its own flag
+        thread.start()
+        thread.join(budget)
+
+        overran = thread.is_alive()
+        if overran:
+            self.overruns[name] = self.overruns.get(name, 0) + 1
+            self.log(f"[WATCHDOG] Phase '{name}' exceeded its {budget:.0f}s budget - cancelling. Stack:\n"
+                     f"{self.stack_of(thread)}", "WARNING")
+            thread.cancel_event.set()
+            thread.join(CANCEL_GRACE_SECONDS)
+            if thread.is_alive():
+                self.stuck[name] = thread
+                self.log(f"[WATCHDOG] Phase '{name}' did not stop after {CANCEL_GRACE_SECONDS}s - abandoned", "ERROR")
+                return False, None, thread
+            self.log(f"[WATCHDOG] Phase '{name}' stopped after {time.monotonic() - started:.1f}s", "WARNING")
+
+        if 'error' in outcome:
+            raise outcome['error']
+        # A phase that was cancelled may have stopped part way - callers must not advance its checkpoint
+        return not overran, outcome.get('result'), None
+
+    @staticmethod
+    def stack_of(thread):
+        frame = sys._current_frames().get(thread.ident)
+        if frame is None:
+            return '  (no stack available)'
+        return ''.join(traceback.format_stack(frame))
@@ -33,18 +33,23 @@ def main():
             print("Invalid quantity")
             continue
             
-        print(f"\nCalling agent.update_local_stock('{item_num}', {qty}, 'subtract')...")
+        print(f"\nCalling agent.adjust_local_stock(cursor, {{'{item_num}': {-qty}}})...")
         
-        # Call the ACTUAL function used in production
-        result = agent.update_local_stock(item_num, qty, 'subtract')
+        # Call the ACTUAL function the transfer engine uses in production
+        conn = agent.get_sql_connection()
+        try:
+            result = agent.adjust_local_stock(conn.cursor(), {item_num: -qty})
+            conn.commit()
+        finally:
+            conn.close()
         
         print("\nRESULT:")
         print(result)
         
-        if result['success']:
+        if result:
             print("✅ Agent says SUCCESS")
         else:
-            print("❌ Agent says FAILURE")
+            print("❌ Agent says FAILURE (item not found)")
 
 if __name__ == "__main__":
     main()